@@ -0,0 +1,152 @@
+import argparse
+import sys
+import tracemalloc
+from dataclasses import dataclass
+
+import orjson
+
+from benchmarks.common import ensure_config, make_catalog, IMAGE_BASE_URL
+
+ensure_config()
+
+from movies.utils import decode_contents  # noqa: E402
+
+
+@dataclass(frozen=True)
+class _LegacyEpisode:
+    type: str = "episode"
+    episode_number: int = None
+    season_number: int = None
+    runtime: int = None
+    vote_average: float = None
+    title: str = None
+    file_url: str = None
+    still_url: str = None
+    episode_type: str = None
+    release_date: str = None
+
+
+@dataclass(frozen=True)
+class _LegacySeason:
+    type: str = "season"
+    season_number: int = None
+    episodes_count: int = None
+    vote_average: float = None
+    title: str = None
+    poster_url: str = None
+    release_date: str = None
+    episodes: tuple = None
+
+
+@dataclass(frozen=True)
+class _LegacyTVShow:
+    tmdb_id: int = None
+    vote_average: float = None
+    adult: bool = None
+    title: str = None
+    og_title: str = None
+    homepage: str = None
+    poster_url: str = None
+    backdrop_url: str = None
+    release_date: str = None
+    genres: tuple = None
+    type: str = "tv"
+    number_of_episodes: int = None
+    number_of_seasons: int = None
+    in_production: bool = None
+    seasons: tuple = None
+
+
+def _legacy_url(path: str | None) -> str | None:
+    return f"{IMAGE_BASE_URL}original{path}" if path else None
+
+
+def _legacy_decode(raw_contents: list[dict]) -> list:
+    contents = []
+    for raw in raw_contents:
+        seasons = []
+        for raw_season in raw["seasons"]:
+            episodes = tuple(
+                _LegacyEpisode(
+                    type=e["type"],
+                    episode_number=e["episode_number"],
+                    season_number=e["season_number"],
+                    runtime=e["runtime"],
+                    vote_average=e["vote_average"],
+                    title=e["title"],
+                    file_url=e["file_url"],
+                    still_url=_legacy_url(e["still_path"]),
+                    episode_type=e["episode_type"],
+                    release_date=e["release_date"],
+                )
+                for e in raw_season["episodes"]
+            )
+            seasons.append(_LegacySeason(
+                type=raw_season["type"],
+                season_number=raw_season["season_number"],
+                episodes_count=raw_season["episodes_count"],
+                vote_average=raw_season["vote_average"],
+                title=raw_season["title"],
+                poster_url=_legacy_url(raw_season["poster_path"]),
+                release_date=raw_season["release_date"],
+                episodes=episodes,
+            ))
+        contents.append(_LegacyTVShow(
+            tmdb_id=raw["tmdb_id"],
+            vote_average=raw["vote_average"],
+            adult=raw["adult"],
+            title=raw["title"],
+            og_title=raw["og_title"],
+            homepage=raw["homepage"],
+            poster_url=_legacy_url(raw["poster_path"]),
+            backdrop_url=_legacy_url(raw["backdrop_path"]),
+            release_date=raw["release_date"],
+            genres=tuple(raw["genres"]),
+            type=raw["type"],
+            number_of_episodes=raw["number_of_episodes"],
+            number_of_seasons=raw["number_of_seasons"],
+            in_production=raw["in_production"],
+            seasons=tuple(seasons),
+        ))
+    return contents
+
+
+def _measure_retained(decoder, file_content: bytes) -> int:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    raw_contents = orjson.loads(file_content)
+    contents = decoder(raw_contents)
+    del raw_contents
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert contents
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure retained catalog memory per episode")
+    parser.add_argument("--shows", type=int, default=100)
+    parser.add_argument("--seasons", type=int, default=5)
+    parser.add_argument("--episodes", type=int, default=20)
+    args = parser.parse_args()
+
+    catalog = make_catalog(0, args.shows, args.seasons, args.episodes)
+    file_content = orjson.dumps(catalog)
+    del catalog
+
+    total_episodes = args.shows * args.seasons * args.episodes
+    legacy_bytes = _measure_retained(_legacy_decode, file_content)
+    current_bytes = _measure_retained(decode_contents, file_content)
+
+    sys.stdout.buffer.write(orjson.dumps({
+        "episodes": total_episodes,
+        "legacy_bytes_per_episode": round(legacy_bytes / total_episodes, 1),
+        "current_bytes_per_episode": round(current_bytes / total_episodes, 1),
+        "saving_percent": round(100 * (1 - current_bytes / legacy_bytes), 1),
+    }, option=orjson.OPT_INDENT_2))
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
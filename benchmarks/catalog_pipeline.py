@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+import aiohttp
+import orjson
+from aiohttp import web
+
+from benchmarks.common import ensure_config, IMAGE_BASE_URL
+
+ensure_config()
+
+import config  # noqa: E402
+import movies.tmdb as tmdb  # noqa: E402
+import movies.yandex_disk as yandex_disk  # noqa: E402
+from movies.db import MoviesDB  # noqa: E402
+from movies.hedging import LATENCY_TRACKER  # noqa: E402
+from yndx_disk.classes import Directory, File  # noqa: E402
+
+_FILE_SIZE = 1_500_000_000
+_MODIFIED_AT = "2024-01-01T00:00:00+00:00"
+
+
+def _show_ids(args) -> range:
+    return range(args.movies + 1, args.movies + args.shows + 1)
+
+
+class _TMDBServer:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.responses = Counter()
+        self._tokens = float(args.tmdb_rate_limit)
+        self._refilled_at = time.monotonic()
+
+    def _rate_limited(self) -> bool:
+        if not self.args.tmdb_rate_limit:
+            return False
+
+        now = time.monotonic()
+        self._tokens = min(self.args.tmdb_rate_limit,
+                           self._tokens + (now - self._refilled_at) * self.args.tmdb_rate_limit)
+        self._refilled_at = now
+        if self._tokens < 1:
+            return True
+        self._tokens -= 1
+        return False
+
+    def _episode(self, tmdb_id: int, season_number: int, episode_number: int) -> dict:
+        return {
+            "episode_number": episode_number,
+            "name": f"Episode {episode_number}",
+            "runtime": 45,
+            "vote_average": 8.1,
+            "still_path": f"/still_{tmdb_id:06d}_{season_number:02d}_{episode_number:03d}.jpg",
+            "episode_type": "standard",
+            "air_date": "2010-05-17",
+        }
+
+    def _season(self, tmdb_id: int, season_number: int) -> dict:
+        return {
+            "season_number": season_number,
+            "name": f"Season {season_number}",
+            "vote_average": 8.0,
+            "poster_path": f"/season_{tmdb_id:06d}_{season_number:02d}.jpg",
+            "air_date": "2010-05-17",
+            "episodes": [self._episode(tmdb_id, season_number, e) for e in range(1, self.args.episodes + 1)],
+        }
+
+    def _body(self, request: web.Request) -> dict:
+        kind = request.match_info["kind"]
+        if kind == "configuration":
+            return {"images": {"base_url": IMAGE_BASE_URL}}
+
+        tmdb_id = int(request.match_info["tmdb_id"])
+        if kind == "movie":
+            return {
+                "title": f"Movie {tmdb_id}",
+                "original_title": f"Original Movie {tmdb_id}",
+                "budget": 10_000_000,
+                "runtime": 110,
+                "vote_average": 7.5,
+                "adult": False,
+                "homepage": f"https://example.com/movie/{tmdb_id}",
+                "poster_path": f"/poster_movie_{tmdb_id:08d}.jpg",
+                "backdrop_path": f"/backdrop_movie_{tmdb_id:08d}.jpg",
+                "release_date": "2001-01-01",
+                "genres": [{"name": "drama"}, {"name": "comedy"}],
+            }
+
+        body = {
+            "name": f"Show {tmdb_id}",
+            "original_name": f"Original Show {tmdb_id}",
+            "vote_average": 8.3,
+            "adult": False,
+            "homepage": f"https://example.com/tv/{tmdb_id}",
+            "poster_path": f"/poster_tv_{tmdb_id:08d}.jpg",
+            "backdrop_path": f"/backdrop_tv_{tmdb_id:08d}.jpg",
+            "first_air_date": "2010-05-17",
+            "in_production": False,
+            "genres": [{"name": "drama"}],
+        }
+        for appended in filter(None, request.query.get("append_to_response", "").split(",")):
+            body[appended] = self._season(tmdb_id, int(appended.removeprefix("season/")))
+        return body
+
+    async def handle(self, request: web.Request) -> web.Response:
+        latency = self.args.tmdb_latency_ms + self.random.uniform(-1, 1) * self.args.tmdb_jitter_ms
+        await asyncio.sleep(max(0.0, latency) / 1000)
+
+        if self._rate_limited():
+            status = 429
+        elif self.random.random() < self.args.tmdb_error_rate:
+            status = 500
+        else:
+            status = 200
+
+        self.responses[status] += 1
+        if status != 200:
+            return web.Response(status=status, headers={"Retry-After": "1"} if status == 429 else None)
+        return web.Response(body=orjson.dumps(self._body(request)), content_type="application/json")
+
+    async def stats(self, _: web.Request) -> web.Response:
+        return web.Response(body=orjson.dumps({str(status): count for status, count in self.responses.items()}),
+                            content_type="application/json")
+
+
+def _serve_tmdb(args, ports: multiprocessing.Queue):
+    # The server lives in its own process, so it neither competes for the event loop nor shows up in memory numbers
+    async def serve():
+        server = _TMDBServer(args)
+        app = web.Application()
+        app.router.add_get("/stats", server.stats)
+        app.router.add_get("/3/{kind:configuration}", server.handle)
+        app.router.add_get("/3/{kind:movie|tv}/{tmdb_id}", server.handle)
+
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        ports.put(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+class _FakeDiskClient:
+    listdir_count = 0
+    latency = 0.0
+    libraries: dict[str, list[File | Directory]] = {}
+    shows: dict[str, list[File]] = {}
+
+    def __init__(self, token: str, auto_update_info: bool = True, session=None):
+        self.token = token
+
+    async def listdir(self, path: str, limit: int = 100) -> list[File | Directory]:
+        _FakeDiskClient.listdir_count += 1
+        await asyncio.sleep(self.latency)
+        return self.libraries[path] if path in self.libraries else self.shows[path]
+
+
+def _make_file(token: str, path: str, name: str) -> File:
+    return File(token=token, created_at=_MODIFIED_AT, modified_at=_MODIFIED_AT, name=name, path=f"{path}/{name}",
+                resource_id=f"{path}/{name}", revision=1, size=_FILE_SIZE,
+                file_url=f"https://downloader.disk.yandex.ru/disk/{hash(path + name):x}?filename={name}")
+
+
+def _install_fake_disks(args):
+    config.YANDEX_CONFIGS = [(f"token-{d}", f"disk:/library-{d}") for d in range(args.disks)]
+
+    libraries = {path: [] for _, path in config.YANDEX_CONFIGS}
+    shows = {}
+    for tmdb_id in range(1, args.movies + args.shows + 1):
+        token, path = config.YANDEX_CONFIGS[tmdb_id % args.disks]
+        if tmdb_id <= args.movies:
+            libraries[path].append(_make_file(token, path, f"movie#{tmdb_id}#Movie {tmdb_id}.mp4"))
+            continue
+
+        name = f"tv#{tmdb_id}#Show {tmdb_id}"
+        libraries[path].append(Directory(token=token, created_at=_MODIFIED_AT, modified_at=_MODIFIED_AT, name=name,
+                                         path=f"{path}/{name}", resource_id=f"{path}/{name}", revision=1))
+        shows[f"{path}/{name}"] = [_make_file(token, f"{path}/{name}", f"{s}#{e}.mp4")
+                                   for s in range(1, args.seasons + 1) for e in range(1, args.episodes + 1)]
+
+    _FakeDiskClient.libraries = libraries
+    _FakeDiskClient.shows = shows
+    _FakeDiskClient.latency = args.disk_latency_ms / 1000
+    yandex_disk.AsyncDiskClient = _FakeDiskClient
+
+
+def _reset(db: MoviesDB):
+    for function in (tmdb._fetch_tmdb_configuration, tmdb._fetch_movie, tmdb._fetch_tv_show):
+        function.cache.clear()
+    yandex_disk.PARSE_CACHE = yandex_disk.ParseCache(max_size=config.YANDEX_DISK_PARSE_CACHE_SIZE,
+                                                     max_age=config.YANDEX_DISK_PARSE_CACHE_MAX_AGE_SECONDS)
+    db.contents = []
+    db.shards = {}
+    db._failed_accounts.clear()
+    db._failed_items.clear()
+
+
+async def _update(db: MoviesDB) -> dict:
+    tmdb_requests = tmdb._requests_count
+    listdir_requests = _FakeDiskClient.listdir_count
+    hedges = sum(LATENCY_TRACKER.hedges.values())
+
+    start = time.perf_counter()
+    await db.update()
+    seconds = time.perf_counter() - start
+
+    return {
+        "seconds": round(seconds, 3),
+        "tmdb_requests": tmdb._requests_count - tmdb_requests,
+        "listdir_requests": _FakeDiskClient.listdir_count - listdir_requests,
+        "hedged_requests": sum(LATENCY_TRACKER.hedges.values()) - hedges,
+        "contents": len(db.contents),
+        "failed_contents": len(db._failed_items),
+        "failed_disks": len(db._failed_accounts),
+    }
+
+
+async def _timed(coroutine) -> float:
+    start = time.perf_counter()
+    await coroutine
+    return round(time.perf_counter() - start, 3)
+
+
+async def _peak_memory(coroutine) -> float:
+    tracemalloc.start()
+    try:
+        await coroutine
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024 / 1024, 2)
+
+
+async def _run(args, port: int, db_path: Path) -> dict:
+    tmdb._BASE_API_URL = f"http://127.0.0.1:{port}/3"
+    db = MoviesDB(db_path=db_path)
+
+    cold = await _update(db)
+    warm = await _update(db)
+    save_seconds = await _timed(db.save_to_disk())
+    _reset(db)
+    load_seconds = await _timed(db.load_from_disk())
+
+    # tracemalloc slows everything down several times, so memory is measured in a separate pass
+    _reset(db)
+    update_memory = await _peak_memory(db.update())
+    _reset(db)
+    load_memory = await _peak_memory(db.load_from_disk())
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{port}/stats") as response:
+            tmdb_responses = await response.json()
+
+    return {
+        "update_cold": {**cold, "peak_memory_mb": update_memory},
+        "update_warm": warm,
+        "save_to_disk": {"seconds": save_seconds, "file_size_mb": round(db_path.stat().st_size / 1024 / 1024, 2)},
+        "load_from_disk": {"seconds": load_seconds, "peak_memory_mb": load_memory},
+        "tmdb_responses": tmdb_responses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the catalog refresh against a fake Yandex Disk and a "
+                                                 "local TMDB server")
+    parser.add_argument("--movies", type=int, default=1000)
+    parser.add_argument("--shows", type=int, default=100)
+    parser.add_argument("--seasons", type=int, default=5)
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--disks", type=int, default=2)
+    parser.add_argument("--disk-latency-ms", type=float, default=50)
+    parser.add_argument("--tmdb-latency-ms", type=float, default=30)
+    parser.add_argument("--tmdb-jitter-ms", type=float, default=10)
+    parser.add_argument("--tmdb-error-rate", type=float, default=0.0, help="share of TMDB requests answered with 500")
+    parser.add_argument("--tmdb-rate-limit", type=float, default=0,
+                        help="TMDB requests per second before answering 429, 0 for no limit")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config.ENABLE_TRACING = False
+    _install_fake_disks(args)
+
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve_tmdb, args=(args, ports), daemon=True)
+    server.start()
+    try:
+        port = ports.get(timeout=30)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result = asyncio.run(_run(args, port, Path(tmp_dir) / "movies_db.json"))
+    finally:
+        server.terminate()
+        server.join()
+
+    sys.stdout.buffer.write(orjson.dumps({
+        "library": {
+            "movies": args.movies,
+            "shows": args.shows,
+            "episodes": args.shows * args.seasons * args.episodes,
+            "disks": args.disks,
+        },
+        "tmdb": {
+            "latency_ms": args.tmdb_latency_ms,
+            "jitter_ms": args.tmdb_jitter_ms,
+            "error_rate": args.tmdb_error_rate,
+            "rate_limit": args.tmdb_rate_limit,
+        },
+        **result,
+    }, option=orjson.OPT_INDENT_2))
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
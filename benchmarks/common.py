@@ -0,0 +1,97 @@
+import importlib.machinery
+import importlib.util
+import sys
+from pathlib import Path
+
+_ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def ensure_config():
+    if str(_ROOT_DIR) not in sys.path:
+        sys.path.insert(0, str(_ROOT_DIR))
+
+    try:
+        import config  # noqa: F401
+    except ModuleNotFoundError:
+        loader = importlib.machinery.SourceFileLoader("config", str(_ROOT_DIR / "config.py.example"))
+        spec = importlib.util.spec_from_loader("config", loader)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules["config"] = module
+
+
+IMAGE_BASE_URL = "https://image.tmdb.org/t/p/"
+
+
+def make_catalog(movies: int, shows: int, seasons: int, episodes: int) -> list:
+    import movies.images as images
+    from movies.classes import Movie, TVShow, Season, Episode
+
+    images.set_base_url(IMAGE_BASE_URL)
+
+    contents = []
+    for i in range(movies):
+        contents.append(Movie(
+            tmdb_id=i + 1,
+            vote_average=7.5,
+            adult=False,
+            title=f"Movie {i}",
+            og_title=f"Original Movie {i}",
+            homepage=f"https://example.com/movie/{i}",
+            poster_path=f"/poster_movie_{i:08d}.jpg",
+            backdrop_path=f"/backdrop_movie_{i:08d}.jpg",
+            release_date="2001-01-01",
+            genres=("Drama", "Comedy"),
+            file_size=1_500_000_000,
+            budget=10_000_000,
+            runtime=110,
+            file_url=(f"https://downloader.disk.yandex.ru/disk/{i:064x}"
+                      f"?uid=0&filename=movie_{i}.mp4&disposition=attachment"),
+        ))
+
+    for i in range(shows):
+        tmdb_id = movies + i + 1
+        show_seasons = []
+        for s in range(1, seasons + 1):
+            show_episodes = tuple(
+                Episode(
+                    episode_number=e,
+                    season_number=s,
+                    runtime=45,
+                    vote_average=8.1,
+                    title=f"Episode {e}",
+                    file_url=(f"https://downloader.disk.yandex.ru/disk/{tmdb_id:032x}{s:016x}{e:016x}"
+                              f"?uid=0&filename={s}%23{e}.mp4&disposition=attachment"),
+                    still_path=f"/still_{tmdb_id:06d}_{s:02d}_{e:03d}.jpg",
+                    episode_type="standard",
+                    release_date="2010-05-17",
+                )
+                for e in range(1, episodes + 1)
+            )
+            show_seasons.append(Season(
+                season_number=s,
+                episodes_count=episodes,
+                vote_average=8.0,
+                title=f"Season {s}",
+                poster_path=f"/season_{tmdb_id:06d}_{s:02d}.jpg",
+                release_date="2010-05-17",
+                episodes=show_episodes,
+            ))
+        contents.append(TVShow(
+            tmdb_id=tmdb_id,
+            vote_average=8.3,
+            adult=False,
+            title=f"Show {i}",
+            og_title=f"Original Show {i}",
+            homepage=f"https://example.com/tv/{i}",
+            poster_path=f"/poster_tv_{i:08d}.jpg",
+            backdrop_path=f"/backdrop_tv_{i:08d}.jpg",
+            release_date="2010-05-17",
+            genres=("Drama", "Sci-Fi & Fantasy"),
+            number_of_episodes=seasons * episodes,
+            number_of_seasons=seasons,
+            in_production=False,
+            seasons=tuple(show_seasons),
+        ))
+
+    return contents
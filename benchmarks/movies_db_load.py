@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import orjson
+
+from benchmarks.common import ensure_config, make_catalog
+
+ensure_config()
+
+from movies.classes import Movie, TVShow  # noqa: E402
+from movies.db import MoviesDB, _decode_db  # noqa: E402
+
+
+def _legacy_decode(file_content: bytes) -> list:
+    loaded_db = orjson.loads(file_content)
+    contents = []
+    for content in loaded_db.get("contents", []):
+        match content["type"]:
+            case "movie":
+                contents.append(Movie(**content))
+            case "tv":
+                contents.append(TVShow(**content))
+    return contents
+
+
+async def _load(db: MoviesDB):
+    db.contents = []
+    await db.load_from_disk()
+
+
+def _measure(func, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "min_seconds": round(min(timings), 4),
+        "median_seconds": round(statistics.median(timings), 4),
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading of movies_db.json")
+    parser.add_argument("--movies", type=int, default=2000)
+    parser.add_argument("--shows", type=int, default=250)
+    parser.add_argument("--seasons", type=int, default=10)
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = Path(tmp_dir) / "movies_db.json"
+        db = MoviesDB(db_path=db_path)
+        db.contents = make_catalog(args.movies, args.shows, args.seasons, args.episodes)
+        asyncio.run(db.save_to_disk())
+        file_content = db_path.read_bytes()
+
+        new_results = _measure(lambda: asyncio.run(_load(db)), args.repeat)
+        decode_results = _measure(lambda: _decode_db(file_content), args.repeat)
+        legacy_results = _measure(lambda: _legacy_decode(file_content), args.repeat)
+
+        episode = db.contents[-1].seasons[0].episodes[0]
+        assert episode.file_url, "episodes were not reconstructed"
+
+    sys.stdout.buffer.write(orjson.dumps({
+        "movies": args.movies,
+        "episodes": args.shows * args.seasons * args.episodes,
+        "file_size_mb": round(len(file_content) / 1024 / 1024, 2),
+        "load_from_disk": new_results,
+        "decode": decode_results,
+        "legacy_decode": legacy_results,
+    }, option=orjson.OPT_INDENT_2))
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
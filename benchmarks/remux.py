@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+import orjson
+from aiohttp import web
+
+from benchmarks.common import ensure_config
+
+ensure_config()
+
+import config  # noqa: E402
+import movies.media_probe as media_probe  # noqa: E402
+from movies.remux import RemuxCache, PLAYLIST_NAME, INIT_SEGMENT_NAME  # noqa: E402
+
+_FIRST_READ_BYTES = 1024 * 1024
+
+
+def _make_input(ffmpeg: str, path: Path, duration: int):
+    # ffmpeg writes the moov box at the end unless asked for fast start, like most files found on disks
+    subprocess.run([
+        ffmpeg, "-nostdin", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", "testsrc=size=640x360:rate=25",
+        "-f", "lavfi", "-i", "sine=frequency=440",
+        "-t", str(duration),
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", "50", "-c:a", "aac",
+        str(path),
+    ], check=True)
+
+
+async def _serve(path: Path) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/{name}", lambda request: web.FileResponse(path))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+
+async def _read(session: aiohttp.ClientSession, url: str, start: int, end: int) -> int:
+    async with session.get(url, headers={"Range": f"bytes={start}-{end}"}) as response:
+        return len(await response.read())
+
+
+async def _direct(url: str, file_size: int) -> dict:
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        media = await media_probe.probe(session, url, file_size)
+        await _read(session, url, 0, _FIRST_READ_BYTES - 1)
+        ttff = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await _read(session, url, file_size // 2, file_size // 2 + _FIRST_READ_BYTES - 1)
+        seek = time.perf_counter() - start
+
+    return {"fast_start": media.fast_start, "ttff_ms": round(ttff * 1000, 1), "seek_ms": round(seek * 1000, 1)}
+
+
+def _segment_at(playlist: str, position: float) -> str | None:
+    elapsed = 0.0
+    duration = None
+    for line in playlist.splitlines():
+        if line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(",")[0])
+        elif line and not line.startswith("#") and duration is not None:
+            if elapsed + duration > position:
+                return line
+            elapsed += duration
+    return None
+
+
+async def _remuxed(cache: RemuxCache, url: str, file_size: int, seek_position: float) -> dict:
+    start = time.perf_counter()
+    playlist_path = await cache.get("1", PLAYLIST_NAME, url, file_size)
+    await cache.get("1", INIT_SEGMENT_NAME, url, file_size)
+    first_segment = _segment_at(playlist_path.read_text(), 0)
+    await cache.get("1", first_segment, url, file_size)
+    ttff = time.perf_counter() - start
+
+    # A seek can only land on a segment that the event playlist already lists
+    start = time.perf_counter()
+    while (segment := _segment_at(playlist_path.read_text(), seek_position)) is None:
+        await asyncio.sleep(0.05)
+    await cache.get("1", segment, url, file_size)
+    seek = time.perf_counter() - start
+
+    return {"ttff_ms": round(ttff * 1000, 1), "seek_ms": round(seek * 1000, 1)}
+
+
+async def _run(args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+
+        input_path = Path(args.input) if args.input else tmp_dir / "input.mp4"
+        if not args.input:
+            _make_input(args.ffmpeg, input_path, args.duration)
+        file_size = input_path.stat().st_size
+
+        runner = await _serve(input_path)
+        port = runner.addresses[0][1]
+        url = f"http://127.0.0.1:{port}/{input_path.name}"
+
+        try:
+            direct = await _direct(url, file_size)
+
+            async with aiohttp.ClientSession() as session:
+                media = await media_probe.probe(session, url, file_size)
+            seek_position = (media.duration or args.duration) / 2
+
+            cache = RemuxCache(cache_dir=tmp_dir / "remux", max_bytes=file_size * 4, ffmpeg_path=args.ffmpeg)
+            await cache.load_from_disk()
+
+            remux_start = time.perf_counter()
+            cold = await _remuxed(cache, url, file_size, seek_position)
+            while cache.remuxing:
+                await asyncio.sleep(0.05)
+            remux_seconds = time.perf_counter() - remux_start
+
+            warm = await _remuxed(cache, url, file_size, seek_position)
+        finally:
+            await runner.cleanup()
+
+    return {
+        "file_size": file_size,
+        "duration": media.duration,
+        "direct": direct,
+        "remux_cold": cold,
+        "remux_warm": warm,
+        "remux_total_seconds": round(remux_seconds, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark time to first frame and seek latency with and without "
+                                                 "HLS remuxing")
+    parser.add_argument("--input", help="video file to serve, a synthetic one is generated if omitted")
+    parser.add_argument("--duration", type=int, default=300, help="duration of the synthetic video in seconds")
+    parser.add_argument("--ffmpeg", default=shutil.which(config.FFMPEG_PATH) or config.FFMPEG_PATH)
+    parser.add_argument("--segment-seconds", type=int, default=config.REMUX_SEGMENT_SECONDS)
+    args = parser.parse_args()
+
+    config.REMUX_SEGMENT_SECONDS = args.segment_seconds
+
+    result = asyncio.run(_run(args))
+
+    sys.stdout.buffer.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
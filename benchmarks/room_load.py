@@ -0,0 +1,457 @@
+import argparse
+import ast
+import asyncio
+import html
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+from urllib.parse import urlencode
+
+import aiohttp
+import orjson
+import socketio
+
+from benchmarks.common import ensure_config, make_catalog
+
+ensure_config()
+
+import config  # noqa: E402
+
+_SOCKET_IO_PATH = "/_nicegui_ws/socket.io"
+_ACK_INTERVAL_SECONDS = 3
+_STARTUP_TIMEOUT_SECONDS = 60
+_ADMIN_TOKEN = "room-load"
+_ROOT_DIR = Path(__file__).resolve().parent.parent
+
+_QUERY_RE = re.compile(r"query: (\{.*?}),\n")
+_ELEMENTS_RE = re.compile(r"parseElements\(String\.raw`(.*?)`\)", re.S)
+_PLAYER_EVENT_RE = re.compile(r"player\.on\('(\w+)', \(\) => emitEvent\('(\w+)'\)\)")
+_SEEK_RE = re.compile(r"\.currentTime = ([-+\d.eE]+);")
+
+
+class _Player:
+    def __init__(self):
+        self.playing = False
+        self._position = 0.0
+        self._since = time.monotonic()
+
+    @property
+    def position(self) -> float:
+        if self.playing:
+            return self._position + time.monotonic() - self._since
+        return self._position
+
+    def _settle(self):
+        self._position = self.position
+        self._since = time.monotonic()
+
+    def play(self):
+        self._settle()
+        self.playing = True
+
+    def pause(self):
+        self._settle()
+        self.playing = False
+
+    def seek(self, position: float):
+        self._position = max(0.0, position)
+        self._since = time.monotonic()
+
+
+class _SimulatedClient:
+    def __init__(self, args, base_url: str, name: str, host: bool, stats: Counter):
+        self.args = args
+        self.base_url = base_url
+        self.room_uid = None
+        self.name = name
+        self.host = host
+        self.stats = stats
+
+        self.random = random.Random(f"{args.seed}:{name}")
+        self.player = _Player()
+        self.session: aiohttp.ClientSession | None = None
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.client_id = None
+        self.next_message_id = 0
+        self.elements: dict[str, dict] = {}
+        self.player_events: dict[str, str] = {}
+
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._deliver_at = 0.0
+
+    def _delay(self) -> float:
+        latency = self.args.latency_ms + self.random.uniform(-1, 1) * self.args.jitter_ms
+        return max(0.0, latency) / 1000
+
+    async def _emit(self, event: str, data: dict):
+        await asyncio.sleep(self._delay())
+        if self.sio.connected:
+            self.stats["messages_sent"] += 1
+            await self.sio.emit(event, data)
+
+    def _receive(self, event: str, message: dict):
+        self.stats["messages_received"] += 1
+        if (message_id := message.pop("_id", None)) is not None:
+            if message_id < self.next_message_id:
+                return
+            self.next_message_id = message_id + 1
+
+        # Messages keep their order, like on a real socket, however much jitter each of them gets
+        self._deliver_at = max(time.monotonic() + self._delay(), self._deliver_at)
+        self._inbox.put_nowait((self._deliver_at, event, message))
+
+    async def _process_inbox(self):
+        while True:
+            deliver_at, event, message = await self._inbox.get()
+            await asyncio.sleep(max(0.0, deliver_at - time.monotonic()))
+            if event == "update":
+                for element_id, element in message.items():
+                    if element is None:
+                        self.elements.pop(element_id, None)
+                    else:
+                        self.elements[element_id] = element
+            elif event == "run_javascript":
+                await self._run_javascript(message["code"], message.get("request_id"))
+
+    def _player_event(self, player_event: str):
+        # Plyr events are global NiceGUI events, which the server listens to on the layout element
+        if (event_name := self.player_events.get(player_event)) is None:
+            return
+        for listener in self.elements.get("0", {}).get("events", []):
+            if listener["type"] == event_name:
+                asyncio.create_task(self._emit("event", {"id": 0, "client_id": self.client_id,
+                                                         "listener_id": listener["listener_id"], "args": []}))
+                return
+
+    async def _run_javascript(self, code: str, request_id: str | None):
+        self.stats["javascript_calls"] += 1
+        result = None
+
+        if "new Plyr(" in code:
+            self.player_events = dict(_PLAYER_EVENT_RE.findall(code))
+        elif "availWidth" in code:
+            result = [1920, 1080]
+        elif ".currentTime;" in code:
+            result = self.player.position
+        elif code.rstrip().endswith(".seeking"):
+            result = False
+        elif ".play();" in code:
+            if not self.player.playing:
+                self.player.play()
+                self._player_event("play")
+        elif ".pause();" in code:
+            if self.player.playing:
+                self.player.pause()
+                self._player_event("pause")
+        elif match := _SEEK_RE.search(code):
+            self.player.seek(float(match.group(1)))
+            self._player_event("seeked")
+        elif "player.source = " in code:
+            self.player.pause()
+            self.player.seek(0)
+
+        if request_id is not None:
+            asyncio.create_task(self._emit("javascript_response", {"request_id": request_id,
+                                                                   "client_id": self.client_id, "result": result}))
+
+    async def _ack(self):
+        while True:
+            await asyncio.sleep(_ACK_INTERVAL_SECONDS)
+            await self._emit("ack", {"client_id": self.client_id, "next_message_id": self.next_message_id})
+
+    async def _act(self):
+        # One viewer per room starts playback and then seeks around now and then, like someone skipping an intro
+        await asyncio.sleep(1)
+        self.player.play()
+        self._player_event("play")
+
+        while self.args.seek_interval:
+            await asyncio.sleep(self.random.expovariate(1 / self.args.seek_interval))
+            self.player.seek(self.player.position + self.random.uniform(-30, 120))
+            self._player_event("seeked")
+            self.stats["user_seeks"] += 1
+
+    async def login(self):
+        self.session = aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True))
+        async with self.session.get(f"{self.base_url}/_load_test/login", params={"username": self.name}) as response:
+            response.raise_for_status()
+
+    async def _connect(self):
+        async with self.session.get(f"{self.base_url}/room/{self.room_uid}") as response:
+            response.raise_for_status()
+            page = await response.text()
+
+        # The template renders the socket.io query as a Python dict literal
+        query = ast.literal_eval(_QUERY_RE.search(page).group(1))
+        self.elements = orjson.loads(html.unescape(_ELEMENTS_RE.search(page).group(1)))
+        self.client_id = query["client_id"]
+        self.next_message_id = query["next_message_id"]
+
+        self.sio.on("update", lambda message: self._receive("update", message))
+        self.sio.on("run_javascript", lambda message: self._receive("run_javascript", message))
+        for event in ("notify", "open", "download"):
+            self.sio.on(event, lambda message, event=event: self._receive(event, message))
+
+        cookies = "; ".join(f"{cookie.key}={cookie.value}" for cookie in self.session.cookie_jar)
+        await self.sio.connect(f"{self.base_url}?{urlencode(query)}", socketio_path=_SOCKET_IO_PATH,
+                               transports=["websocket"], headers={"Cookie": cookies})
+        handshake = {
+            "client_id": self.client_id,
+            "document_id": str(uuid.uuid4()),
+            "tab_id": str(uuid.uuid4()),
+            "old_tab_id": None,
+            "next_message_id": self.next_message_id,
+        }
+        if not await self.sio.call("handshake", handshake, timeout=10):
+            raise RuntimeError("handshake was rejected")
+
+    async def run(self, stop: asyncio.Event):
+        tasks = []
+        try:
+            await self._connect()
+            self.stats["clients_connected"] += 1
+
+            tasks = [asyncio.create_task(self._process_inbox()), asyncio.create_task(self._ack())]
+            if self.host:
+                tasks.append(asyncio.create_task(self._act()))
+
+            await stop.wait()
+            await self.sio.disconnect()
+        except Exception as e:
+            self.stats["clients_failed"] += 1
+            print(f"{self.name} failed: {e!r}", file=sys.stderr)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.session.close()
+
+
+def _parse_metrics(text: str) -> dict[str, float]:
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            samples[series] = float(value)
+    return samples
+
+
+def _histogram(before: dict, after: dict, name: str) -> dict:
+    # Label sets other than le are summed, the load test looks at the whole process
+    buckets = defaultdict(float)
+    for series, value in after.items():
+        if series.startswith(f"{name}_bucket{{"):
+            le = series.rsplit("le=\"", 1)[1].split("\"", 1)[0]
+            buckets[float(le)] += value - before.get(series, 0)
+
+    count = buckets.get(float("inf"), 0)
+    total = sum(value - before.get(series, 0) for series, value in after.items()
+                if series.startswith(f"{name}_sum"))
+
+    def quantile(q: float) -> float | str | None:
+        for bound in sorted(buckets):
+            if buckets[bound] >= q * count:
+                return bound if bound != float("inf") else "+Inf"
+        return None
+
+    return {
+        "count": int(count),
+        "mean": round(total / count, 4) if count else None,
+        "p50_le": quantile(0.5) if count else None,
+        "p95_le": quantile(0.95) if count else None,
+        "p99_le": quantile(0.99) if count else None,
+        "buckets": {str(bound): int(value) for bound, value in sorted(buckets.items())},
+    }
+
+
+def _counter(before: dict, after: dict, name: str) -> dict:
+    deltas = {series.removeprefix(name): int(value - before.get(series, 0))
+              for series, value in after.items() if series.startswith(name) and not series.startswith(f"{name}_")}
+    return {labels: delta for labels, delta in deltas.items() if delta}
+
+
+def _cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as file:
+        fields = file.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def _scrape(session: aiohttp.ClientSession, base_url: str) -> dict[str, float]:
+    async with session.get(f"{base_url}/metrics", headers={"Authorization": f"Bearer {_ADMIN_TOKEN}"}) as response:
+        response.raise_for_status()
+        return _parse_metrics(await response.text())
+
+
+async def _wait_for_server(session: aiohttp.ClientSession, base_url: str, server: subprocess.Popen):
+    deadline = time.monotonic() + _STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with code {server.returncode}")
+        try:
+            await _scrape(session, base_url)
+            return
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.5)
+    raise TimeoutError("server did not start")
+
+
+async def _load(args, server: subprocess.Popen) -> dict:
+    base_url = f"http://127.0.0.1:{args.port}"
+    stats = Counter()
+    stop = asyncio.Event()
+
+    async with aiohttp.ClientSession() as session:
+        await _wait_for_server(session, base_url, server)
+
+        rooms = [[_SimulatedClient(args, base_url, f"viewer-{r}-{c}", host=c == 0, stats=stats)
+                  for c in range(args.clients)] for r in range(args.rooms)]
+        clients = [client for room in rooms for client in room]
+
+        # Logging in hashes a new uid with bcrypt, which would starve the first viewers' sockets if done while joining
+        start = time.monotonic()
+        for client in clients:
+            await client.login()
+        login_seconds = time.monotonic() - start
+
+        # Empty rooms delete themselves after a while, so they are created only once everybody can join right away
+        for room in rooms:
+            async with session.get(f"{base_url}/_load_test/room", params={"tmdb_id": 1}) as response:
+                room_uid = (await response.json())["uid"]
+            for client in room:
+                client.room_uid = room_uid
+
+        tasks = []
+        for client in clients:
+            tasks.append(asyncio.create_task(client.run(stop)))
+            await asyncio.sleep(args.ramp_seconds / len(clients))
+
+        # Joining is measured separately from the steady state the rooms settle into
+        await asyncio.sleep(args.warmup_seconds)
+        before = await _scrape(session, base_url)
+        cpu_before = _cpu_seconds(server.pid)
+        stats_before = Counter(stats)
+        start = time.monotonic()
+
+        await asyncio.sleep(args.duration)
+
+        elapsed = time.monotonic() - start
+        cpu = _cpu_seconds(server.pid) - cpu_before
+        after = await _scrape(session, base_url)
+        window = Counter(stats)
+        window.subtract(stats_before)
+
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    return {
+        "clients": {
+            "connected": stats["clients_connected"],
+            "failed": stats["clients_failed"],
+            "login_seconds_per_client": round(login_seconds / len(clients), 3),
+        },
+        "server_cpu_percent": round(cpu / elapsed * 100, 1),
+        "websocket_messages_per_second": {
+            "received": round(window["messages_received"] / elapsed, 1),
+            "sent": round(window["messages_sent"] / elapsed, 1),
+        },
+        "javascript_calls_per_second": round(window["javascript_calls"] / elapsed, 1),
+        "user_seeks": window["user_seeks"],
+        "event_loop_lag_seconds": _histogram(before, after, "wwf_event_loop_lag_seconds"),
+        "slow_callbacks": _counter(before, after, "wwf_event_loop_slow_callbacks_total"),
+        "sync_drift_seconds": _histogram(before, after, "wwf_sync_drift_seconds"),
+        "sync_seeks": _counter(before, after, "wwf_sync_seeks_total"),
+        "javascript_roundtrip_seconds": _histogram(before, after, "wwf_js_roundtrip_seconds"),
+        "javascript_timeouts": _counter(before, after, "wwf_js_timeouts_total"),
+    }
+
+
+def _serve(args):
+    config.ENABLE_METRICS = True
+    config.ADMIN_TOKEN = _ADMIN_TOKEN
+    config.ENABLE_LOOP_MONITOR = True
+    config.ENABLE_TRACING = False
+
+    from nicegui import app, background_tasks, ui
+
+    import globals
+    import web.routes  # noqa: F401
+    from monitoring.loop_monitor import LOOP_MONITOR
+    from movies.db import MoviesDB
+    from rooms.db import RoomsDB
+    from users.db import UsersDB
+    from users.utils import generate_token
+
+    # NiceGUI keeps user storage in the working directory, which must not be the real one
+    os.chdir(tempfile.mkdtemp(prefix="room_load_"))
+
+    globals.MOVIES_DATABASE = MoviesDB(db_path="movies_db.json")
+    globals.MOVIES_DATABASE.contents = make_catalog(args.movies, 0, 0, 0)
+    globals.MOVIES_DATABASE._assign_content()
+    globals.USERS_DATABASE = UsersDB(db_path="users_db.json")
+    globals.ROOMS_DATABASE = RoomsDB()
+
+    @app.get("/_load_test/login")
+    async def login(username: str):
+        user = await globals.USERS_DATABASE.create_user(username)
+        app.storage.user["token"] = generate_token(user)
+        return {"uid": user.uid}
+
+    @app.get("/_load_test/room")
+    async def room(tmdb_id: int):
+        return {"uid": (await globals.ROOMS_DATABASE.create_room(tmdb_id)).uid}
+
+    app.on_startup(lambda: background_tasks.create_lazy(LOOP_MONITOR.run(), name="loop_monitor"))
+
+    ui.run(host="127.0.0.1", port=args.port, reload=False, show=False, storage_secret=uuid.uuid4().hex)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test rooms with simulated viewers that speak NiceGUI's "
+                                                 "websocket protocol and answer the player's javascript calls")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--movies", type=int, default=10)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=5, help="viewers per room")
+    parser.add_argument("--latency-ms", type=float, default=40, help="one-way latency between viewers and server")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--seek-interval", type=float, default=60,
+                        help="mean seconds between seeks by the first viewer of each room, 0 to never seek")
+    parser.add_argument("--ramp-seconds", type=float, default=10)
+    parser.add_argument("--warmup-seconds", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.serve:
+        _serve(args)
+        return
+
+    # The server runs in its own process, so its CPU time and event loop are not shared with the viewers
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.room_load", "--serve", "--port", str(args.port),
+                               "--movies", str(args.movies)], cwd=_ROOT_DIR, stdout=subprocess.DEVNULL)
+    try:
+        result = asyncio.run(_load(args, server))
+    finally:
+        server.terminate()
+        server.wait()
+
+    sys.stdout.buffer.write(orjson.dumps({
+        "rooms": args.rooms,
+        "clients_per_room": args.clients,
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "duration_seconds": args.duration,
+        **result,
+    }, option=orjson.OPT_INDENT_2))
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
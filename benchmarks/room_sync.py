@@ -0,0 +1,444 @@
+import argparse
+import heapq
+import itertools
+import math
+import random
+import statistics
+import sys
+from collections import Counter
+from datetime import datetime, timedelta
+
+import orjson
+
+from benchmarks.common import ensure_config, make_catalog
+
+ensure_config()
+
+import config  # noqa: E402
+import globals  # noqa: E402
+from movies.db import MoviesDB  # noqa: E402
+from rooms import sync  # noqa: E402
+from rooms.room import Room  # noqa: E402
+from rooms.state import PlayerState  # noqa: E402
+
+# NiceGUI's default for ui.run_javascript, which the player uses for every query
+_JS_TIMEOUT_SECONDS = 1.0
+_SAMPLE_INTERVAL_SECONDS = 0.1
+_EPOCH = datetime(2000, 1, 1)
+_MEDIA_SECONDS = 2 * 3600
+
+
+class _Future:
+    __slots__ = ("done", "value", "waiters")
+
+    def __init__(self):
+        self.done = False
+        self.value = None
+        self.waiters = []
+
+
+class _Simulation:
+    # Processes are generators that yield a delay in seconds or a _Future to wait for, as in SimPy
+    def __init__(self):
+        self.now = 0.0
+        self._queue = []
+        self._order = itertools.count()
+
+    def datetime(self) -> datetime:
+        return _EPOCH + timedelta(seconds=self.now)
+
+    def call_later(self, delay: float, callback, *args):
+        heapq.heappush(self._queue, (self.now + max(0.0, delay), next(self._order), callback, args))
+
+    def process(self, generator):
+        self.call_later(0.0, self._step, generator, None)
+
+    def _step(self, generator, value):
+        try:
+            waiting = generator.send(value)
+        except StopIteration:
+            return
+
+        if isinstance(waiting, _Future):
+            if waiting.done:
+                self.call_later(0.0, self._step, generator, waiting.value)
+            else:
+                waiting.waiters.append(generator)
+        else:
+            self.call_later(waiting, self._step, generator, None)
+
+    def resolve(self, future: _Future, value=None):
+        if future.done:
+            return
+        future.done = True
+        future.value = value
+        for generator in future.waiters:
+            self.call_later(0.0, self._step, generator, value)
+        future.waiters.clear()
+
+    def timeout(self, future: _Future, seconds: float, value=None):
+        self.call_later(seconds, self.resolve, future, value)
+        return future
+
+    def run(self, until: float):
+        while self._queue and self._queue[0][0] <= until:
+            self.now, _, callback, args = heapq.heappop(self._queue)
+            callback(*args)
+        self.now = until
+
+
+class _Player:
+    # A browser tab running Plyr: it plays at a slightly wrong rate, stalls to buffer and takes time to seek
+    def __init__(self, simulation: _Simulation, client: "_Client", rng: random.Random, args):
+        self.simulation = simulation
+        self.client = client
+        self.rng = rng
+        self.args = args
+
+        self.playing = False
+        self.position = 0.0
+        self.rate = 1.0 + rng.uniform(-args.rate_skew, args.rate_skew)
+        self.seeking_until = 0.0
+        self.stalled_until = 0.0
+        self._last_advance = 0.0
+
+    @property
+    def seeking(self) -> bool:
+        return self.simulation.now < self.seeking_until
+
+    def advance(self):
+        now = self.simulation.now
+        if self.playing:
+            # Playback only moves while the media is neither seeking nor buffering
+            start = max(self._last_advance, self.seeking_until, self.stalled_until)
+            if now > start:
+                self.position += (now - start) * self.rate
+        self._last_advance = now
+
+    def play(self):
+        self.advance()
+        if not self.playing:
+            self.playing = True
+            self.client.emit("play")
+
+    def pause(self):
+        self.advance()
+        if self.playing:
+            self.playing = False
+            self.client.emit("pause")
+
+    def seek(self, position: float):
+        self.advance()
+        self.position = max(0.0, position)
+        self.seeking_until = self.simulation.now + self.rng.uniform(*self.args.seek_seconds)
+        self.simulation.call_later(self.seeking_until - self.simulation.now, self._seeked, self.seeking_until)
+
+    def _seeked(self, seeking_until: float):
+        # Only the last of overlapping seeks reports seeked, like HTMLMediaElement
+        if seeking_until == self.seeking_until:
+            self.advance()
+            self.client.emit("seeked")
+
+    def current_position(self) -> float:
+        self.advance()
+        return self.position
+
+    def stalls(self):
+        if self.args.stalls_per_minute <= 0:
+            return
+        while True:
+            yield self.rng.expovariate(self.args.stalls_per_minute / 60)
+            if self.playing:
+                self.advance()
+                self.stalled_until = max(self.stalled_until, self.simulation.now) + self.rng.expovariate(
+                    1 / self.args.stall_seconds)
+
+
+class _Client:
+    # One viewer: the browser side, the network between and the server-side handlers of web/pages/room.py
+    def __init__(self, simulation: _Simulation, room: Room, rng: random.Random, args, stats: Counter):
+        self.simulation = simulation
+        self.room = room
+        self.rng = rng
+        self.args = args
+        self.stats = stats
+        self.player = _Player(simulation, self, rng, args)
+        self.player_data = {"state": PlayerState.PAUSED, "position": 0, "last_change": None, "next_sync": 0.0,
+                            "hidden": False}
+        self.timer_interval = config.SYNC_INTERVAL_SECONDS
+
+    def _delay(self) -> float:
+        return max(0.0, self.rng.gauss(self.args.latency_ms, self.args.jitter_ms)) / 1000
+
+    def _send(self, callback, *args):
+        self.simulation.call_later(self._delay(), callback, *args)
+
+    def _query(self, query):
+        future = _Future()
+        self.stats["js_queries"] += 1
+
+        def answer():
+            value = query()
+            self._send(self.simulation.resolve, future, value)
+
+        self._send(answer)
+        return self.simulation.timeout(future, _JS_TIMEOUT_SECONDS, TimeoutError)
+
+    def emit(self, event: str):
+        self.stats[f"events_{event}"] += 1
+        self._send(lambda: self.simulation.process(self._handle(event)))
+
+    def _handle(self, event: str):
+        match event:
+            case "play":
+                self.room.play()
+                self.player_data["state"] = PlayerState.PLAYING
+            case "pause":
+                self.room.pause()
+                self.player_data["state"] = PlayerState.PAUSED
+            case "seeked":
+                position = yield self._query(self.player.current_position)
+                if position is TimeoutError:
+                    self.stats["js_timeouts"] += 1
+                    return
+                if abs(position - self.room.player_position) > self.args.threshold:
+                    self.stats["room_jumps"] += 1
+                self.stats["room_seeks"] += 1
+                self.room.seek(position)
+                self.player_data["position"] = position
+
+    def _sync(self):
+        last_change = self.room.last_change
+        if (not self.args.fixed_cadence and last_change == self.player_data["last_change"]
+                and self.simulation.now < self.player_data["next_sync"]):
+            return
+
+        self.stats["syncs"] += 1
+        position = yield self._query(self.player.current_position)
+        if position is TimeoutError:
+            self.stats["js_timeouts"] += 1
+            return
+        seeking = yield self._query(lambda: self.player.seeking)
+        if seeking is TimeoutError:
+            self.stats["js_timeouts"] += 1
+            seeking = False
+        self.player_data["position"] = position
+
+        since_change = (self.simulation.datetime() - last_change).total_seconds()
+        decision = sync.decide(self.player_data["state"], position, seeking, self.player_data["hidden"],
+                               self.room.player_state, self.room.player_position, since_change)
+
+        if decision.state is not None:
+            self.stats["state_commands"] += 1
+            self._send(self.player.play if decision.state == PlayerState.PLAYING else self.player.pause)
+            self.player_data["state"] = decision.state
+
+        if decision.seek_reason is not None:
+            self.stats[f"corrective_seeks_{decision.seek_reason}"] += 1
+            self._send(self.player.seek, self.room.player_position)
+            self.player_data["position"] = self.room.player_position
+
+        if not self.args.fixed_cadence:
+            self.player_data["last_change"] = last_change
+            self.player_data["next_sync"] = self.simulation.now + decision.interval
+            self.timer_interval = min(decision.interval, config.SYNC_INTERVAL_SECONDS)
+
+    def sync_loop(self):
+        # Clients open the page at different moments, so their timers are out of phase
+        yield self.rng.uniform(0, self.timer_interval)
+        while True:
+            start = self.simulation.now
+            yield from self._sync()
+            yield max(0.0, start + self.timer_interval - self.simulation.now)
+
+
+def _room_position(simulation: _Simulation, room: Room) -> float:
+    # Between two ticks the room is further along than player_position says
+    if room.player_state == PlayerState.PLAYING:
+        return room.player_position + (simulation.datetime() - room.last_update).total_seconds()
+    return room.player_position
+
+
+def _quantile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(q * len(values)) - 1)]
+
+
+def _summary(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "p50": _quantile(values, 0.5),
+        "p95": _quantile(values, 0.95),
+        "max": max(values),
+    }
+
+
+def _simulate(seed: int, args) -> dict:
+    rng = random.Random(seed)
+    simulation = _Simulation()
+    stats = Counter()
+
+    room = Room(uid="simulated", tmdb_id=1, clock=simulation.datetime)
+    clients = [_Client(simulation, room, random.Random(rng.random()), args, stats) for _ in range(args.clients)]
+    host = clients[0].player
+
+    def room_loop():
+        while True:
+            yield config.ROOMS_UPDATE_INTERVAL_SECONDS
+            room.tick()
+
+    actions = []
+
+    def host_loop():
+        yield args.start_seconds
+        actions.append((simulation.now, "play"))
+        host.play()
+        while True:
+            yield rng.expovariate(1 / args.action_interval)
+            host.advance()
+            if rng.random() < args.seek_share:
+                actions.append((simulation.now, "seek"))
+                host.seek(rng.uniform(0, _MEDIA_SECONDS))
+            elif host.playing:
+                actions.append((simulation.now, "pause"))
+                host.pause()
+            else:
+                actions.append((simulation.now, "play"))
+                host.play()
+
+    samples = []
+
+    def sample_loop():
+        while True:
+            reference = _room_position(simulation, room)
+            playing = room.player_state == PlayerState.PLAYING
+            drifts = [abs(client.player.current_position() - reference) for client in clients]
+            states_match = all(client.player.playing == playing for client in clients)
+            samples.append((simulation.now, playing, max(drifts), states_match, drifts))
+            yield _SAMPLE_INTERVAL_SECONDS
+
+    simulation.process(room_loop())
+    simulation.process(host_loop())
+    simulation.process(sample_loop())
+    for client in clients:
+        simulation.process(client.player.stalls())
+        simulation.process(client.sync_loop())
+    simulation.run(args.duration)
+
+    # A change has converged once every viewer agrees with the room and keeps agreeing for the hold period
+    converge = {"play": [], "pause": [], "seek": []}
+    unconverged = Counter()
+    for i, (start, action) in enumerate(actions):
+        end = actions[i + 1][0] if i + 1 < len(actions) else args.duration
+        in_sync_since = None
+        converged = None
+        for moment, _, worst, states_match, _ in samples:
+            if moment < start:
+                continue
+            if moment >= end:
+                break
+            if states_match and worst <= args.threshold:
+                if in_sync_since is None:
+                    in_sync_since = moment
+                if moment - in_sync_since >= args.hold_seconds:
+                    converged = in_sync_since - start
+                    break
+            else:
+                in_sync_since = None
+        if converged is None:
+            unconverged[action] += 1
+        else:
+            converge[action].append(converged)
+
+    # Steady state leaves out the settle period after every change, when drift is expected
+    steady = []
+    action_times = [start for start, _ in actions]
+    for moment, playing, _, _, drifts in samples:
+        if not playing:
+            continue
+        if any(0 <= moment - start < args.settle_seconds for start in action_times):
+            continue
+        steady.extend(drifts)
+
+    return {
+        "actions": Counter(action for _, action in actions),
+        "converge": converge,
+        "unconverged": unconverged,
+        "steady": steady,
+        "stats": stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate viewers of a room on a virtual clock and score how well "
+                                                 "the sync logic keeps them together")
+    parser.add_argument("--clients", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=1800, help="simulated seconds per run")
+    parser.add_argument("--runs", type=int, default=5, help="runs with consecutive seeds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=40, help="one-way latency between viewers and server")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--stalls-per-minute", type=float, default=0.5, help="buffering stalls per viewer")
+    parser.add_argument("--stall-seconds", type=float, default=1.5, help="mean length of a stall")
+    parser.add_argument("--seek-seconds", type=float, nargs=2, default=(0.1, 0.6), metavar=("MIN", "MAX"),
+                        help="how long a seek takes before the player reports seeked")
+    parser.add_argument("--rate-skew", type=float, default=0.002, help="max relative playback rate error")
+    parser.add_argument("--start-seconds", type=float, default=2, help="when the host first presses play")
+    parser.add_argument("--action-interval", type=float, default=60, help="mean seconds between host actions")
+    parser.add_argument("--seek-share", type=float, default=0.5, help="share of host actions that are seeks")
+    parser.add_argument("--threshold", type=float, default=1.0, help="drift at which a viewer counts as in sync")
+    parser.add_argument("--hold-seconds", type=float, default=2.0)
+    parser.add_argument("--settle-seconds", type=float, default=10.0)
+    parser.add_argument("--fixed-cadence", action="store_true",
+                        help="sync every SYNC_INTERVAL_SECONDS regardless of what the room is doing")
+    args = parser.parse_args()
+
+    globals.MOVIES_DATABASE = MoviesDB(db_path="movies_db.json")
+    globals.MOVIES_DATABASE.contents = make_catalog(1, 0, 0, 0)
+    globals.MOVIES_DATABASE._assign_content()
+
+    actions = Counter()
+    converge = {"play": [], "pause": [], "seek": []}
+    unconverged = Counter()
+    steady = []
+    stats = Counter()
+    for seed in range(args.seed, args.seed + args.runs):
+        result = _simulate(seed, args)
+        actions.update(result["actions"])
+        for action, seconds in result["converge"].items():
+            converge[action].extend(seconds)
+        unconverged.update(result["unconverged"])
+        steady.extend(result["steady"])
+        stats.update(result["stats"])
+
+    simulated_minutes = args.duration * args.runs / 60
+    per_client_minute = simulated_minutes * args.clients
+    corrective = {key.removeprefix("corrective_seeks_"): count for key, count in sorted(stats.items())
+                  if key.startswith("corrective_seeks_")}
+    report = {
+        "config": {**vars(args), "max_delay_seconds": config.MAX_DELAY_SECONDS,
+                   "rooms_update_interval_seconds": config.ROOMS_UPDATE_INTERVAL_SECONDS},
+        "actions": dict(actions),
+        "converge_seconds": {action: {**_summary(seconds), "unconverged": unconverged[action]}
+                             for action, seconds in converge.items()},
+        "steady_drift_seconds": _summary(steady),
+        "steady_in_sync_share": (sum(drift <= args.threshold for drift in steady) / len(steady)) if steady else None,
+        "corrective_seeks": corrective,
+        "corrective_seeks_per_client_minute": sum(corrective.values()) / per_client_minute,
+        "room_seeks": stats["room_seeks"],
+        "room_jumps": stats["room_jumps"],
+        "state_commands": stats["state_commands"],
+        "syncs_per_client_minute": stats["syncs"] / per_client_minute,
+        "js_queries_per_client_minute": stats["js_queries"] / per_client_minute,
+        "js_timeouts": stats["js_timeouts"],
+    }
+    sys.stdout.buffer.write(orjson.dumps(report, option=orjson.OPT_INDENT_2) + b"\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import random
+import statistics
+import sys
+import time
+
+import orjson
+
+from benchmarks.common import ensure_config
+
+ensure_config()
+
+from movies.classes import Movie  # noqa: E402
+from movies.search import SearchIndex  # noqa: E402
+
+_WORDS = [
+    "the", "star", "wars", "return", "king", "lord", "rings", "matrix", "night", "day", "dark", "knight",
+    "love", "story", "lost", "city", "man", "woman", "girl", "boy", "house", "river", "mountain", "war", "peace",
+    "blue", "red", "black", "white", "empire", "strikes", "back", "new", "hope", "last", "first", "secret", "life",
+    "death", "brother", "sister", "father", "mother", "shadow", "fire", "ice", "game", "thrones", "breaking", "bad",
+    "война", "мир", "брат", "сестра", "ночь", "день", "ёлки", "москва", "слезам", "не", "верит", "ирония",
+    "судьбы", "служебный", "роман", "операция", "приключения", "шурика",
+]
+_GENRES = ["Drama", "Comedy", "Action", "Thriller", "Horror", "Documentary", "Animation", "Sci-Fi & Fantasy",
+           "Crime", "Mystery", "Romance", "Family", "Драма", "Комедия"]
+_QUERIES = ["s", "st", "sta", "star wars", "the king", "matrix 1999", "drama", "ёлки", "елки",
+            "москва слезам", "night shadow fire", "nonexistent", "lord rings return king", "2010", "брат 2"]
+
+
+def _make_contents(count: int, rng: random.Random) -> list[Movie]:
+    contents = []
+    for i in range(count):
+        title = " ".join(rng.choices(_WORDS, k=rng.randint(1, 4))).capitalize()
+        og_title = " ".join(rng.choices(_WORDS, k=rng.randint(1, 4))).capitalize()
+        contents.append(Movie(
+            tmdb_id=i + 1,
+            title=f"{title} {rng.randint(1, 5)}" if rng.random() < 0.1 else title,
+            og_title=og_title,
+            vote_average=round(rng.uniform(1, 10), 1),
+            release_date=f"{rng.randint(1950, 2025)}-01-01",
+            genres=tuple(rng.sample(_GENRES, k=rng.randint(1, 3))),
+        ))
+    return contents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the contents search index")
+    parser.add_argument("--titles", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    contents = _make_contents(args.titles, random.Random(args.seed))
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.build(contents)
+    build_seconds = time.perf_counter() - start
+
+    queries = {}
+    for query in _QUERIES:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = index.search(query, args.limit)
+            timings.append((time.perf_counter() - start) * 1_000_000)
+        timings.sort()
+        queries[query] = {
+            "results": len(results),
+            "median_us": round(statistics.median(timings), 1),
+            "p95_us": round(timings[int(len(timings) * 0.95) - 1], 1),
+        }
+
+    sys.stdout.buffer.write(orjson.dumps({
+        "titles": args.titles,
+        "vocabulary": len(index.vocabulary),
+        "build_seconds": round(build_seconds, 3),
+        "queries": queries,
+    }, option=orjson.OPT_INDENT_2))
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 from movies.db import MoviesDB
+from movies.image_cache import ImageCache
+from movies.remux import RemuxCache
 from rooms.db import RoomsDB
 from users.db import UsersDB
 
 MOVIES_DATABASE: MoviesDB | None = None
 USERS_DATABASE: UsersDB | None = None
 ROOMS_DATABASE: RoomsDB | None = None
+IMAGE_CACHE: ImageCache | None = None
+REMUX_CACHE: RemuxCache | None = None
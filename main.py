@@ -2,15 +2,21 @@ import asyncio
 import logging
 import os
 import pathlib
+import shutil
 
 from nicegui import background_tasks, app
 
 import config
 import globals
 import web.routes
+from monitoring.loop_monitor import LOOP_MONITOR
 from movies.db import MoviesDB
+from movies.proxies import PROXY_POOL
+from movies.image_cache import ImageCache
+from movies.remux import RemuxCache
 from rooms.db import RoomsDB
 from users.db import UsersDB
+from web.assets import init_assets
 
 working_dir = pathlib.Path(__file__).resolve().parent
 os.chdir(working_dir)
@@ -38,6 +44,24 @@ async def init_rooms_db():
     globals.ROOMS_DATABASE = RoomsDB()
 
 
+async def init_image_cache():
+    globals.IMAGE_CACHE = ImageCache(cache_dir="data/images", max_bytes=config.IMAGES_CACHE_MAX_BYTES)
+    await globals.IMAGE_CACHE.load_from_disk()
+
+
+async def init_remux_cache():
+    if not config.ENABLE_REMUX:
+        return
+
+    if (ffmpeg_path := shutil.which(config.FFMPEG_PATH)) is None:
+        logging.warning("ffmpeg was not found at %s, remuxing is disabled", config.FFMPEG_PATH)
+        return
+
+    globals.REMUX_CACHE = RemuxCache(cache_dir="data/remux", max_bytes=config.REMUX_CACHE_MAX_BYTES,
+                                     ffmpeg_path=ffmpeg_path)
+    await globals.REMUX_CACHE.load_from_disk()
+
+
 async def before_startup():
     if not os.path.exists("data"):
         os.mkdir("data")
@@ -45,11 +69,20 @@ async def before_startup():
     await init_movies_db()
     await init_users_db()
     await init_rooms_db()
+    await init_image_cache()
+    await init_remux_cache()
+    await init_assets("data/assets")
 
 
 async def after_startup():
+    if config.ENABLE_LOOP_MONITOR:
+        background_tasks.create_lazy(LOOP_MONITOR.run(), name="loop_monitor")
     background_tasks.create_lazy(globals.MOVIES_DATABASE.auto_update(), name="movies_db_auto_update")
     background_tasks.create_lazy(globals.USERS_DATABASE.auto_remove_inactive(), name="users_db_auto_remove_inactive")
+    if config.ENABLE_MEDIA_PROBING:
+        background_tasks.create_lazy(globals.MOVIES_DATABASE.auto_probe_media(), name="movies_db_auto_probe_media")
+    if config.PROXIES:
+        background_tasks.create_lazy(PROXY_POOL.auto_probe(), name="proxy_pool_auto_probe")
 
     logging.info("Application successfully started!")
 
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+
+import config
+from monitoring import metrics
+
+_ROOT_DIR = str(Path(__file__).resolve().parent.parent)
+_STACK_DEPTH = 8
+
+
+def _task_label(name: str) -> str:
+    # Per-room and auto-numbered task names would give every task its own metric series
+    if name.startswith("room_update_"):
+        return "room_update"
+    if name.startswith("Task-"):
+        return "Task"
+    return name
+
+
+class LoopMonitor:
+    def __init__(self, interval: float, slow_threshold: float):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._heartbeat = time.monotonic()
+        self._stall: dict | None = None
+
+    def _capture(self) -> dict:
+        task = asyncio.current_task(self._loop)
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.extract_stack(frame)[-_STACK_DEPTH:] if frame is not None else []
+
+        # The innermost frame of our own code says more than a frame deep inside a library
+        location = next((f for f in reversed(stack) if f.filename.startswith(_ROOT_DIR)), stack[-1] if stack else None)
+
+        return {
+            "task": task.get_name() if task is not None else "callback",
+            "location": f"{location.filename}:{location.lineno} in {location.name}" if location else "unknown",
+        }
+
+    def _watch(self):
+        # Runs in its own thread, so it can look at the loop exactly while something is blocking it
+        while True:
+            time.sleep(self.slow_threshold / 2)
+            if self._stall is None and time.monotonic() - self._heartbeat > self.interval + self.slow_threshold:
+                self._stall = self._capture()
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        threading.Thread(target=self._watch, name="loop_monitor", daemon=True).start()
+
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+
+            lag = max(0.0, now - start - self.interval)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+
+            if (stall := self._stall) is None:
+                if lag > self.slow_threshold:
+                    logging.warning("Event loop lagged by %.3fs", lag)
+                continue
+
+            self._stall = None
+            metrics.SLOW_CALLBACKS.inc(task=_task_label(stall["task"]))
+            logging.warning("Event loop was blocked for %.3fs by task %s at %s", lag, stall["task"],
+                            stall["location"])
+
+
+LOOP_MONITOR = LoopMonitor(interval=config.LOOP_MONITOR_INTERVAL_SECONDS,
+                           slow_threshold=config.LOOP_MONITOR_SLOW_CALLBACK_SECONDS)
@@ -0,0 +1,193 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DRIFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f"{name}=\"{_escape(value)}\"" for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._function: Callable[[], float | dict[tuple, float]] | None = None
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.labels)
+
+    def set_function(self, function: Callable[[], float | dict[tuple, float]]):
+        # The value is computed only when metrics are scraped, so nothing is paid on the hot path
+        self._function = function
+
+    def remove(self, **labels):
+        self._values.pop(self._key(labels), None)
+
+    def _samples(self) -> dict[tuple, float]:
+        if self._function is None:
+            return self._values
+        value = self._function()
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in self._samples().items():
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self._histograms: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        if (histogram := self._histograms.get(key)) is None:
+            histogram = self._histograms[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = histogram
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def remove(self, **labels):
+        self._histograms.pop(self._key(labels), None)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, (counts, total) in self._histograms.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f"le=\"{_format_value(bound)}\""
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+ROOMS = REGISTRY.register(Gauge(
+    "wwf_rooms", "Number of open rooms"))
+ROOM_CLIENTS = REGISTRY.register(Gauge(
+    "wwf_room_clients", "Number of clients connected to rooms"))
+SYNC_DRIFT_SECONDS = REGISTRY.register(Histogram(
+    "wwf_sync_drift_seconds", "Distance between a client's player and the room clock at each sync",
+    buckets=DRIFT_BUCKETS))
+ROOM_SYNC_DRIFT_SECONDS = REGISTRY.register(Gauge(
+    "wwf_room_sync_drift_seconds", "Last drift measured in a room", ("room",)))
+SYNC_SEEKS = REGISTRY.register(Counter(
+    "wwf_sync_seeks_total", "Corrective seeks issued by the room sync", ("reason",)))
+JS_ROUNDTRIP_SECONDS = REGISTRY.register(Histogram(
+    "wwf_js_roundtrip_seconds", "Round trip of run_javascript calls made by the video player", ("call",)))
+JS_TIMEOUTS = REGISTRY.register(Counter(
+    "wwf_js_timeouts_total", "run_javascript calls made by the video player that timed out", ("call",)))
+
+CATALOG_REFRESH_SECONDS = REGISTRY.register(Histogram(
+    "wwf_catalog_refresh_seconds", "Duration of catalog refreshes", ("scope",)))
+CATALOG_ITEMS = REGISTRY.register(Gauge(
+    "wwf_catalog_items", "Number of items in the catalog", ("type",)))
+CATALOG_PENDING_RETRIES = REGISTRY.register(Gauge(
+    "wwf_catalog_pending_retries", "Disks and contents waiting for a retry", ("kind",)))
+
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    "wwf_upstream_requests_total", "Requests to TMDB and Yandex Disk by outcome", ("endpoint", "outcome")))
+UPSTREAM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "wwf_upstream_request_seconds", "Latency of successful requests to TMDB and Yandex Disk", ("endpoint",)))
+UPSTREAM_HEDGES = REGISTRY.register(Counter(
+    "wwf_upstream_hedges_total", "Hedged requests sent, won and skipped for lack of a free permit", ("endpoint", "result")))
+
+PROXY_HEALTHY = REGISTRY.register(Gauge(
+    "wwf_proxy_healthy", "Whether a proxy is in rotation (1) or ejected after failures (0)", ("proxy",)))
+PROXY_LATENCY_SECONDS = REGISTRY.register(Gauge(
+    "wwf_proxy_latency_seconds", "Moving average of the latency through a proxy", ("proxy",)))
+PROXY_SUCCESS_RATIO = REGISTRY.register(Gauge(
+    "wwf_proxy_success_ratio", "Moving average of the share of successful requests through a proxy", ("proxy",)))
+PROXY_SCORE = REGISTRY.register(Gauge(
+    "wwf_proxy_score", "Score used to pick proxies, lower is better", ("proxy",)))
+PROXY_REQUESTS = REGISTRY.register(Counter(
+    "wwf_proxy_requests_total", "Requests through a proxy by outcome", ("proxy", "outcome")))
+
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "wwf_cache_requests_total", "Cache lookups by cache and result", ("cache", "result")))
+
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "wwf_event_loop_lag_seconds", "How late the event loop woke up a periodic sleep", buckets=LAG_BUCKETS))
+SLOW_CALLBACKS = REGISTRY.register(Counter(
+    "wwf_event_loop_slow_callbacks_total", "Times a task blocked the event loop past the threshold", ("task",)))
+
+LOGINS = REGISTRY.register(Counter(
+    "wwf_logins_total", "Login attempts by outcome", ("outcome",)))
+USERS_DB_SAVE_SECONDS = REGISTRY.register(Histogram(
+    "wwf_users_db_save_seconds", "Duration of Users DB saves"))
@@ -0,0 +1,80 @@
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+_ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    path = Path(code.co_filename)
+    try:
+        filename = str(path.relative_to(_ROOT_DIR))
+    except ValueError:
+        filename = path.name
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def sample(self, seconds: float, interval: float) -> Counter[str]:
+        # Nothing is installed in the interpreter: the profiler costs nothing unless this thread is sampling
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Profiler is already running")
+
+        try:
+            own_thread_id = threading.get_ident()
+            stacks = Counter()
+            deadline = time.monotonic() + seconds
+
+            while time.monotonic() < deadline:
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread_id:
+                        continue
+
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame))
+                        frame = frame.f_back
+                    stack.append(thread_names.get(thread_id, str(thread_id)))
+                    stacks[";".join(reversed(stack))] += 1
+
+                time.sleep(interval)
+
+            return stacks
+        finally:
+            self._lock.release()
+
+
+def collapsed(stacks: Counter[str]) -> str:
+    # The collapsed format is what flamegraph.pl, speedscope and inferno read
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def top(stacks: Counter[str], limit: int) -> str:
+    total = sum(stacks.values()) or 1
+    own = Counter()
+    cumulative = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")[1:]
+        if frames:
+            own[frames[-1]] += count
+        for frame in set(frames):
+            cumulative[frame] += count
+
+    lines = [f"{total} samples", "", f"{'own %':>7} {'total %':>7}  function"]
+    for frame, count in own.most_common(limit):
+        lines.append(f"{count / total * 100:7.1f} {cumulative[frame] / total * 100:7.1f}  {frame}")
+    return "\n".join(lines) + "\n"
+
+
+PROFILER = SamplingProfiler()
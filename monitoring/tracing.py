@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+import orjson
+
+import config
+
+_FILE_PATH = Path("data/traces.jsonl")
+_SERVICE_NAME = "watch-together"
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+_SUMMARY_TOP = 10
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start", "end", "error")
+
+    def __init__(self, trace: "Trace", parent_id: str | None, name: str, attributes: dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def seconds(self) -> float:
+        return ((self.end or time.time_ns()) - self.start) / 1e9
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans: list[Span] = []
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+_writer_lock = threading.Lock()
+_writer: RotatingFileHandler | None = None
+
+
+def _attribute_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _encode_span(trace: Trace, span: Span) -> dict:
+    encoded = {
+        "traceId": trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start),
+        "endTimeUnixNano": str(span.end),
+        "attributes": [{"key": key, "value": _attribute_value(value)}
+                       for key, value in span.attributes.items() if value is not None],
+        "status": {"code": _STATUS_ERROR, "message": span.error} if span.error else {"code": _STATUS_OK},
+    }
+    if span.parent_id is not None:
+        encoded["parentSpanId"] = span.parent_id
+    return encoded
+
+
+def _encode_trace(trace: Trace) -> bytes:
+    # Each line is an OTLP/JSON ExportTraceServiceRequest, the layout of the OpenTelemetry collector file exporter
+    return orjson.dumps({"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": _SERVICE_NAME}}]},
+        "scopeSpans": [{
+            "scope": {"name": __name__},
+            "spans": [_encode_span(trace, span) for span in trace.spans],
+        }],
+    }]})
+
+
+def _write(line: bytes):
+    global _writer
+
+    with _writer_lock:
+        if _writer is None:
+            _FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            _writer = RotatingFileHandler(_FILE_PATH, maxBytes=config.TRACING_FILE_MAX_BYTES,
+                                          backupCount=config.TRACING_FILE_BACKUPS, encoding="utf-8")
+            _writer.setFormatter(logging.Formatter("%(message)s"))
+
+        _writer.emit(logging.makeLogRecord({"msg": line.decode("utf-8")}))
+
+
+def _export(trace: Trace):
+    try:
+        line = _encode_trace(trace)
+    except Exception as e:
+        logging.error("Failed to encode trace: %s", e)
+        return
+
+    try:
+        asyncio.get_running_loop().run_in_executor(None, _write, line)
+    except RuntimeError:
+        _write(line)
+
+
+def summarize(root: Span) -> str:
+    totals = defaultdict(lambda: [0, 0.0, 0.0, 0, 0])
+    for span in root.trace.spans:
+        if span is root:
+            continue
+        total = totals[span.name]
+        total[0] += 1
+        total[1] += span.seconds
+        total[2] = max(total[2], span.seconds)
+        total[3] += span.attributes.get("items") or 0
+        total[4] += span.error is not None
+
+    lines = [f"{root.name} took {root.seconds:.2f}s in {len(root.trace.spans)} spans"]
+    # Concurrent spans overlap, so the totals of a phase can add up to more than the refresh itself
+    slowest = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)[:_SUMMARY_TOP]
+    for name, (count, seconds, longest, items, errors) in slowest:
+        line = f"  {name}: {count}x, {seconds:.2f}s total, {longest:.2f}s max"
+        if items:
+            line += f", {items} items"
+        if errors:
+            line += f", {errors} failed"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+@contextmanager
+def _record(trace: Trace, parent: Span | None, name: str, attributes: dict):
+    span = Span(trace, parent.span_id if parent is not None else None, name, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end = time.time_ns()
+        trace.spans.append(span)
+        _current_span.reset(token)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    if not config.ENABLE_TRACING:
+        yield None
+        return
+
+    # Each root span gets its own trace, even when it starts inside another one
+    root_trace = Trace()
+    root = None
+    try:
+        with _record(root_trace, None, name, attributes) as root:
+            yield root
+    finally:
+        if root is not None:
+            _export(root_trace)
+            logging.info("Trace summary: %s", summarize(root))
+
+
+@contextmanager
+def span(name: str, **attributes):
+    # Spans are only recorded inside a trace, so code outside of a catalog refresh pays a single lookup
+    if (parent := _current_span.get()) is None:
+        yield None
+        return
+
+    with _record(parent.trace, parent, name, attributes) as child:
+        yield child
+
+
+def annotate(**attributes):
+    if (current := _current_span.get()) is not None:
+        current.set(**attributes)
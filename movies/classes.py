@@ -1,8 +1,23 @@
 from dataclasses import dataclass
 from typing import Sized
 
+from movies.images import image_url
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True)
+class MediaInfo:
+    container: str = None
+
+    duration: float = None
+    bitrate: int = None
+
+    video_codec: str = None
+    audio_codec: str = None
+
+    fast_start: bool = None
+
+
+@dataclass(frozen=True, slots=True)
 class Content:
     tmdb_id: int = None
 
@@ -13,13 +28,21 @@ class Content:
     title: str = None
     og_title: str = None
     homepage: str = None
-    poster_url: str = None
-    backdrop_url: str = None
+    poster_path: str = None
+    backdrop_path: str = None
     release_date: str = None
     genres: tuple[Sized, ...] = None
 
+    @property
+    def poster_url(self) -> str | None:
+        return image_url(self.poster_path)
+
+    @property
+    def backdrop_url(self) -> str | None:
+        return image_url(self.backdrop_path)
+
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Movie(Content):
     type: str = "movie"
 
@@ -28,9 +51,10 @@ class Movie(Content):
     runtime: int = None
 
     file_url: str = None
+    media: MediaInfo = None
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Episode:
     type: str = "episode"
 
@@ -41,13 +65,19 @@ class Episode:
     vote_average: float = None
 
     title: str = None
+    file_size: int = None
     file_url: str = None
-    still_url: str = None
+    media: MediaInfo = None
+    still_path: str = None
     episode_type: str = None
     release_date: str = None
 
+    @property
+    def still_url(self) -> str | None:
+        return image_url(self.still_path)
+
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Season:
     type: str = "season"
 
@@ -57,13 +87,17 @@ class Season:
     vote_average: float = None
 
     title: str = None
-    poster_url: str = None
+    poster_path: str = None
     release_date: str = None
 
     episodes: tuple[Episode, ...] = None
 
+    @property
+    def poster_url(self) -> str | None:
+        return image_url(self.poster_path)
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True)
 class TVShow(Content):
     type: str = "tv"
 
@@ -73,3 +107,17 @@ class TVShow(Content):
     in_production: bool = None
 
     seasons: tuple[Season, ...] = None
+
+
+@dataclass(frozen=True, slots=True)
+class DiskListing:
+    contents: tuple[Movie | TVShow, ...] = ()
+    failed_tmdb_ids: frozenset[int] = frozenset()
+
+
+@dataclass(frozen=True, slots=True)
+class DiskAccount:
+    key: str
+    token: str
+    path: str
+    update_interval: float
@@ -1,66 +1,359 @@
 import asyncio
 import logging
+import os
+import random
+import time
 from datetime import datetime
 from pathlib import Path
 
 import aiofiles
 import orjson
+from nicegui import Event
 
 import config
+import movies.images as images
+import movies.media_probe as media_probe
 import movies.tmdb as tmdb
 import movies.yandex_disk as yandex_disk
-from movies.classes import Movie, TVShow
+from monitoring import metrics, tracing
+from movies.classes import Movie, TVShow, Episode, DiskAccount
+from movies.search import SearchIndex
+from movies.utils import decode_contents
 from singleton import Singleton
 
+DB_FORMAT_VERSION = 3
+
+_MEDIA_PROBE_BATCH_SIZE = 50
+
+# What content cards and their dialogs show. File URLs are re-signed on every listing and probing only adds media info,
+# neither is worth redrawing a card for
+_DISPLAYED_FIELDS = ("title", "og_title", "poster_path", "genres", "release_date", "vote_average", "budget", "runtime",
+                     "number_of_seasons", "number_of_episodes", "in_production")
+
+# Contents listed on one disk account by TMDB ID
+Shard = dict[int, Movie | TVShow]
+
+
+def _displayed(content: Movie | TVShow) -> tuple:
+    return tuple(getattr(content, field, None) for field in _DISPLAYED_FIELDS)
+
+
+def _decode_db(file_content: bytes) -> tuple[dict, list[Movie | TVShow]]:
+    loaded_db = orjson.loads(file_content)
+    raw_contents = loaded_db.pop("contents", [])
+
+    if loaded_db.get("version") != DB_FORMAT_VERSION:
+        return loaded_db, []
+
+    return loaded_db, decode_contents(raw_contents)
+
 
 class MoviesDB(metaclass=Singleton):
     def __init__(self, db_path: Path | str):
         self.path = Path(db_path).resolve()
         self.contents = []
+        # Keyed by DiskAccount.key, _merge_shards walks them in the order of the configured accounts
+        self.shards: dict[str, Shard] = {}
+        self.shards_updated_at: dict[str, datetime] = {}
         self.by_tmdb_id: dict[int, Movie | TVShow] = {}
-        self.by_title: dict[str, Movie | TVShow] = {}
+        self.image_names: set[str] = set()
+        self.search_index = SearchIndex()
         self.last_updated = None
 
+        # Fired with the TMDB IDs of added, removed and changed contents after every refresh that changed something
+        self.contents_changed = Event[list[int], list[int], list[int]]()
+
+        # Failures end with the number of attempts and the monotonic time of the next retry
+        self._failed_accounts: dict[str, tuple[int, float]] = {}
+        self._failed_items: dict[tuple[str, int], tuple[Movie | TVShow, int, float]] = {}
+
+        self._save_lock = asyncio.Lock()
+
+        metrics.CATALOG_PENDING_RETRIES.set_function(
+            lambda: {("disk",): len(self._failed_accounts), ("content",): len(self._failed_items)})
+
     def _assign_content(self):
+        previous = self.by_tmdb_id
         self.by_tmdb_id = {}
-        self.by_title = {}
+        image_paths = set()
+        counts = {"movie": 0, "tv": 0, "episode": 0}
 
         for content in self.contents:
             tmdb_id = content.tmdb_id
             self.by_tmdb_id[tmdb_id] = content
+            image_paths.update((content.poster_path, content.backdrop_path))
+            counts[content.type] += 1
+            if content.type == "tv":
+                counts["episode"] += sum(len(season.episodes or ()) for season in content.seasons or ())
+                for season in content.seasons or ():
+                    image_paths.add(season.poster_path)
+                    image_paths.update(episode.still_path for episode in season.episodes or ())
+
+        # The image endpoint only serves images of the catalog, TMDB paths are "/<name>"
+        self.image_names = {path.lstrip("/") for path in image_paths if path}
+
+        for content_type, count in counts.items():
+            metrics.CATALOG_ITEMS.set(count, type=content_type)
+
+        self.search_index.build(self.contents)
+
+        added = [tmdb_id for tmdb_id in self.by_tmdb_id if tmdb_id not in previous]
+        removed = [tmdb_id for tmdb_id in previous if tmdb_id not in self.by_tmdb_id]
+        changed = [tmdb_id for tmdb_id, content in self.by_tmdb_id.items()
+                   if tmdb_id in previous and _displayed(previous[tmdb_id]) != _displayed(content)]
+        if added or removed or changed:
+            logging.info("Catalog changed: %s added, %s removed, %s changed", len(added), len(removed), len(changed))
+            self.contents_changed.emit(added, removed, changed)
 
-            title, og_title = content.title, content.og_title
-            title = title if title else ""
-            og_title = og_title if og_title else ""
-            full_title = title + og_title
-            if full_title:
-                self.by_title[full_title] = content
+    def _merge_shards(self):
+        # Accounts are merged in config order, so a title present on several disks always comes from the first one
+        contents = {}
+        owners = {}
+        for account in yandex_disk.get_accounts():
+            for tmdb_id, content in self.shards.get(account.key, {}).items():
+                if tmdb_id in contents:
+                    logging.debug("TMDB ID %s found on disk %s is already provided by disk %s", tmdb_id,
+                                  account.path, owners[tmdb_id])
+                    continue
+                contents[tmdb_id] = content
+                owners[tmdb_id] = account.path
+        self.contents = list(contents.values())
+
+    def get_file(self, tmdb_id: int, season_number: int | None = None,
+                 episode_number: int | None = None) -> Movie | Episode | None:
+        content = self.by_tmdb_id.get(tmdb_id)
+        if content is None:
+            return None
+
+        if content.type == "tv":
+            try:
+                return content.seasons[season_number - 1].episodes[episode_number - 1]
+            except (IndexError, TypeError):
+                return None
+
+        return content
+
+    def get_next_episode(self, tmdb_id: int, season_number: int | None,
+                         episode_number: int | None) -> tuple[int, int] | None:
+        content = self.by_tmdb_id.get(tmdb_id)
+        if content is None or content.type != "tv" or season_number is None or episode_number is None:
+            return None
+
+        seasons = content.seasons or ()
+        if season_number > len(seasons):
+            return None
+        if episode_number < len(seasons[season_number - 1].episodes or ()):
+            return season_number, episode_number + 1
+
+        for next_season_number in range(season_number + 1, len(seasons) + 1):
+            if seasons[next_season_number - 1].episodes:
+                return next_season_number, 1
+        return None
+
+    def search(self, query: str, limit: int | None = None) -> list[Movie | TVShow]:
+        return self.search_index.search(query, limit)
+
+    @staticmethod
+    def _schedule_retry(failures: dict, key, *value):
+        attempts = failures[key][-2] + 1 if key in failures else 1
+        delay = min(config.MOVIES_DB_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+                    config.MOVIES_DB_UPDATE_INTERVAL_SECONDS)
+        failures[key] = (*value, attempts, time.monotonic() + delay)
+
+    def _next_retry_at(self) -> float | None:
+        retry_times = [failure[-1] for failure in (*self._failed_accounts.values(), *self._failed_items.values())]
+        return min(retry_times, default=None)
 
     async def auto_update(self):
+        tasks = [self._auto_update_shard(account) for account in yandex_disk.get_accounts()]
+        await asyncio.gather(*tasks, self._auto_retry())
+
+    async def _auto_update_shard(self, account: DiskAccount):
+        # A random offset keeps the accounts from refreshing at the same instant
+        await asyncio.sleep(random.uniform(0, config.MOVIES_DB_UPDATE_JITTER_SECONDS))
+
+        while True:
+            await asyncio.sleep(account.update_interval)
+            await self.update_shard(account)
+
+    async def _auto_retry(self):
         while True:
-            await asyncio.sleep(config.MOVIES_DB_UPDATE_INTERVAL_SECONDS)
-            await self.update()
+            retry_at = self._next_retry_at()
+            delay = config.MOVIES_DB_RETRY_BASE_SECONDS if retry_at is None else retry_at - time.monotonic()
+            await asyncio.sleep(max(0.0, min(delay, config.MOVIES_DB_RETRY_BASE_SECONDS)))
+            await self._retry_failed()
+
+    async def auto_probe_media(self):
+        while True:
+            await self.probe_media()
+            await asyncio.sleep(config.MEDIA_PROBE_INTERVAL_SECONDS)
+
+    async def probe_media(self):
+        pending = [(key, content) for key, shard in self.shards.items() for content in shard.values()
+                   if media_probe.needs_probe(content)]
+        if not pending:
+            return
+
+        logging.info("Probing media of %s contents", len(pending))
+
+        # Every batch is visible at once, but the whole catalog is only written out now and then
+        saved_at = time.monotonic()
+        unsaved = False
+        for i in range(0, len(pending), _MEDIA_PROBE_BATCH_SIZE):
+            batch = pending[i:i + _MEDIA_PROBE_BATCH_SIZE]
+            results = await media_probe.probe_contents([content for _, content in batch])
+
+            # The shard may have been refreshed while probing, so results are merged into whatever is there now
+            for (key, content), result in zip(batch, results):
+                shard = self.shards.get(key, {})
+                if (current := shard.get(content.tmdb_id)) is not None:
+                    shard[content.tmdb_id] = media_probe.carry_over_media(current, result)
+
+            save = time.monotonic() - saved_at >= config.MEDIA_PROBE_SAVE_INTERVAL_SECONDS
+            await self._commit(save=save)
+            if save:
+                saved_at = time.monotonic()
+            unsaved = not save
+
+        if unsaved:
+            await self.save_to_disk()
+
+        logging.info("Finished probing media")
+
+    async def _fetch_metadata(self, raw_contents: list[Movie | TVShow]) -> list[Movie | TVShow | BaseException]:
+        with tracing.span("catalog.fetch_metadata", items=len(raw_contents)):
+            try:
+                results = await tmdb.fetch_all_data(raw_contents)
+            except Exception as e:
+                logging.error("Failed to fetch TMDB data: %s", e)
+                results = [e] * len(raw_contents)
+            tracing.annotate(failed=sum(isinstance(result, BaseException) for result in results))
+            return results
+
+    def _apply_metadata(self, key: str, shard: Shard, raw_contents: list[Movie | TVShow],
+                        results: list[Movie | TVShow | BaseException]):
+        previous_shard = self.shards.get(key, {})
+
+        for raw_content, result in zip(raw_contents, results):
+            tmdb_id = raw_content.tmdb_id
+            if isinstance(result, BaseException):
+                logging.warning("Keeping previous data for %s %s after failed fetch: %s", raw_content.type, tmdb_id,
+                                result)
+                if tmdb_id in previous_shard:
+                    shard[tmdb_id] = previous_shard[tmdb_id]
+                self._schedule_retry(self._failed_items, (key, tmdb_id), raw_content)
+            else:
+                shard[tmdb_id] = media_probe.carry_over_media(result, previous_shard.get(tmdb_id))
+                self._failed_items.pop((key, tmdb_id), None)
+
+    async def _refresh_accounts(self, accounts: list[DiskAccount]):
+        with tracing.span("catalog.list_disks", disks=len(accounts)):
+            listings = await yandex_disk.get_all_contents(accounts)
+            tracing.annotate(items=sum(len(listing.contents) for listing in listings.values()
+                                       if not isinstance(listing, BaseException)))
+
+        refreshed = {}
+        for key, listing in listings.items():
+            if isinstance(listing, BaseException):
+                self._schedule_retry(self._failed_accounts, key)
+                continue
+
+            previous_shard = self.shards.get(key, {})
+            shard = {tmdb_id: previous_shard[tmdb_id]
+                     for tmdb_id in listing.failed_tmdb_ids if tmdb_id in previous_shard}
+            if listing.failed_tmdb_ids:
+                self._schedule_retry(self._failed_accounts, key)
+            else:
+                self._failed_accounts.pop(key, None)
+
+            for failed_key in [k for k in self._failed_items if k[0] == key]:
+                del self._failed_items[failed_key]
+
+            self.shards_updated_at[key] = datetime.now()
+
+            refreshed[key] = (shard, list(listing.contents))
+
+        raw_contents = [raw for _, raws in refreshed.values() for raw in raws]
+        results = iter(await self._fetch_metadata(raw_contents))
+
+        for key, (shard, raws) in refreshed.items():
+            self._apply_metadata(key, shard, raws, [next(results) for _ in raws])
+            self.shards[key] = shard
+
+    async def _retry_failed(self):
+        now = time.monotonic()
+        accounts = [account for account in yandex_disk.get_accounts()
+                    if account.key in self._failed_accounts and self._failed_accounts[account.key][1] <= now]
+        account_keys = {account.key for account in accounts}
+        items = [(key, raw) for (key, _), (raw, _, retry_at) in self._failed_items.items()
+                 if retry_at <= now and key not in account_keys]
+
+        if not accounts and not items:
+            return
+
+        logging.info("Retrying %s failed disks and %s failed contents", len(accounts), len(items))
+
+        with metrics.CATALOG_REFRESH_SECONDS.time(scope="retry"), tracing.trace("catalog.retry"):
+            if accounts:
+                await self._refresh_accounts(accounts)
+
+            if items:
+                results = await self._fetch_metadata([raw for _, raw in items])
+                for (key, raw), result in zip(items, results):
+                    shard = self.shards.setdefault(key, {})
+                    self._apply_metadata(key, shard, [raw], [result])
+
+            await self._commit()
+
+    async def _commit(self, save: bool = True):
+        with tracing.span("catalog.merge"):
+            self._merge_shards()
+        self.last_updated = datetime.now()
+        if save:
+            await self.save_to_disk()
+        with tracing.span("catalog.index", items=len(self.contents)):
+            self._assign_content()
 
     async def update(self):
         logging.info("Updating Movies DB")
 
-        raw_contents = await yandex_disk.get_all_contents()
-        self.contents = await tmdb.fetch_all_data(raw_contents)
-        self.last_updated = datetime.now()
-        await self.save_to_disk()
-        self._assign_content()
+        with metrics.CATALOG_REFRESH_SECONDS.time(scope="full"), tracing.trace("catalog.update"):
+            await self._refresh_accounts(yandex_disk.get_accounts())
+            await self._commit()
+
+        logging.info("Finished updating Movies DB (%s disks and %s contents awaiting retry)",
+                     len(self._failed_accounts), len(self._failed_items))
+
+    async def update_shard(self, account: DiskAccount):
+        logging.info("Updating Movies DB shard for disk %s", account.path)
 
-        logging.info("Finished updating Movies DB")
+        with (metrics.CATALOG_REFRESH_SECONDS.time(scope="shard"),
+              tracing.trace("catalog.update_shard", disk=account.path)):
+            await self._refresh_accounts([account])
+            await self._commit()
+
+        logging.info("Finished updating Movies DB shard for disk %s (last success: %s)", account.path,
+                     self.shards_updated_at.get(account.key))
 
     async def save_to_disk(self):
         logging.info("Saving Movies DB to disk")
 
-        to_save = await asyncio.to_thread(orjson.dumps, {
-            "last_updated": self.last_updated,
-            "contents": self.contents
-        })
-        async with aiofiles.open(self.path, "wb") as file:
-            await file.write(to_save)
+        # Snapshots are taken under the lock too, so an older catalog never overwrites a newer one on disk
+        async with self._save_lock:
+            with tracing.span("catalog.serialize", items=len(self.contents)):
+                to_save = await asyncio.to_thread(orjson.dumps, {
+                    "version": DB_FORMAT_VERSION,
+                    "last_updated": self.last_updated,
+                    "image_base_url": images.get_base_url(),
+                    "shards": {key: list(shard) for key, shard in self.shards.items()},
+                    "contents": self.contents
+                })
+                tracing.annotate(bytes=len(to_save))
+            with tracing.span("catalog.write", bytes=len(to_save)):
+                tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+                async with aiofiles.open(tmp_path, "wb") as file:
+                    await file.write(to_save)
+                os.replace(tmp_path, self.path)
 
         logging.info("Finished Saving Movies DB to disk")
 
@@ -76,20 +369,24 @@ class MoviesDB(metaclass=Singleton):
             if len(file_content) == 0:
                 return
 
-            loaded_db = await asyncio.to_thread(orjson.loads, file_content)
-            self.last_updated = loaded_db.get("last_updated", None)
-            contents = loaded_db.get("contents", [])
-
-        new_contents = []
-        for content in contents:
-            match content["type"]:
-                case "movie":
-                    new_contents.append(Movie(**content))
-                case "tv":
-                    new_contents.append(TVShow(**content))
-                case _:
-                    continue
-        self.contents = new_contents
+            header, contents = await asyncio.to_thread(_decode_db, file_content)
+
+        if (version := header.get("version")) != DB_FORMAT_VERSION:
+            logging.warning("Movies DB on disk has format version %s, expected %s. It will be rebuilt on next update",
+                            version, DB_FORMAT_VERSION)
+            return
+
+        if images.get_base_url() is None:
+            images.set_base_url(header.get("image_base_url"))
+
+        last_updated = header.get("last_updated")
+        self.last_updated = datetime.fromisoformat(last_updated) if last_updated else None
+        by_tmdb_id = {content.tmdb_id: content for content in contents}
+        self.shards = {
+            key: {tmdb_id: by_tmdb_id[tmdb_id] for tmdb_id in tmdb_ids if tmdb_id in by_tmdb_id}
+            for key, tmdb_ids in header.get("shards", {}).items()
+        }
+        self.contents = contents
         self._assign_content()
 
         logging.info("Finished Loading Movies DB from disk")
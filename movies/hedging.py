@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+import config
+from monitoring import metrics, tracing
+
+T = TypeVar("T")
+
+_LATENCY_WINDOW = 256
+
+
+class LatencyTracker:
+    def __init__(self, window: int = _LATENCY_WINDOW):
+        self.window = window
+        self.samples: dict[str, deque[float]] = {}
+        self.hedges: dict[str, int] = {}
+        self.hedge_wins: dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float):
+        if (samples := self.samples.get(endpoint)) is None:
+            samples = self.samples[endpoint] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def percentile(self, endpoint: str, percent: float, min_samples: int = 1) -> float | None:
+        samples = self.samples.get(endpoint)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+    def stats(self) -> dict[str, dict]:
+        return {
+            endpoint: {
+                "count": len(samples),
+                "p50": self.percentile(endpoint, 50),
+                "p95": self.percentile(endpoint, 95),
+                "p99": self.percentile(endpoint, 99),
+                "hedges": self.hedges.get(endpoint, 0),
+                "hedge_wins": self.hedge_wins.get(endpoint, 0),
+            }
+            for endpoint, samples in self.samples.items()
+        }
+
+
+LATENCY_TRACKER = LatencyTracker()
+
+
+def _outcome(error: Exception) -> str:
+    if (status := getattr(error, "status", None)) is not None:
+        return str(status)
+    return type(error).__name__
+
+
+async def _timed(endpoint: str, request: Callable[[], Awaitable[T]]) -> T:
+    with tracing.span(f"request {endpoint}", endpoint=endpoint):
+        start = time.monotonic()
+        try:
+            result = await request()
+        except Exception as e:
+            metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint, outcome=_outcome(e))
+            tracing.annotate(outcome=_outcome(e))
+            raise
+
+        elapsed = time.monotonic() - start
+        LATENCY_TRACKER.record(endpoint, elapsed)
+        metrics.UPSTREAM_REQUESTS.inc(endpoint=endpoint, outcome="ok")
+        metrics.UPSTREAM_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+        tracing.annotate(outcome="ok")
+        return result
+
+
+async def hedged(endpoint: str, request: Callable[[], Awaitable[T]], semaphore: asyncio.Semaphore) -> T:
+    # Latencies and the hedge timer start once a permit is held, time spent queued for one says nothing about upstream
+    async with semaphore:
+        threshold = None
+        if config.ENABLE_REQUEST_HEDGING:
+            threshold = LATENCY_TRACKER.percentile(endpoint, config.HEDGING_PERCENTILE, config.HEDGING_MIN_SAMPLES)
+
+        if threshold is None:
+            return await _timed(endpoint, request)
+
+        started_at = time.monotonic()
+        primary = asyncio.create_task(_timed(endpoint, request))
+        tasks = {primary}
+        hedge_permit = False
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if not done:
+                # A hedge only goes out on a free permit, otherwise it would just queue behind other requests
+                if semaphore.locked():
+                    metrics.UPSTREAM_HEDGES.inc(endpoint=endpoint, result="skipped")
+                else:
+                    await semaphore.acquire()
+                    hedge_permit = True
+                    logging.debug("Request to %s is slower than %.3fs, sending a hedged request", endpoint, threshold)
+                    LATENCY_TRACKER.hedges[endpoint] = LATENCY_TRACKER.hedges.get(endpoint, 0) + 1
+                    metrics.UPSTREAM_HEDGES.inc(endpoint=endpoint, result="sent")
+                    tasks.add(asyncio.create_task(_timed(endpoint, request)))
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            LATENCY_TRACKER.hedge_wins[endpoint] = LATENCY_TRACKER.hedge_wins.get(endpoint, 0) + 1
+                            metrics.UPSTREAM_HEDGES.inc(endpoint=endpoint, result="won")
+                            # The cancelled primary would otherwise never be sampled and the threshold would only shrink
+                            LATENCY_TRACKER.record(endpoint, time.monotonic() - started_at)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if hedge_permit:
+                semaphore.release()
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+import re
+from pathlib import Path
+
+import aiofiles
+
+import movies.tmdb as tmdb
+from monitoring import metrics
+from singleton import Singleton
+
+# Every size is downloaded from TMDB on its own, images are never resized locally
+ALLOWED_SIZES = frozenset({"w92", "w154", "w185", "w300", "w342", "w500", "w780", "w1280", "original"})
+
+_IMAGE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_\-]+\.(jpg|jpeg|png|webp|svg)$")
+
+
+class ImageCache(metaclass=Singleton):
+    def __init__(self, cache_dir: Path | str, max_bytes: int):
+        self.path = Path(cache_dir).resolve()
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._pending: dict[Path, asyncio.Task] = {}
+        self._evicting = False
+
+    @staticmethod
+    def is_valid(size: str, name: str) -> bool:
+        return size in ALLOWED_SIZES and _IMAGE_NAME_PATTERN.match(name) is not None
+
+    def _scan(self) -> int:
+        self.path.mkdir(parents=True, exist_ok=True)
+        return sum(file.stat().st_size for file in self.path.rglob("*") if file.is_file())
+
+    async def load_from_disk(self):
+        self.total_bytes = await asyncio.to_thread(self._scan)
+        logging.info("Image cache holds %s bytes in %s", self.total_bytes, self.path)
+
+    def _evict(self) -> int:
+        files = [(file.stat(), file) for file in self.path.rglob("*") if file.is_file()]
+        files.sort(key=lambda item: item[0].st_mtime)
+
+        total = sum(stat.st_size for stat, _ in files)
+        target = self.max_bytes * 0.9
+        for stat, file in files:
+            if total <= target:
+                break
+            file.unlink(missing_ok=True)
+            total -= stat.st_size
+        return total
+
+    async def _evict_if_needed(self):
+        if self.total_bytes <= self.max_bytes or self._evicting:
+            return
+
+        self._evicting = True
+        try:
+            logging.info("Image cache is over %s bytes, evicting least recently used images", self.max_bytes)
+            self.total_bytes = await asyncio.to_thread(self._evict)
+        finally:
+            self._evicting = False
+
+    async def _download(self, size: str, name: str, file_path: Path):
+        data = await tmdb.fetch_image(size, f"/{name}")
+
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+        async with aiofiles.open(tmp_path, "wb") as file:
+            await file.write(data)
+        os.replace(tmp_path, file_path)
+
+        self.total_bytes += len(data)
+        await self._evict_if_needed()
+
+    async def get(self, size: str, name: str) -> Path:
+        file_path = self.path / size / name
+
+        if file_path.exists():
+            metrics.CACHE_REQUESTS.inc(cache="images", result="hit")
+            # mtime doubles as the last access time for LRU eviction
+            await asyncio.to_thread(os.utime, file_path)
+            return file_path
+
+        metrics.CACHE_REQUESTS.inc(cache="images", result="miss")
+        if (task := self._pending.get(file_path)) is None:
+            task = asyncio.create_task(self._download(size, name, file_path))
+            self._pending[file_path] = task
+            task.add_done_callback(lambda _: self._pending.pop(file_path, None))
+
+        await asyncio.shield(task)
+        return file_path
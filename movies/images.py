@@ -0,0 +1,18 @@
+_BASE_IMAGE_URL: str | None = None
+
+IMAGES_ROUTE = "/images"
+
+
+def get_base_url() -> str | None:
+    return _BASE_IMAGE_URL
+
+
+def set_base_url(base_url: str | None):
+    global _BASE_IMAGE_URL
+    _BASE_IMAGE_URL = base_url
+
+
+def image_url(path: str | None, size: str = "original") -> str | None:
+    if not path:
+        return None
+    return f"{IMAGES_ROUTE}/{size}{path}"
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import struct
+from dataclasses import replace
+
+import aiohttp
+
+import config
+from movies.classes import Movie, TVShow, Episode, MediaInfo
+from movies.proxies import PROXY_POOL
+
+_HEADER_READ_BYTES = 64 * 1024
+_BOX_HEADER_BYTES = 16
+_MAX_MOOV_BYTES = 32 * 1024 * 1024
+_MAX_TOP_LEVEL_BOXES = 64
+
+_MATROSKA_MAGIC = b"\x1a\x45\xdf\xa3"
+
+_MEDIA_PROBE_SEMAPHORE = asyncio.Semaphore(config.MEDIA_PROBE_CONCURRENT_REQUESTS_LIMIT)
+
+
+def _read_box_header(data: bytes, offset: int, end: int) -> tuple[bytes, int, int] | None:
+    if offset + 8 > end:
+        return None
+
+    size, box_type = struct.unpack_from(">I4s", data, offset)
+    header_size = 8
+    if size == 1:
+        if offset + 16 > end:
+            return None
+        size = struct.unpack_from(">Q", data, offset + 8)[0]
+        header_size = 16
+    elif size == 0:
+        size = end - offset
+
+    if size < header_size:
+        return None
+
+    return box_type, header_size, size
+
+
+def _iter_boxes(data: bytes, start: int, end: int):
+    offset = start
+    while (header := _read_box_header(data, offset, end)) is not None:
+        box_type, header_size, size = header
+        yield box_type, offset + header_size, min(offset + size, end)
+        offset += size
+
+
+def _find_box(data: bytes, start: int, end: int, *path: bytes) -> tuple[int, int] | None:
+    for box_type, payload_start, payload_end in _iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload_start, payload_end
+            return _find_box(data, payload_start, payload_end, *path[1:])
+    return None
+
+
+def _parse_mvhd(data: bytes, start: int) -> float | None:
+    version = data[start]
+    if version == 1:
+        timescale, duration = struct.unpack_from(">IQ", data, start + 20)
+    else:
+        timescale, duration = struct.unpack_from(">II", data, start + 12)
+    return duration / timescale if timescale else None
+
+
+def _parse_track(data: bytes, start: int, end: int) -> tuple[bytes | None, str | None]:
+    if (mdia := _find_box(data, start, end, b"mdia")) is None:
+        return None, None
+
+    handler = None
+    if (hdlr := _find_box(data, *mdia, b"hdlr")) is not None:
+        handler = data[hdlr[0] + 8:hdlr[0] + 12]
+
+    codec = None
+    if (stsd := _find_box(data, *mdia, b"minf", b"stbl", b"stsd")) is not None:
+        # The first sample entry follows the version/flags and entry count fields
+        if (entry := _read_box_header(data, stsd[0] + 8, stsd[1])) is not None:
+            codec = entry[0].decode("latin-1").strip()
+
+    return handler, codec
+
+
+def _parse_moov(data: bytes, file_size: int | None, fast_start: bool) -> MediaInfo:
+    duration = None
+    video_codec = None
+    audio_codec = None
+
+    for box_type, start, end in _iter_boxes(data, 0, len(data)):
+        if box_type == b"mvhd":
+            duration = _parse_mvhd(data, start)
+        elif box_type == b"trak":
+            handler, codec = _parse_track(data, start, end)
+            if handler == b"vide" and video_codec is None:
+                video_codec = codec
+            elif handler == b"soun" and audio_codec is None:
+                audio_codec = codec
+
+    bitrate = int(file_size * 8 / duration) if file_size and duration else None
+
+    return MediaInfo(
+        container="mp4",
+        duration=round(duration, 3) if duration is not None else None,
+        bitrate=bitrate,
+        video_codec=video_codec,
+        audio_codec=audio_codec,
+        fast_start=fast_start,
+    )
+
+
+async def _read_range(session: aiohttp.ClientSession, url: str, start: int, end: int,
+                      proxy: str | None) -> tuple[bytes, int | None]:
+    async with PROXY_POOL.track(proxy):
+        async with session.get(url, headers={"Range": f"bytes={start}-{end}"}, proxy=proxy) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                raise ValueError(f"Server ignored range request (status {response.status})")
+
+            total_size = None
+            if (content_range := response.headers.get("Content-Range", "")).rpartition("/")[2].isdigit():
+                total_size = int(content_range.rpartition("/")[2])
+
+            return await response.read(), total_size
+
+
+async def probe(session: aiohttp.ClientSession, url: str, file_size: int | None = None,
+                proxy: str | None = None) -> MediaInfo:
+    data, total_size = await _read_range(session, url, 0, _HEADER_READ_BYTES - 1, proxy)
+    file_size = total_size or file_size
+
+    if data[4:8] != b"ftyp":
+        return MediaInfo(container="matroska" if data.startswith(_MATROSKA_MAGIC) else "unknown")
+
+    # Top-level boxes are walked by their headers, so only the moov box itself is ever downloaded
+    data_offset = 0
+    offset = 0
+    seen_mdat = False
+    for _ in range(_MAX_TOP_LEVEL_BOXES):
+        if file_size is not None and offset >= file_size:
+            break
+
+        if offset + _BOX_HEADER_BYTES > data_offset + len(data):
+            data, _ = await _read_range(session, url, offset, offset + _BOX_HEADER_BYTES - 1, proxy)
+            data_offset = offset
+
+        if (header := _read_box_header(data, offset - data_offset, len(data))) is None:
+            break
+        box_type, header_size, size = header
+
+        if box_type == b"moov":
+            if size > _MAX_MOOV_BYTES:
+                raise ValueError(f"moov box is too large: {size} bytes")
+            if offset + size <= data_offset + len(data):
+                moov = data[offset - data_offset + header_size:offset - data_offset + size]
+            else:
+                moov, _ = await _read_range(session, url, offset + header_size, offset + size - 1, proxy)
+            return _parse_moov(moov, file_size, fast_start=not seen_mdat)
+
+        if box_type == b"mdat":
+            seen_mdat = True
+
+        offset += size
+
+    raise ValueError("No moov box found")
+
+
+def needs_probe(content: Movie | TVShow) -> bool:
+    if content.type == "movie":
+        return content.file_url is not None and content.media is None
+    return any(episode.file_url is not None and episode.media is None
+               for season in content.seasons or () for episode in season.episodes or ())
+
+
+async def _probe_file(session: aiohttp.ClientSession, file: Movie | Episode) -> MediaInfo | None:
+    proxy = PROXY_POOL.choose() if config.YANDEX_DISK_USE_PROXIES else None
+    async with _MEDIA_PROBE_SEMAPHORE:
+        try:
+            media = await probe(session, file.file_url, file.file_size, proxy)
+        except (ValueError, IndexError, struct.error) as e:
+            logging.warning("Failed to parse media container of %s: %s", file.file_url, e)
+            return MediaInfo(container="unknown")
+        except (aiohttp.ClientError, TimeoutError) as e:
+            logging.warning("Failed to probe %s: %s", file.file_url, e)
+            return None
+
+    if media.fast_start is False:
+        logging.info("File %s has its moov box at the end, playback will start slowly", file.file_url)
+    return media
+
+
+async def _probe_episode(session: aiohttp.ClientSession, episode: Episode) -> Episode:
+    if episode.file_url is None or episode.media is not None:
+        return episode
+    return replace(episode, media=await _probe_file(session, episode))
+
+
+async def _probe_content(session: aiohttp.ClientSession, content: Movie | TVShow) -> Movie | TVShow:
+    if content.type == "movie":
+        if content.file_url is None or content.media is not None:
+            return content
+        return replace(content, media=await _probe_file(session, content))
+
+    seasons = []
+    for season in content.seasons or ():
+        episodes = await asyncio.gather(*(_probe_episode(session, episode) for episode in season.episodes or ()))
+        seasons.append(replace(season, episodes=tuple(episodes)))
+    return replace(content, seasons=tuple(seasons))
+
+
+async def probe_contents(contents: list[Movie | TVShow]) -> list[Movie | TVShow]:
+    logging.info("Probing media files of %s contents", len(contents))
+
+    timeout = aiohttp.ClientTimeout(total=config.MEDIA_PROBE_TIMEOUT_SECONDS)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        return await asyncio.gather(*(_probe_content(session, content) for content in contents))
+
+
+def carry_over_media(content: Movie | TVShow, previous: Movie | TVShow | None) -> Movie | TVShow:
+    # File URLs are re-signed on every listing, so the file size stands in for the file identity
+    if previous is None or previous.type != content.type:
+        return content
+
+    if content.type == "movie":
+        if content.media is None and previous.media is not None and previous.file_size == content.file_size:
+            return replace(content, media=previous.media)
+        return content
+
+    known = {(episode.season_number, episode.episode_number): episode
+             for season in previous.seasons or () for episode in season.episodes or () if episode.media is not None}
+    if not known:
+        return content
+
+    seasons = []
+    for season in content.seasons or ():
+        episodes = []
+        for episode in season.episodes or ():
+            previous_episode = known.get((episode.season_number, episode.episode_number))
+            if (episode.media is None and previous_episode is not None
+                    and previous_episode.file_size == episode.file_size):
+                episode = replace(episode, media=previous_episode.media)
+            episodes.append(episode)
+        seasons.append(replace(season, episodes=tuple(episodes)))
+    return replace(content, seasons=tuple(seasons))
+
+
+def preload_hint(media: MediaInfo | None) -> str:
+    # Without fast start the browser has to fetch the index from the end of the file before it can play anything,
+    # so that work is started as soon as the source is set
+    if media is not None and media.fast_start is False:
+        return "auto"
+    return "metadata"
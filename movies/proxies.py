@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+import aiohttp
+from yarl import URL
+
+import config
+from monitoring import metrics
+
+_EWMA_ALPHA = 0.3
+_TOP_CANDIDATES = 3
+
+# Errors that say something about the proxy itself rather than about the upstream API
+_PROXY_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientHttpProxyError, asyncio.TimeoutError)
+
+
+def _display_url(proxy: str) -> str:
+    return str(URL(proxy).with_user(None))
+
+
+@dataclass
+class ProxyStats:
+    url: str
+
+    latency_ewma: float | None = None
+    success_ewma: float = 1.0
+
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+
+    ejected_until: float = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return self.ejected_until <= time.monotonic()
+
+    @property
+    def score(self) -> float:
+        latency = self.latency_ewma if self.latency_ewma is not None else 0.0
+        return latency / max(self.success_ewma, 0.05)
+
+
+class ProxyPool:
+    def __init__(self, proxies: list[str]):
+        self.proxies = {proxy: ProxyStats(url=proxy) for proxy in proxies}
+
+        metrics.PROXY_HEALTHY.set_function(lambda: self._gauge("healthy"))
+        metrics.PROXY_LATENCY_SECONDS.set_function(lambda: self._gauge("latency_ewma"))
+        metrics.PROXY_SUCCESS_RATIO.set_function(lambda: self._gauge("success_ewma"))
+        metrics.PROXY_SCORE.set_function(lambda: self._gauge("score"))
+        metrics.PROXY_REQUESTS.set_function(lambda: {
+            (stats["url"], outcome): count for stats in self.stats()
+            for outcome, count in (("ok", stats["requests"] - stats["failures"]), ("failed", stats["failures"]))
+        })
+
+    def choose(self) -> str | None:
+        if not self.proxies:
+            return None
+
+        healthy = [stats for stats in self.proxies.values() if stats.healthy]
+        if not healthy:
+            return min(self.proxies.values(), key=lambda s: s.ejected_until).url
+
+        # Unmeasured proxies are tried first so every proxy gets a latency estimate
+        unmeasured = [stats for stats in healthy if stats.latency_ewma is None]
+        if unmeasured:
+            return random.choice(unmeasured).url
+
+        # The fastest proxies share the load in inverse proportion to their score
+        candidates = sorted(healthy, key=lambda s: s.score)[:_TOP_CANDIDATES]
+        weights = [1 / max(stats.score, 0.001) for stats in candidates]
+        return random.choices(candidates, weights=weights)[0].url
+
+    def report(self, proxy: str | None, success: bool, latency: float | None = None):
+        if (stats := self.proxies.get(proxy)) is None:
+            return
+
+        stats.requests += 1
+        stats.success_ewma += _EWMA_ALPHA * ((1.0 if success else 0.0) - stats.success_ewma)
+
+        if success:
+            stats.consecutive_failures = 0
+            if latency is not None:
+                if stats.latency_ewma is None:
+                    stats.latency_ewma = latency
+                else:
+                    stats.latency_ewma += _EWMA_ALPHA * (latency - stats.latency_ewma)
+            return
+
+        stats.failures += 1
+        stats.consecutive_failures += 1
+        if stats.consecutive_failures >= config.PROXY_EJECT_AFTER_FAILURES and stats.healthy:
+            logging.warning("Ejecting proxy %s for %s seconds after %s consecutive failures", _display_url(proxy),
+                            config.PROXY_EJECT_COOLDOWN_SECONDS, stats.consecutive_failures)
+            stats.ejected_until = time.monotonic() + config.PROXY_EJECT_COOLDOWN_SECONDS
+
+    @asynccontextmanager
+    async def track(self, proxy: str | None):
+        start = time.monotonic()
+        try:
+            yield
+        except _PROXY_ERRORS:
+            self.report(proxy, False)
+            raise
+        except aiohttp.ClientResponseError:
+            self.report(proxy, True, time.monotonic() - start)
+            raise
+        self.report(proxy, True, time.monotonic() - start)
+
+    async def _probe(self, session: aiohttp.ClientSession, proxy: str):
+        try:
+            async with self.track(proxy):
+                async with session.get(config.PROXY_PROBE_URL, proxy=proxy) as response:
+                    await response.read()
+        except Exception as e:
+            logging.debug("Probe through proxy %s failed: %s", _display_url(proxy), e)
+
+    async def probe_all(self):
+        timeout = aiohttp.ClientTimeout(total=config.PROXY_PROBE_TIMEOUT_SECONDS)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await asyncio.gather(*(self._probe(session, proxy) for proxy in self.proxies))
+
+        logging.info("Proxy pool: %s of %s proxies healthy", sum(s.healthy for s in self.proxies.values()),
+                     len(self.proxies))
+
+    async def auto_probe(self):
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(config.PROXY_PROBE_INTERVAL_SECONDS)
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "url": _display_url(stats.url),
+                "healthy": stats.healthy,
+                "latency_ewma": stats.latency_ewma,
+                "success_ewma": round(stats.success_ewma, 3),
+                "score": stats.score if stats.latency_ewma is not None else None,
+                "requests": stats.requests,
+                "failures": stats.failures,
+            }
+            for stats in self.proxies.values()
+        ]
+
+    def _gauge(self, field: str) -> dict[tuple, float]:
+        # Proxies without a latency estimate yet have no sample rather than a made-up one
+        return {(stats["url"],): float(stats[field]) for stats in self.stats() if stats[field] is not None}
+
+
+PROXY_POOL = ProxyPool(config.PROXIES)
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+
+import config
+from movies.classes import MediaInfo
+from singleton import Singleton
+
+REMUX_ROUTE = "/remux"
+HLS_MIME_TYPE = "application/vnd.apple.mpegurl"
+PLAYLIST_NAME = "index.m3u8"
+INIT_SEGMENT_NAME = "init.mp4"
+
+_COMPLETE_MARKER = ".complete"
+_WAIT_POLL_SECONDS = 0.1
+
+_STREAM_ID_PATTERN = re.compile(r"^(\d+)(?:-(\d+)-(\d+))?$")
+_FILE_NAME_PATTERN = re.compile(r"^(index\.m3u8|init\.mp4|segment_\d{5}\.m4s)$")
+
+
+class RemuxBusyError(Exception):
+    pass
+
+
+def stream_id(tmdb_id: int, season_number: int | None = None, episode_number: int | None = None) -> str:
+    if season_number is None or episode_number is None:
+        return str(tmdb_id)
+    return f"{tmdb_id}-{season_number}-{episode_number}"
+
+
+def parse_stream_id(value: str) -> tuple[int, int | None, int | None]:
+    tmdb_id, season_number, episode_number = _STREAM_ID_PATTERN.match(value).groups()
+    return (int(tmdb_id), int(season_number) if season_number else None,
+            int(episode_number) if episode_number else None)
+
+
+def stream_url(value: str) -> str:
+    return f"{REMUX_ROUTE}/{value}/{PLAYLIST_NAME}"
+
+
+def should_remux(media: MediaInfo | None) -> bool:
+    return media is not None and (media.fast_start is False or media.container == "matroska")
+
+
+class RemuxCache(metaclass=Singleton):
+    def __init__(self, cache_dir: Path | str, max_bytes: int, ffmpeg_path: str):
+        self.path = Path(cache_dir).resolve()
+        self.max_bytes = max_bytes
+        self.ffmpeg_path = ffmpeg_path
+        self._running: dict[Path, asyncio.Task] = {}
+        self._evicting = False
+
+    @staticmethod
+    def is_valid(value: str, name: str) -> bool:
+        return _STREAM_ID_PATTERN.match(value) is not None and _FILE_NAME_PATTERN.match(name) is not None
+
+    @property
+    def remuxing(self) -> int:
+        return len(self._running)
+
+    def _stream_dir(self, value: str, file_size: int | None) -> Path:
+        # The file size is part of the directory, so a file replaced on disk is remuxed again
+        return self.path / f"{value}-{file_size or 0}"
+
+    def _clean_incomplete(self) -> int:
+        self.path.mkdir(parents=True, exist_ok=True)
+        removed = 0
+        for stream_dir in self.path.iterdir():
+            if stream_dir.is_dir() and not (stream_dir / _COMPLETE_MARKER).exists():
+                shutil.rmtree(stream_dir, ignore_errors=True)
+                removed += 1
+        return removed
+
+    async def load_from_disk(self):
+        removed = await asyncio.to_thread(self._clean_incomplete)
+        logging.info("Remux cache in %s is ready (%s interrupted streams removed)", self.path, removed)
+
+    def _evict(self):
+        streams = []
+        for stream_dir in self.path.iterdir():
+            if not stream_dir.is_dir() or stream_dir in self._running:
+                continue
+            size = sum(file.stat().st_size for file in stream_dir.iterdir() if file.is_file())
+            streams.append((stream_dir.stat().st_mtime, size, stream_dir))
+        streams.sort()
+
+        total = sum(size for _, size, _ in streams)
+        target = self.max_bytes * 0.9
+        for _, size, stream_dir in streams:
+            if total <= target:
+                break
+            shutil.rmtree(stream_dir, ignore_errors=True)
+            total -= size
+
+    async def _evict_if_needed(self):
+        if self._evicting:
+            return
+
+        self._evicting = True
+        try:
+            await asyncio.to_thread(self._evict)
+        finally:
+            self._evicting = False
+
+    async def _remux(self, stream_dir: Path, file_url: str):
+        logging.info("Remuxing %s into %s", file_url, stream_dir)
+
+        stream_dir.mkdir(parents=True, exist_ok=True)
+        started_at = time.monotonic()
+        # Stream copy only: the container changes, the audio and video bitstreams are never re-encoded
+        process = await asyncio.create_subprocess_exec(
+            self.ffmpeg_path, "-nostdin", "-loglevel", "error",
+            "-i", file_url,
+            "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+            "-f", "hls",
+            "-hls_time", str(config.REMUX_SEGMENT_SECONDS),
+            "-hls_playlist_type", "event",
+            "-hls_segment_type", "fmp4",
+            "-hls_fmp4_init_filename", INIT_SEGMENT_NAME,
+            "-hls_flags", "temp_file+independent_segments",
+            "-hls_segment_filename", str(stream_dir / "segment_%05d.m4s"),
+            str(stream_dir / PLAYLIST_NAME),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+
+        if process.returncode != 0:
+            logging.error("Failed to remux %s: %s", file_url, stderr.decode(errors="replace").strip())
+            shutil.rmtree(stream_dir, ignore_errors=True)
+            return
+
+        (stream_dir / _COMPLETE_MARKER).touch()
+        logging.info("Finished remuxing %s in %.1fs", stream_dir.name, time.monotonic() - started_at)
+
+        await self._evict_if_needed()
+
+    async def _wait_for(self, stream_dir: Path, name: str) -> Path:
+        # Segments are renamed into place by ffmpeg, so a file that exists is always complete
+        playlist_path = stream_dir / PLAYLIST_NAME
+        file_path = stream_dir / name
+        deadline = time.monotonic() + config.REMUX_WAIT_TIMEOUT_SECONDS
+
+        while True:
+            running = stream_dir in self._running
+            if playlist_path.exists() and file_path.exists():
+                return file_path
+            if not running or time.monotonic() > deadline:
+                raise FileNotFoundError(file_path)
+            await asyncio.sleep(_WAIT_POLL_SECONDS)
+
+    async def get(self, value: str, name: str, file_url: str, file_size: int | None) -> Path:
+        stream_dir = self._stream_dir(value, file_size)
+
+        if not (stream_dir / _COMPLETE_MARKER).exists() and stream_dir not in self._running:
+            # Every job is an ffmpeg process writing to disk, so only a few run at once and the rest are turned away
+            if len(self._running) >= config.MAX_CONCURRENT_REMUXES:
+                raise RemuxBusyError(f"{len(self._running)} remuxes are already running")
+            task = asyncio.create_task(self._remux(stream_dir, file_url))
+            self._running[stream_dir] = task
+            task.add_done_callback(lambda _: self._running.pop(stream_dir, None))
+
+        if stream_dir.exists():
+            # mtime doubles as the last access time for LRU eviction
+            await asyncio.to_thread(os.utime, stream_dir)
+
+        return await self._wait_for(stream_dir, name)
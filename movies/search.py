@@ -0,0 +1,122 @@
+import heapq
+import unicodedata
+from bisect import bisect_left
+
+from movies.classes import Movie, TVShow
+
+TITLE_WEIGHT = 4
+OG_TITLE_WEIGHT = 3
+YEAR_WEIGHT = 2
+GENRE_WEIGHT = 1
+
+EXACT_MATCH_BONUS = 2
+CACHED_PREFIX_LENGTH = 2
+
+
+def normalize(text: str) -> list[str]:
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    cleaned = "".join(
+        char if char.isalnum() else " "
+        for char in decomposed
+        if not unicodedata.combining(char)
+    )
+    return cleaned.split()
+
+
+def _merge_into(scores: dict[int, int], posting: dict[int, int], bonus: int):
+    for doc, weight in posting.items():
+        score = weight * bonus
+        if scores.get(doc, 0) < score:
+            scores[doc] = score
+
+
+class SearchIndex:
+    def __init__(self):
+        self.contents: list[Movie | TVShow] = []
+        self.postings: dict[str, dict[int, int]] = {}
+        self.vocabulary: list[str] = []
+        self._prefix_cache: dict[str, dict[int, int]] = {}
+        self._ranked_cache: dict[str, list[int]] = {}
+
+    def _add_tokens(self, doc: int, text: str | None, weight: int):
+        if not text:
+            return
+        for token in normalize(text):
+            posting = self.postings.setdefault(token, {})
+            if posting.get(doc, 0) < weight:
+                posting[doc] = weight
+
+    def build(self, contents: list[Movie | TVShow]):
+        # Documents are numbered by static rank, so ties on score are broken by the document number alone
+        self.contents = sorted(contents, key=lambda c: (-(c.vote_average or 0), c.title or ""))
+        self.postings = {}
+        self._prefix_cache = {}
+        self._ranked_cache = {}
+
+        for doc, content in enumerate(self.contents):
+            self._add_tokens(doc, content.title, TITLE_WEIGHT)
+            self._add_tokens(doc, content.og_title, OG_TITLE_WEIGHT)
+            if content.release_date:
+                self._add_tokens(doc, content.release_date[:4], YEAR_WEIGHT)
+            for genre in content.genres or ():
+                self._add_tokens(doc, genre, GENRE_WEIGHT)
+
+        self.vocabulary = sorted(self.postings)
+
+        # Short prefixes match a large part of the vocabulary, so they are merged once per build
+        for token in self.vocabulary:
+            for length in range(1, min(len(token), CACHED_PREFIX_LENGTH) + 1):
+                prefix = token[:length]
+                bonus = EXACT_MATCH_BONUS if prefix == token else 1
+                _merge_into(self._prefix_cache.setdefault(prefix, {}), self.postings[token], bonus)
+
+    def _match_token(self, token: str) -> dict[int, int]:
+        if (cached := self._prefix_cache.get(token)) is not None:
+            return cached
+
+        scores = {}
+        for i in range(bisect_left(self.vocabulary, token), len(self.vocabulary)):
+            vocabulary_token = self.vocabulary[i]
+            if not vocabulary_token.startswith(token):
+                break
+            bonus = EXACT_MATCH_BONUS if vocabulary_token == token else 1
+            if scores:
+                _merge_into(scores, self.postings[vocabulary_token], bonus)
+            else:
+                scores = {doc: weight * bonus for doc, weight in self.postings[vocabulary_token].items()}
+        return scores
+
+    @staticmethod
+    def _rank(scores: dict[int, int], limit: int | None) -> list[int]:
+        buckets: dict[int, list[int]] = {}
+        for doc, score in scores.items():
+            buckets.setdefault(score, []).append(doc)
+
+        ranked = []
+        for score in sorted(buckets, reverse=True):
+            remaining = None if limit is None else limit - len(ranked)
+            bucket = buckets[score]
+            if remaining is not None and remaining < len(bucket):
+                ranked.extend(heapq.nsmallest(remaining, bucket))
+                break
+            ranked.extend(sorted(bucket))
+        return ranked
+
+    def search(self, query: str, limit: int | None = None) -> list[Movie | TVShow]:
+        tokens = list(dict.fromkeys(normalize(query)))
+        if not tokens:
+            return []
+
+        if len(tokens) == 1 and tokens[0] in self._prefix_cache:
+            if (ranked := self._ranked_cache.get(tokens[0])) is None:
+                ranked = self._ranked_cache[tokens[0]] = self._rank(self._prefix_cache[tokens[0]], None)
+            return [self.contents[doc] for doc in ranked[:limit]]
+
+        matches = sorted((self._match_token(token) for token in tokens), key=len)
+        scores = matches[0]
+        for token_scores in matches[1:]:
+            scores = {doc: score + token_scores[doc] for doc, score in scores.items() if doc in token_scores}
+            if not scores:
+                return []
+
+        return [self.contents[doc] for doc in self._rank(scores, limit)]
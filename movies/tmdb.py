@@ -1,55 +1,82 @@
 import asyncio
 import logging
-import random
 
 import aiohttp
 from cachetools import TTLCache
 from cachetools_async import cached
 
 import config
+import movies.images as images
+from monitoring import tracing
 from movies.classes import Movie, TVShow, Season, Episode
+from movies.hedging import hedged
+from movies.proxies import PROXY_POOL
+from movies.utils import intern_or_none, intern_genres
 
 _BASE_API_URL = "https://api.themoviedb.org/3"
-_BASE_IMAGE_URL = None
+
+_MAX_APPENDED_RESPONSES = 20
 
 _TMDB_REQUEST_SEMAPHORE = asyncio.Semaphore(config.TMDB_CONCURRENT_REQUESTS_LIMIT)
 
+_requests_count = 0
+
+
+def _endpoint_name(url: str, params: dict | None) -> str:
+    endpoint = "tmdb:" + url.removeprefix(_BASE_API_URL).strip("/").split("/", 1)[0]
+    # A show with 20 appended seasons takes far longer than one with a single season, so they get separate latencies
+    if appended := (params or {}).get("append_to_response"):
+        endpoint += f":{appended.count(',') + 1}_appended"
+    return endpoint
+
+
+async def _send_tmdb_request(session: aiohttp.ClientSession, url: str, headers: dict, params: dict) -> dict:
+    global _requests_count
+
+    _requests_count += 1
+    proxy = PROXY_POOL.choose()
+    async with PROXY_POOL.track(proxy):
+        async with session.get(url=url, headers=headers, params=params, proxy=proxy) as response:
+            response.raise_for_status()
+            tracing.annotate(bytes=response.content_length)
+            return await response.json()
+
 
 async def _make_tmdb_request(session: aiohttp.ClientSession, url: str, params: dict = None) -> dict:
-    async with _TMDB_REQUEST_SEMAPHORE:
-        headers = {
-            "Authorization": f"Bearer {config.TMDB_API_KEY}",
-            "Accept": "application/json"
-        }
-        request_params = {"language": config.TMDB_LANG, **(params or {})}
-
-        try:
-            async with session.get(url=url, headers=headers, params=request_params) as response:
-                response.raise_for_status()
-                return await response.json()
-        except aiohttp.ClientResponseError as e:
-            logging.error("TMDB request failed for %s: Status %s, Response: %s", url, e.status, e.message)
-            raise
-        except aiohttp.ClientError as e:
-            logging.error("Network error during TMDB request for %s: %s", url, e)
-            raise
+    headers = {
+        "Authorization": f"Bearer {config.TMDB_API_KEY}",
+        "Accept": "application/json"
+    }
+    request_params = {"language": config.TMDB_LANG, **(params or {})}
+
+    try:
+        return await hedged(_endpoint_name(url, params),
+                            lambda: _send_tmdb_request(session, url, headers, request_params), _TMDB_REQUEST_SEMAPHORE)
+    except aiohttp.ClientResponseError as e:
+        logging.error("TMDB request failed for %s: Status %s, Response: %s", url, e.status, e.message)
+        raise
+    except aiohttp.ClientError as e:
+        logging.error("Network error during TMDB request for %s: %s", url, e)
+        raise
+    except TimeoutError:
+        logging.error("TMDB request timed out for %s", url)
+        raise
 
 
 async def _get_client_session() -> aiohttp.ClientSession:
-    proxy = random.choice(config.PROXIES) if config.PROXIES else None
-    return aiohttp.ClientSession(proxy=proxy)
+    timeout = aiohttp.ClientTimeout(sock_connect=config.TMDB_CONNECT_TIMEOUT_SECONDS,
+                                    sock_read=config.TMDB_READ_TIMEOUT_SECONDS)
+    return aiohttp.ClientSession(timeout=timeout)
 
 
 @cached(TTLCache(maxsize=config.CACHE_MAXSIZE, ttl=config.CACHE_TTL))
 async def _fetch_tmdb_configuration():
-    global _BASE_IMAGE_URL
-
     logging.info("Fetching TMDB configuration data")
 
     async with await _get_client_session() as session:
         response_json = await _make_tmdb_request(session, f"{_BASE_API_URL}/configuration")
 
-    _BASE_IMAGE_URL = response_json["images"]["base_url"]
+    images.set_base_url(response_json["images"]["base_url"])
 
 
 @cached(TTLCache(maxsize=config.CACHE_MAXSIZE, ttl=config.CACHE_TTL))
@@ -70,18 +97,39 @@ async def _fetch_movie(movie: Movie) -> Movie:
         adult=response_json.get("adult"),
         og_title=response_json.get("original_title"),
         homepage=response_json.get("homepage"),
-        poster_url=f"{_BASE_IMAGE_URL}original{response_json['poster_path']}" if response_json.get(
-            "poster_path") else None,
-        backdrop_url=f"{_BASE_IMAGE_URL}original{response_json['backdrop_path']}" if response_json.get(
-            "backdrop_path") else None,
-        release_date=response_json.get("release_date"),
-        genres=tuple(sorted([genre["name"].capitalize() for genre in response_json.get("genres", [])], key=len)),
+        poster_path=response_json.get("poster_path"),
+        backdrop_path=response_json.get("backdrop_path"),
+        release_date=intern_or_none(response_json.get("release_date")),
+        genres=intern_genres(sorted([genre["name"].capitalize() for genre in response_json.get("genres", [])],
+                                    key=len)),
     )
 
 
-async def _fetch_tv_season_data(session: aiohttp.ClientSession, tv_show_id: int, season_number: int) -> dict:
-    logging.debug("Fetching season %s data for TV show TMDB ID: %s", season_number, tv_show_id)
-    return await _make_tmdb_request(session, f"{_BASE_API_URL}/tv/{tv_show_id}/season/{season_number}")
+async def _fetch_tv_show_with_seasons(session: aiohttp.ClientSession, tv_show_id: int,
+                                     season_numbers: list[int]) -> tuple[dict, list[dict]]:
+    chunks = [season_numbers[i:i + _MAX_APPENDED_RESPONSES]
+              for i in range(0, len(season_numbers), _MAX_APPENDED_RESPONSES)] or [[]]
+
+    logging.debug("Fetching %s seasons for TV show TMDB ID %s in %s requests", len(season_numbers), tv_show_id,
+                  len(chunks))
+
+    tasks = [
+        _make_tmdb_request(session, f"{_BASE_API_URL}/tv/{tv_show_id}",
+                           params={"append_to_response": ",".join(f"season/{n}" for n in chunk)} if chunk else None)
+        for chunk in chunks
+    ]
+    responses = await asyncio.gather(*tasks)
+
+    seasons_data_jsons = []
+    for chunk, response_json in zip(chunks, responses):
+        for season_number in chunk:
+            season_response_json = response_json.get(f"season/{season_number}")
+            if season_response_json is None:
+                logging.warning("TMDB returned no data for season %s of TV show %s", season_number, tv_show_id)
+                continue
+            seasons_data_jsons.append(season_response_json)
+
+    return responses[0], seasons_data_jsons
 
 
 @cached(TTLCache(maxsize=config.CACHE_MAXSIZE, ttl=config.CACHE_TTL))
@@ -89,13 +137,8 @@ async def _fetch_tv_show(tv_show: TVShow) -> TVShow:
     logging.info("Fetching TV show data for TMDB ID: %s", tv_show.tmdb_id)
 
     async with await _get_client_session() as session:
-        tv_response_json = await _make_tmdb_request(session, f"{_BASE_API_URL}/tv/{tv_show.tmdb_id}")
-
-        season_tasks = [
-            _fetch_tv_season_data(session, tv_show.tmdb_id, season.season_number)
-            for season in tv_show.seasons
-        ]
-        seasons_data_jsons = await asyncio.gather(*season_tasks)
+        tv_response_json, seasons_data_jsons = await _fetch_tv_show_with_seasons(
+            session, tv_show.tmdb_id, [season.season_number for season in tv_show.seasons])
 
     raw_seasons_map = {s.season_number: s for s in tv_show.seasons}
 
@@ -127,11 +170,11 @@ async def _fetch_tv_show(tv_show: TVShow) -> TVShow:
                 runtime=episode_response_json.get("runtime"),
                 vote_average=episode_response_json.get("vote_average"),
                 title=episode_response_json.get("name", str(episode_number)),
+                file_size=raw_episode.file_size,
                 file_url=raw_episode.file_url,
-                still_url=f"{_BASE_IMAGE_URL}original{episode_response_json['still_path']}" if tv_response_json.get(
-                    "poster_path") else None,
-                episode_type=episode_response_json.get("episode_type"),
-                release_date=episode_response_json.get("air_date"),
+                still_path=episode_response_json.get("still_path"),
+                episode_type=intern_or_none(episode_response_json.get("episode_type")),
+                release_date=intern_or_none(episode_response_json.get("air_date")),
             ))
 
         processed_seasons_list.append(Season(
@@ -139,9 +182,8 @@ async def _fetch_tv_show(tv_show: TVShow) -> TVShow:
             episodes_count=len(processed_episodes),
             vote_average=season_response_json.get("vote_average"),
             title=season_response_json.get("name", str(season_number)),
-            poster_url=f"{_BASE_IMAGE_URL}original{season_response_json['poster_path']}" if season_response_json.get(
-                "poster_path") else None,
-            release_date=season_response_json.get("air_date"),
+            poster_path=season_response_json.get("poster_path"),
+            release_date=intern_or_none(season_response_json.get("air_date")),
             episodes=tuple(processed_episodes)
         ))
 
@@ -156,33 +198,56 @@ async def _fetch_tv_show(tv_show: TVShow) -> TVShow:
         title=tv_response_json.get("name"),
         og_title=tv_response_json.get("original_name"),
         homepage=tv_response_json.get("homepage"),
-        poster_url=f"{_BASE_IMAGE_URL}original{tv_response_json['poster_path']}" if tv_response_json.get(
-            "poster_path") else None,
-        backdrop_url=f"{_BASE_IMAGE_URL}original{tv_response_json['backdrop_path']}" if tv_response_json.get(
-            "backdrop_path") else None,
-        release_date=tv_response_json.get("first_air_date"),
+        poster_path=tv_response_json.get("poster_path"),
+        backdrop_path=tv_response_json.get("backdrop_path"),
+        release_date=intern_or_none(tv_response_json.get("first_air_date")),
         in_production=tv_response_json.get("in_production"),
         seasons=tuple(processed_seasons_list),
-        genres=tuple(sorted([genre["name"].capitalize() for genre in tv_response_json.get("genres", [])], key=len)),
+        genres=intern_genres(sorted([genre["name"].capitalize() for genre in tv_response_json.get("genres", [])],
+                                    key=len)),
     )
 
 
+async def fetch_image(size: str, path: str) -> bytes:
+    if images.get_base_url() is None:
+        await _fetch_tmdb_configuration()
+
+    logging.info("Fetching TMDB image %s%s", size, path)
+
+    proxy = PROXY_POOL.choose()
+    async with await _get_client_session() as session, PROXY_POOL.track(proxy):
+        async with session.get(url=f"{images.get_base_url()}{size}{path}", proxy=proxy) as response:
+            response.raise_for_status()
+            return await response.read()
+
+
 async def _fetch_data(content: Movie | TVShow) -> Movie | TVShow:
     logging.info("Fetching data for %s: %s", content.type, content.tmdb_id)
 
-    match content.type:
-        case "movie":
-            return await _fetch_movie(content)
-        case "tv":
-            return await _fetch_tv_show(content)
-        case _:
-            raise TypeError(f"Unknown content type: {content.type}")
+    with tracing.span(f"tmdb.{content.type}", tmdb_id=content.tmdb_id):
+        match content.type:
+            case "movie":
+                return await _fetch_movie(content)
+            case "tv":
+                return await _fetch_tv_show(content)
+            case _:
+                raise TypeError(f"Unknown content type: {content.type}")
 
 
-async def fetch_all_data(contents: list[Movie | TVShow]) -> list[Movie | TVShow]:
+async def fetch_all_data(contents: list[Movie | TVShow]) -> list[Movie | TVShow | BaseException]:
     logging.info("Fetching data for %s contents", len(contents))
 
-    await _fetch_tmdb_configuration()
+    requests_count_before = _requests_count
+
+    with tracing.span("tmdb.configuration"):
+        await _fetch_tmdb_configuration()
+
+    with tracing.span("tmdb.titles", items=len(contents)):
+        tasks = [_fetch_data(content) for content in contents]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    failed = sum(isinstance(result, BaseException) for result in results)
+    logging.info("Fetched data for %s contents (%s failed) with %s TMDB requests", len(contents), failed,
+                 _requests_count - requests_count_before)
 
-    tasks = [_fetch_data(content) for content in contents]
-    return await asyncio.gather(*tasks)
+    return results
@@ -0,0 +1,115 @@
+from sys import intern
+
+from movies.classes import Movie, TVShow, Season, Episode, MediaInfo
+
+
+def intern_or_none(value: str | None) -> str | None:
+    return intern(value) if value is not None else None
+
+
+def intern_genres(genres) -> tuple[str, ...] | None:
+    if genres is None:
+        return None
+    return tuple(intern(genre) for genre in genres)
+
+
+def _decode_media(raw: dict | None) -> MediaInfo | None:
+    if raw is None:
+        return None
+    return MediaInfo(
+        container=intern_or_none(raw.get("container")),
+        duration=raw.get("duration"),
+        bitrate=raw.get("bitrate"),
+        video_codec=intern_or_none(raw.get("video_codec")),
+        audio_codec=intern_or_none(raw.get("audio_codec")),
+        fast_start=raw.get("fast_start"),
+    )
+
+
+def _decode_episode(raw: dict) -> Episode:
+    return Episode(
+        episode_number=raw.get("episode_number"),
+        season_number=raw.get("season_number"),
+        runtime=raw.get("runtime"),
+        vote_average=raw.get("vote_average"),
+        title=raw.get("title"),
+        file_size=raw.get("file_size"),
+        file_url=raw.get("file_url"),
+        media=_decode_media(raw.get("media")),
+        still_path=raw.get("still_path"),
+        episode_type=intern_or_none(raw.get("episode_type")),
+        release_date=intern_or_none(raw.get("release_date")),
+    )
+
+
+def _decode_season(raw: dict) -> Season:
+    return Season(
+        season_number=raw.get("season_number"),
+        episodes_count=raw.get("episodes_count"),
+        vote_average=raw.get("vote_average"),
+        title=raw.get("title"),
+        poster_path=raw.get("poster_path"),
+        release_date=intern_or_none(raw.get("release_date")),
+        episodes=tuple(_decode_episode(e) for e in raw.get("episodes") or ()),
+    )
+
+
+def _decode_movie(raw: dict) -> Movie:
+    return Movie(
+        tmdb_id=raw.get("tmdb_id"),
+        vote_average=raw.get("vote_average"),
+        adult=raw.get("adult"),
+        title=raw.get("title"),
+        og_title=raw.get("og_title"),
+        homepage=raw.get("homepage"),
+        poster_path=raw.get("poster_path"),
+        backdrop_path=raw.get("backdrop_path"),
+        release_date=intern_or_none(raw.get("release_date")),
+        genres=intern_genres(raw.get("genres")),
+        file_size=raw.get("file_size"),
+        budget=raw.get("budget"),
+        runtime=raw.get("runtime"),
+        file_url=raw.get("file_url"),
+        media=_decode_media(raw.get("media")),
+    )
+
+
+def _decode_tv_show(raw: dict) -> TVShow:
+    return TVShow(
+        tmdb_id=raw.get("tmdb_id"),
+        vote_average=raw.get("vote_average"),
+        adult=raw.get("adult"),
+        title=raw.get("title"),
+        og_title=raw.get("og_title"),
+        homepage=raw.get("homepage"),
+        poster_path=raw.get("poster_path"),
+        backdrop_path=raw.get("backdrop_path"),
+        release_date=intern_or_none(raw.get("release_date")),
+        genres=intern_genres(raw.get("genres")),
+        number_of_episodes=raw.get("number_of_episodes"),
+        number_of_seasons=raw.get("number_of_seasons"),
+        in_production=raw.get("in_production"),
+        seasons=tuple(_decode_season(s) for s in raw.get("seasons") or ()),
+    )
+
+
+_DECODERS = {
+    "movie": _decode_movie,
+    "tv": _decode_tv_show,
+}
+
+
+def decode_content(raw: dict) -> Movie | TVShow | None:
+    decoder = _DECODERS.get(raw.get("type"))
+    if decoder is None:
+        return None
+    return decoder(raw)
+
+
+def decode_contents(raw_contents: list[dict]) -> list[Movie | TVShow]:
+    contents = []
+    for raw in raw_contents:
+        content = decode_content(raw)
+        if content is not None:
+            contents.append(content)
+    return contents
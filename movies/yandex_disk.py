@@ -1,24 +1,128 @@
 import asyncio
-import copy
+import hashlib
 import itertools
 import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 
-from cachetools import TTLCache
-from cachetools_async import cached
+import aiohttp
 from yndx_disk.classes import Directory, File
 from yndx_disk.clients import AsyncDiskClient
 
 import config
-from movies.classes import Movie, TVShow, Season, Episode
+from movies.classes import Movie, TVShow, Season, Episode, DiskListing, DiskAccount
+from movies.hedging import hedged
+from monitoring import metrics, tracing
+from movies.proxies import PROXY_POOL
 
 NAME_DELIMITER = "#"
 EXTENSION_DELIMITER = "."
 
-_YANDEX_DISK_REQUEST_SEMAPHORE = asyncio.Semaphore(config.YANDEX_DISK_CONCURRENT_REQUESTS_LIMIT)
+_YANDEX_DISK_REQUEST_SEMAPHORES: dict[str, asyncio.Semaphore] = {}
 
+# yndx_disk passes its own total timeout to every request, which overrides the session's connect/read timeouts,
+# so the combined budget is enforced around each attempt as well
+_LISTDIR_TIMEOUT_SECONDS = config.YANDEX_DISK_CONNECT_TIMEOUT_SECONDS + config.YANDEX_DISK_READ_TIMEOUT_SECONDS
 
-@cached(TTLCache(maxsize=config.CACHE_MAXSIZE, ttl=config.CACHE_TTL))
-async def _parse_tv_show(disk_client: AsyncDiskClient, directory: Directory) -> TVShow:
+
+@dataclass(frozen=True, slots=True)
+class _ParsedShow:
+    modified_at: str
+    revision: int
+    parsed_at: float
+    tv_show: TVShow
+
+
+class ParseCache:
+    def __init__(self, max_size: int, max_age: float):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._entries: OrderedDict[tuple[str, str], _ParsedShow] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, token: str, directory: Directory) -> TVShow | None:
+        key = (token, directory.path)
+        if (entry := self._entries.get(key)) is None:
+            self.misses += 1
+            metrics.CACHE_REQUESTS.inc(cache="tv_show_parse", result="miss")
+            return None
+
+        # File URLs in a listing expire, so even an unchanged directory is re-listed once in a while
+        if (entry.modified_at != directory.modified_at or entry.revision != directory.revision
+                or time.monotonic() - entry.parsed_at > self.max_age):
+            del self._entries[key]
+            self.invalidations += 1
+            self.misses += 1
+            metrics.CACHE_REQUESTS.inc(cache="tv_show_parse", result="stale")
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        metrics.CACHE_REQUESTS.inc(cache="tv_show_parse", result="hit")
+        return entry.tv_show
+
+    def put(self, token: str, directory: Directory, tv_show: TVShow):
+        key = (token, directory.path)
+        self._entries[key] = _ParsedShow(modified_at=directory.modified_at, revision=directory.revision,
+                                         parsed_at=time.monotonic(), tv_show=tv_show)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+        }
+
+
+PARSE_CACHE = ParseCache(max_size=config.YANDEX_DISK_PARSE_CACHE_SIZE,
+                         max_age=config.YANDEX_DISK_PARSE_CACHE_MAX_AGE_SECONDS)
+
+
+async def _timed_listdir(disk_client: AsyncDiskClient, path: str, proxy: str | None) -> list[File | Directory]:
+    async with PROXY_POOL.track(proxy):
+        contents = await asyncio.wait_for(disk_client.listdir(path=path, limit=10000),
+                                          timeout=_LISTDIR_TIMEOUT_SECONDS)
+    tracing.annotate(items=len(contents))
+    return contents
+
+
+def _get_semaphore(token: str) -> asyncio.Semaphore:
+    if (semaphore := _YANDEX_DISK_REQUEST_SEMAPHORES.get(token)) is None:
+        semaphore = asyncio.Semaphore(config.YANDEX_DISK_CONCURRENT_REQUESTS_LIMIT)
+        _YANDEX_DISK_REQUEST_SEMAPHORES[token] = semaphore
+    return semaphore
+
+
+async def _listdir(disk_client: AsyncDiskClient, path: str, proxy: str | None) -> list[File | Directory]:
+    return await hedged("yandex_disk:listdir", lambda: _timed_listdir(disk_client, path, proxy),
+                        _get_semaphore(disk_client.token))
+
+
+async def _get_tv_show(disk_client: AsyncDiskClient, directory: Directory, proxy: str | None) -> TVShow:
+    with tracing.span("yandex_disk.tv_show", path=directory.path):
+        if (tv_show := PARSE_CACHE.get(disk_client.token, directory)) is not None:
+            tracing.annotate(cached=True)
+            return tv_show
+
+        tv_show = await _parse_tv_show(disk_client, directory, proxy)
+        PARSE_CACHE.put(disk_client.token, directory, tv_show)
+        tracing.annotate(cached=False, items=tv_show.number_of_episodes)
+        return tv_show
+
+
+async def _parse_tv_show(disk_client: AsyncDiskClient, directory: Directory, proxy: str | None) -> TVShow:
     logging.info("Parsing TV show directory: %s", directory.path)
 
     parts = [p.strip() for p in directory.name.split(NAME_DELIMITER)]
@@ -39,8 +143,7 @@ async def _parse_tv_show(disk_client: AsyncDiskClient, directory: Directory) ->
 
     seasons_map = {}
 
-    async with _YANDEX_DISK_REQUEST_SEMAPHORE:
-        contents = await disk_client.listdir(path=directory.path, limit=10000)
+    contents = await _listdir(disk_client, directory.path, proxy)
     for obj in contents:
         if not isinstance(obj, File):
             continue
@@ -72,6 +175,7 @@ async def _parse_tv_show(disk_client: AsyncDiskClient, directory: Directory) ->
         episode = Episode(
             episode_number=episode_number,
             season_number=season_number,
+            file_size=int(obj.size),
             file_url=obj.file_url
         )
         seasons_map[season_number].append(episode)
@@ -81,7 +185,7 @@ async def _parse_tv_show(disk_client: AsyncDiskClient, directory: Directory) ->
         season = Season(
             season_number=season_number,
             episodes_count=len(episodes),
-            episodes=tuple(copy.deepcopy(episodes))
+            episodes=tuple(episodes)
         )
         seasons_list.append(season)
 
@@ -98,17 +202,42 @@ async def _parse_tv_show(disk_client: AsyncDiskClient, directory: Directory) ->
     )
 
 
-async def _get_contents_on_disk(token: str, path: str) -> list[Movie | TVShow]:
+def account_key(token: str, path: str) -> str:
+    return hashlib.sha1(f"{token}:{path}".encode("utf-8")).hexdigest()[:12]
+
+
+def get_accounts() -> list[DiskAccount]:
+    accounts = []
+    for token, path, *options in config.YANDEX_CONFIGS:
+        update_interval = options[0] if options else config.MOVIES_DB_UPDATE_INTERVAL_SECONDS
+        accounts.append(DiskAccount(key=account_key(token, path), token=token, path=path,
+                                    update_interval=update_interval))
+    return accounts
+
+
+async def _get_contents_on_disk(token: str, path: str) -> DiskListing:
+    timeout = aiohttp.ClientTimeout(sock_connect=config.YANDEX_DISK_CONNECT_TIMEOUT_SECONDS,
+                                    sock_read=config.YANDEX_DISK_READ_TIMEOUT_SECONDS)
+    proxy = PROXY_POOL.choose() if config.YANDEX_DISK_USE_PROXIES else None
+    async with aiohttp.ClientSession(timeout=timeout, proxy=proxy) as session:
+        disk_client = AsyncDiskClient(token=token, auto_update_info=False, session=session)
+        with tracing.span("yandex_disk.disk", path=path):
+            listing = await _list_contents_on_disk(disk_client, token, path, proxy)
+            tracing.annotate(items=len(listing.contents), failed=len(listing.failed_tmdb_ids))
+            return listing
+
+
+async def _list_contents_on_disk(disk_client: AsyncDiskClient, token: str, path: str,
+                                 proxy: str | None) -> DiskListing:
     logging.info("Fetching contents from disk for token ending with ...%s, path: %s", token[-10:], path)
 
-    disk_client = AsyncDiskClient(token=token, auto_update_info=False)
-    async with _YANDEX_DISK_REQUEST_SEMAPHORE:
-        contents_on_disk = await disk_client.listdir(path, limit=10000)
+    contents_on_disk = await _listdir(disk_client, path, proxy)
 
     logging.info("Found %s items on disk for token ending with ...%s", len(contents_on_disk), token[-10:])
 
     movies = []
     tv_show_tasks = []
+    tv_show_ids = []
 
     for obj in contents_on_disk:
         parts = [p.strip() for p in obj.name.split(NAME_DELIMITER)]
@@ -134,7 +263,8 @@ async def _get_contents_on_disk(token: str, path: str) -> list[Movie | TVShow]:
                 )
                 movies.append(movie)
             elif file_type == "tv" and isinstance(obj, Directory):
-                tv_show_tasks.append(_parse_tv_show(disk_client=disk_client, directory=obj))
+                tv_show_ids.append(int(tmdb_id_str))
+                tv_show_tasks.append(_get_tv_show(disk_client=disk_client, directory=obj, proxy=proxy))
             else:
                 logging.warning("Skipping unknown/unsupported item type or mismatch: %s (Type: %s, Is Directory: %s)",
                                 obj.name, file_type, isinstance(obj, Directory))
@@ -143,22 +273,39 @@ async def _get_contents_on_disk(token: str, path: str) -> list[Movie | TVShow]:
         except Exception as e:
             logging.critical("Unexpected error processing item %s: %s", obj.name, e, exc_info=True)
 
-    tv_shows = await asyncio.gather(*tv_show_tasks)
+    tv_shows = []
+    failed_tmdb_ids = set()
+    for tmdb_id, result in zip(tv_show_ids, await asyncio.gather(*tv_show_tasks, return_exceptions=True)):
+        if isinstance(result, ValueError):
+            logging.error("Error parsing TV show %s: %s", tmdb_id, result)
+        elif isinstance(result, BaseException):
+            logging.error("Failed to list TV show %s: %s", tmdb_id, result)
+            failed_tmdb_ids.add(tmdb_id)
+        else:
+            tv_shows.append(result)
 
     all_contents = movies + tv_shows
-    logging.info("Found %s total contents on disk for token ending with ...%s", len(all_contents), token[-10:])
+    logging.info("Found %s total contents on disk for token ending with ...%s (%s failed)", len(all_contents),
+                 token[-10:], len(failed_tmdb_ids))
 
-    return all_contents
+    return DiskListing(contents=tuple(all_contents), failed_tmdb_ids=frozenset(failed_tmdb_ids))
 
 
-async def get_all_contents() -> list[Movie | TVShow]:
-    logging.info("Fetching all contents from all disks...")
+async def get_all_contents(accounts: list[DiskAccount]) -> dict[str, DiskListing | BaseException]:
+    logging.info("Fetching all contents from %s disks...", len(accounts))
 
-    tasks = [_get_contents_on_disk(token, path) for token, path in config.YANDEX_CONFIGS]
-    all_contents_lists = await asyncio.gather(*tasks)
+    tasks = [_get_contents_on_disk(account.token, account.path) for account in accounts]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
 
-    all_contents = list(itertools.chain.from_iterable(all_contents_lists))
+    listings = {}
+    for account, result in zip(accounts, results):
+        if isinstance(result, BaseException):
+            logging.error("Failed to fetch contents from disk for token ending with ...%s, path: %s: %s",
+                          account.token[-10:], account.path, result)
+        listings[account.key] = result
 
-    logging.info("Found %s total contents on all disks.", len(all_contents))
+    logging.info("Found %s total contents on all disks.",
+                 sum(len(r.contents) for r in listings.values() if isinstance(r, DiskListing)))
+    logging.info("TV show parse cache: %s", PARSE_CACHE.stats())
 
-    return all_contents
+    return listings
@@ -1,7 +1,8 @@
 import logging
 
-from nicegui import background_tasks
+from nicegui import background_tasks, Event
 
+from monitoring import metrics
 from rooms.room import Room
 from rooms.utils import generate_uid
 
@@ -11,6 +12,13 @@ class RoomsDB:
         self.rooms = []
         self.by_uid: dict[str, Room] = {}
 
+        self.room_created = Event[Room]()
+        self.room_deleted = Event[str]()
+        self.members_changed = Event[Room]()
+
+        metrics.ROOMS.set_function(lambda: len(self.rooms))
+        metrics.ROOM_CLIENTS.set_function(lambda: sum(len(set(room.connected_users)) for room in self.rooms))
+
     async def create_room(self, tmdb_id: int) -> Room:
         logging.info("Creating new room")
 
@@ -25,6 +33,7 @@ class RoomsDB:
         background_tasks.create_lazy(room.update(), name=f"room_update_{uid}")
 
         logging.info(f"Created new room {room.uid}")
+        self.room_created.emit(room)
 
         return room
 
@@ -35,5 +44,20 @@ class RoomsDB:
         room = self.by_uid[uid]
         del self.by_uid[uid]
         self.rooms.remove(room)
+        metrics.ROOM_SYNC_DRIFT_SECONDS.remove(room=uid)
 
         logging.info(f"Deleted room {uid}")
+        self.room_deleted.emit(uid)
+
+    def add_member(self, uid: str, user_uid: str):
+        room = self.by_uid[uid]
+        room.connected_users.append(user_uid)
+        self.members_changed.emit(room)
+
+    def remove_member(self, uid: str, user_uid: str) -> bool:
+        room = self.by_uid[uid]
+        if user_uid not in room.connected_users:
+            return False
+        room.connected_users.remove(user_uid)
+        self.members_changed.emit(room)
+        return True
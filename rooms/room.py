@@ -2,9 +2,11 @@ import asyncio
 import logging
 from dataclasses import dataclass, field
 from datetime import datetime
+from typing import Callable
 
 import config
 import globals
+from movies.classes import Movie, Episode
 from rooms.state import PlayerState
 
 
@@ -18,19 +20,24 @@ class Room:
 
     current_season: int | None = None
     current_episode: int | None = None
+    auto_advance: bool = True
 
     connected_users: list[str] = field(default_factory=list)
     messages: list[tuple[str, str]] = field(default_factory=list)
 
-    def __init__(self, uid: str, tmdb_id: int):
+    clock: Callable[[], datetime] = field(default=datetime.now, repr=False)
+
+    def __init__(self, uid: str, tmdb_id: int, clock: Callable[[], datetime] = datetime.now):
         self.uid = uid
         self.tmdb_id = tmdb_id
+        self.clock = clock
 
         self.player_position = 0.0
         self.player_state = PlayerState.PAUSED
 
         self.current_season = None
         self.current_episode = None
+        self.auto_advance = config.ROOMS_AUTO_ADVANCE
 
         self.connected_users = []
         self.messages = []
@@ -40,7 +47,18 @@ class Room:
             self.current_season = 1
             self.current_episode = 1
 
-        self.last_update = datetime.now()
+        self.last_update = self.clock()
+        self.last_change = self.last_update
+
+    def current_file(self) -> Movie | Episode | None:
+        return globals.MOVIES_DATABASE.get_file(self.tmdb_id, self.current_season, self.current_episode)
+
+    @property
+    def duration(self) -> float | None:
+        file = self.current_file()
+        if file is None or file.media is None:
+            return None
+        return file.media.duration
 
     async def _delete(self):
         await globals.ROOMS_DATABASE.delete_room(self.uid)
@@ -56,15 +74,23 @@ class Room:
                 logging.info("No users connected to %s, deleting it", self.uid)
                 await self._delete()
 
-        now = datetime.now()
+        self.tick()
+
+    def tick(self):
+        now = self.clock()
 
         if self.player_state == PlayerState.PLAYING:
             self.player_position += (now - self.last_update).total_seconds()
 
+            if (duration := self.duration) is not None and self.player_position >= duration:
+                self.player_position = duration
+                if not self.auto_advance or not self.advance():
+                    self.stop()
+
         self.last_update = now
 
     async def update(self):
-        self.last_update = datetime.now()
+        self.last_update = self.clock()
 
         while True:
             await asyncio.sleep(config.ROOMS_UPDATE_INTERVAL_SECONDS)
@@ -72,13 +98,36 @@ class Room:
 
     def pause(self):
         self.player_state = PlayerState.PAUSED
+        self.last_change = self.clock()
 
     def play(self):
         self.player_state = PlayerState.PLAYING
+        self.last_change = self.clock()
 
     def stop(self):
         self.player_state = PlayerState.STOPPED
+        self.last_change = self.clock()
+
+    @property
+    def next_episode(self) -> tuple[int, int] | None:
+        return globals.MOVIES_DATABASE.get_next_episode(self.tmdb_id, self.current_season, self.current_episode)
+
+    def change_episode(self, season_number: int, episode_number: int, play: bool = False):
+        self.current_season, self.current_episode = season_number, episode_number
+        self.player_position = 0.0
+        self.player_state = PlayerState.PLAYING if play else PlayerState.PAUSED
+        self.last_update = self.clock()
+        self.last_change = self.last_update
+
+    def advance(self) -> bool:
+        if (next_episode := self.next_episode) is None:
+            return False
+        self.change_episode(*next_episode, play=True)
+        return True
 
     def seek(self, seconds: float):
-        self.player_position = seconds
-        self.last_update = datetime.now()
+        if (duration := self.duration) is not None:
+            seconds = min(seconds, duration)
+        self.player_position = max(0.0, seconds)
+        self.last_update = self.clock()
+        self.last_change = self.last_update
@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+
+import config
+from rooms.state import PlayerState
+
+SEEK_REASON_DRIFT = "drift"
+SEEK_REASON_NOT_PLAYING = "not_playing"
+
+# Players report back the position they were seeked to, anything further away was moved since
+_HOLD_TOLERANCE_SECONDS = 0.1
+
+
+@dataclass
+class SyncDecision:
+    state: PlayerState | None
+    drift: float
+    seek_reason: str | None
+    interval: float
+
+
+def drift(position: float, room_position: float) -> float:
+    return abs(position - room_position)
+
+
+def state_change(client_state: PlayerState, room_state: PlayerState) -> PlayerState | None:
+    if client_state == room_state:
+        return None
+    return room_state
+
+
+def seek_reason(client_state: PlayerState, client_drift: float) -> str | None:
+    # A player that is not playing can't drift on its own, it is only moved back when someone moved it
+    if client_state != PlayerState.PLAYING:
+        return SEEK_REASON_NOT_PLAYING if client_drift > _HOLD_TOLERANCE_SECONDS else None
+    if client_drift > config.MAX_DELAY_SECONDS:
+        return SEEK_REASON_DRIFT
+    return None
+
+
+def next_interval(room_state: PlayerState, client_drift: float, since_change: float) -> float:
+    if since_change < config.SYNC_FAST_PERIOD_SECONDS:
+        return config.SYNC_FAST_INTERVAL_SECONDS
+    if room_state != PlayerState.PLAYING and client_drift <= _HOLD_TOLERANCE_SECONDS:
+        return config.SYNC_IDLE_INTERVAL_SECONDS
+    return config.SYNC_INTERVAL_SECONDS
+
+
+def decide(client_state: PlayerState, client_position: float, seeking: bool, hidden: bool, room_state: PlayerState,
+           room_position: float, since_change: float) -> SyncDecision:
+    new_state = state_change(client_state, room_state)
+    client_drift = drift(client_position, room_position)
+
+    # Hidden tabs still follow play, pause and episode changes, but are never seeked and otherwise polled rarely
+    if hidden:
+        return SyncDecision(new_state, client_drift, None, config.SYNC_IDLE_INTERVAL_SECONDS)
+
+    # A player that is still seeking reports a position it is about to leave
+    reason = None if seeking else seek_reason(new_state or client_state, client_drift)
+    return SyncDecision(new_state, client_drift, reason, next_interval(room_state, client_drift, since_change))
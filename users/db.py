@@ -8,6 +8,7 @@ import aiofiles
 import orjson
 
 import config
+from monitoring import metrics
 from singleton import Singleton
 from users.classes import User
 from users.utils import is_inactive_too_long, decode_token, generate_uid
@@ -118,9 +119,10 @@ class UsersDB(metaclass=Singleton):
             users[i]["last_activity"] = self.users[i]._last_activity_str
             del users[i]["_last_activity_str"]
 
-        to_save = await asyncio.to_thread(orjson.dumps, users)
-        async with aiofiles.open(self.path, "wb") as file:
-            await file.write(to_save)
+        with metrics.USERS_DB_SAVE_SECONDS.time():
+            to_save = await asyncio.to_thread(orjson.dumps, users)
+            async with aiofiles.open(self.path, "wb") as file:
+                await file.write(to_save)
 
         logging.info("Finished Saving Users DB to disk")
 
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+import aiofiles
+import aiohttp
+import orjson
+
+import config
+
+ASSETS_ROUTE = "/assets"
+
+_MANIFEST_NAME = "manifest.json"
+
+_SOURCES = {
+    "plyr.css": f"https://cdn.plyr.io/{config.PLYR_VERSION}/plyr.css",
+    "plyr.js": f"https://cdn.plyr.io/{config.PLYR_VERSION}/plyr.polyfilled.js",
+    "plyr.svg": f"https://cdn.plyr.io/{config.PLYR_VERSION}/plyr.svg",
+    "blank.mp4": "https://cdn.plyr.io/static/blank.mp4",
+    "hls.js": f"https://cdn.jsdelivr.net/npm/hls.js@{config.HLS_JS_VERSION}/dist/hls.min.js",
+}
+
+_urls: dict[str, str] = {}
+_files: dict[str, Path] = {}
+
+
+def asset_url(name: str) -> str:
+    # init_assets fails the startup when an asset can't be vendored, only processes that never call it use the CDN
+    return _urls.get(name, _SOURCES[name])
+
+
+def get_file(hashed_name: str) -> Path | None:
+    return _files.get(hashed_name)
+
+
+def _register(name: str, file_path: Path):
+    _files[file_path.name] = file_path
+    _urls[name] = f"{ASSETS_ROUTE}/{file_path.name}"
+
+
+class AssetChecksumError(Exception):
+    pass
+
+
+def _file_path(assets_dir: Path, name: str, digest: str) -> Path:
+    # The content hash in the name lets browsers cache the file forever and still pick up new versions
+    stem, suffix = name.rsplit(".", 1)
+    return assets_dir / f"{stem}.{digest[:12]}.{suffix}"
+
+
+async def _download(session: aiohttp.ClientSession, assets_dir: Path, name: str, url: str) -> Path:
+    async with session.get(url) as response:
+        response.raise_for_status()
+        data = await response.read()
+
+    digest = hashlib.sha256(data).hexdigest()
+    if not (pin := config.ASSETS_SHA256.get(name)):
+        logging.warning("%s is not pinned, vendored it with sha256 %s, add it to ASSETS_SHA256", url, digest)
+    elif digest != pin:
+        raise AssetChecksumError(f"{url} has sha256 {digest}, expected {pin}")
+
+    file_path = _file_path(assets_dir, name, digest)
+    tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+    async with aiofiles.open(tmp_path, "wb") as file:
+        await file.write(data)
+    os.replace(tmp_path, file_path)
+
+    return file_path
+
+
+async def init_assets(assets_dir: Path | str):
+    assets_dir = Path(assets_dir).resolve()
+    assets_dir.mkdir(parents=True, exist_ok=True)
+
+    # Unpinned assets are trusted the way they were first vendored, the manifest remembers their files
+    manifest_path = assets_dir / _MANIFEST_NAME
+    manifest = orjson.loads(manifest_path.read_bytes()) if manifest_path.exists() else {}
+
+    # Files are only written after their checksum matched, so a file named after the pinned hash is trusted as is
+    missing = {}
+    for name, url in _SOURCES.items():
+        if pin := config.ASSETS_SHA256.get(name):
+            file_path = _file_path(assets_dir, name, pin)
+        else:
+            file_path = assets_dir / manifest[url] if url in manifest else None
+
+        if file_path is not None and file_path.exists():
+            _register(name, file_path)
+        else:
+            missing[name] = url
+
+    if missing:
+        logging.info("Vendoring %s player assets into %s", len(missing), assets_dir)
+
+        timeout = aiohttp.ClientTimeout(total=config.ASSETS_DOWNLOAD_TIMEOUT_SECONDS)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            results = await asyncio.gather(*(_download(session, assets_dir, name, url) for name, url in missing.items()),
+                                           return_exceptions=True)
+
+        if errors := [result for result in results if isinstance(result, BaseException)]:
+            for error in errors:
+                logging.error("Failed to vendor a player asset: %s", error)
+            raise errors[0]
+
+        for (name, url), file_path in zip(missing.items(), results):
+            _register(name, file_path)
+            manifest[url] = file_path.name
+
+        async with aiofiles.open(manifest_path, "wb") as file:
+            await file.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+
+    logging.info("Player assets: %s", _urls)
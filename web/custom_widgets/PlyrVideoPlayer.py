@@ -1,21 +1,27 @@
+import time
 import uuid
+import weakref
 
-from nicegui import ui
+from nicegui import ui, Client
 
+from monitoring import metrics
+from movies.remux import HLS_MIME_TYPE
+from web.assets import asset_url
+
+_installed_clients: weakref.WeakSet[Client] = weakref.WeakSet()
 
-class PlyrVideoPlayer:
-    _plyr_installed = False
 
+class PlyrVideoPlayer:
     def __init__(self, src: str, poster_url: str = None, minimal: bool = False):
-        if not PlyrVideoPlayer._plyr_installed:
-            install_plyr()
-            PlyrVideoPlayer._plyr_installed = True
+        install_plyr()
 
         self.src = src
         self.poster_url = poster_url
 
         self.element_id = f"plyr_{uuid.uuid4().hex}"
         self.player_var = f"player_{self.element_id}"
+        self.hls_var = f"hls_{self.element_id}"
+        self.preload_id = f"preload_{self.element_id}"
         self.event_play = f"{self.element_id}_playing"
         self.event_pause = f"{self.element_id}_pause"
         self.event_end = f"{self.element_id}_ended"
@@ -35,6 +41,9 @@ class PlyrVideoPlayer:
         options = {}
         options.setdefault("settings", [])
         options.setdefault("ratio", "16:9")
+        # Plyr loads its icon sprite and a blank video from its CDN unless told otherwise
+        options.setdefault("iconUrl", asset_url("plyr.svg"))
+        options.setdefault("blankVideo", asset_url("blank.mp4"))
         if minimal:
             options.setdefault("controls",
                                ["play-large", "play", "current-time", "progress", "mute", "pip", "airplay", "download",
@@ -71,9 +80,20 @@ class PlyrVideoPlayer:
             raise ValueError("Supported events: 'play', 'pause', 'end', 'seeked'")
         ui.on(mapping[event], callback)
 
+    @staticmethod
+    async def _run_javascript(call: str, code: str):
+        start = time.perf_counter()
+        try:
+            result = await ui.run_javascript(code)
+        except TimeoutError:
+            metrics.JS_TIMEOUTS.inc(call=call)
+            raise
+        metrics.JS_ROUNDTRIP_SECONDS.observe(time.perf_counter() - start, call=call)
+        return result
+
     async def is_seeking(self) -> bool:
         try:
-            return await ui.run_javascript(f"window.{self.player_var}.seeking")
+            return await self._run_javascript("is_seeking", f"window.{self.player_var}.seeking")
         except TimeoutError:
             return False
 
@@ -86,32 +106,73 @@ class PlyrVideoPlayer:
     def seek(self, time: float):
         ui.run_javascript(f"window.{self.player_var}.currentTime = {time};")
 
-    def set_source(self, src: str, poster_url: str = "", type: str = 'video/mp4'):
+    def set_source(self, src: str, poster_url: str = "", type: str = 'video/mp4', preload: str = "metadata"):
+        poster_url = poster_url or ""
         self.src = src
         self.poster_url = poster_url
         ui.run_javascript(f"""
-            window.{self.player_var}.source = {{
-                type: 'video',
-                sources: [
-                    {{
-                        src: '{src}',
-                        type: '{type}',
-                    }},
-                ],
-                poster: '{poster_url}',
-            }};
+            const player = window.{self.player_var};
+            document.getElementById('{self.preload_id}')?.remove();
+            if (window.{self.hls_var}) {{
+                window.{self.hls_var}.destroy();
+                window.{self.hls_var} = null;
+            }}
+            player.media.preload = '{preload}';
+
+            // Browsers without native HLS play remuxed streams through hls.js
+            if ('{type}' === '{HLS_MIME_TYPE}' && window.Hls && Hls.isSupported()) {{
+                player.poster = '{poster_url}';
+                const hls = new Hls();
+                hls.loadSource('{src}');
+                hls.attachMedia(player.media);
+                window.{self.hls_var} = hls;
+            }} else {{
+                player.source = {{
+                    type: 'video',
+                    sources: [
+                        {{
+                            src: '{src}',
+                            type: '{type}',
+                        }},
+                    ],
+                    poster: '{poster_url}',
+                }};
+            }}
+        """)
+
+    def preload(self, src: str, type: str = 'video/mp4'):
+        ui.run_javascript(f"""
+            document.getElementById('{self.preload_id}')?.remove();
+            if ('{type}' === '{HLS_MIME_TYPE}') {{
+                // Requesting the playlist is enough for the server to start remuxing
+                fetch('{src}');
+            }} else {{
+                const video = document.createElement('video');
+                video.id = '{self.preload_id}';
+                video.preload = 'auto';
+                video.muted = true;
+                video.style.display = 'none';
+                video.src = '{src}';
+                document.body.appendChild(video);
+            }}
         """)
 
     async def get_current_position(self) -> float:
-        result = await ui.run_javascript(f"return window.{self.player_var}.currentTime;")
+        result = await self._run_javascript("current_position", f"return window.{self.player_var}.currentTime;")
         return float(result)
 
 
-def install_plyr(css: str = "https://cdn.plyr.io/3.7.8/plyr.css",
-                 js: str = "https://cdn.plyr.io/3.7.8/plyr.polyfilled.js"):
+def install_plyr():
+    # Both the room route and every player ask for the assets, but each page gets them only once
+    client = ui.context.client
+    if client in _installed_clients:
+        return
+    _installed_clients.add(client)
+
     ui.add_head_html(f'''
-        <link rel="stylesheet" href="{css}" />
-        <script src="{js}"></script>
+        <link rel="stylesheet" href="{asset_url("plyr.css")}" />
+        <script src="{asset_url("plyr.js")}"></script>
+        <script src="{asset_url("hls.js")}"></script>
         <style>
             .plyr-container {{
                 border-radius: 15px;
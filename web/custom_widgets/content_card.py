@@ -1,6 +1,7 @@
 from nicegui import ui
 
 import globals
+from movies.images import image_url
 from web.custom_widgets import ContentDialog
 
 
@@ -8,14 +9,14 @@ class ContentCard:
     def __init__(self, tmdb_id: int):
         self.content = globals.MOVIES_DATABASE.by_tmdb_id[tmdb_id]
 
-        self.dialog = ContentDialog(tmdb_id)
+        self.dialog = None
 
         self.card = ui.card()
         self.card.classes("no-shadow")
         self.card.style("margin: 0; padding: 6px; border-radius: 20px")
 
         with self.card:
-            self.poster_image = ui.image(source=self.content.poster_url)
+            self.poster_image = ui.image(source=image_url(self.content.poster_path, "w342"))
             self.poster_image.style("width: 200px; height: 100%; border-radius: 15px")
 
         with self.poster_image:
@@ -45,4 +46,7 @@ class ContentCard:
         self.card.style("transform: scale(1.0)")
 
     def on_card_click(self):
+        if self.dialog is None:
+            with self.card:
+                self.dialog = ContentDialog(self.content.tmdb_id)
         self.dialog.open()
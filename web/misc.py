@@ -1,9 +1,33 @@
+import orjson
 from nicegui import ui, app
 
 import config
 import globals
 from users.classes import User
 
+_VIEWPORT_EVENT = "viewport"
+
+# Layouts switch to a single column in portrait on their own, the server only needs the orientation for details
+_VIEWPORT_CSS = """
+    <style>
+        @media (orientation: portrait) {
+            .portrait-column {
+                flex-direction: column !important;
+                flex-wrap: nowrap !important;
+                width: 100% !important;
+            }
+            .portrait-full {
+                width: 100% !important;
+                min-height: 0 !important;
+            }
+            .portrait-short {
+                max-height: 20vh !important;
+                min-height: 0 !important;
+            }
+        }
+    </style>
+"""
+
 
 def convert_runtime(total_minutes: int) -> str:
     hours = total_minutes // 60
@@ -53,16 +77,26 @@ async def update_user():
 
 async def default_page_setup():
     ui.add_head_html("<meta name=\"referrer\" content=\"no-referrer\" />")
+    ui.add_head_html(_VIEWPORT_CSS)
     await ui.context.client.connected(timeout=config.CONNECTION_TIMEOUT_SECONDS)
+    track_viewport()
     ui.timer(60, update_user)
 
 
-async def is_portrait():
-    try:
-        width, height = await ui.run_javascript("return [window.screen.availWidth, window.screen.availHeight]")
-    except TimeoutError:
-        return False
+def _on_viewport(e):
+    app.storage.user["portrait"] = bool(e.args)
+
+
+def track_viewport():
+    # The browser only reports an orientation the server doesn't know yet, and then every change of it
+    known = orjson.dumps(app.storage.user.get("portrait")).decode()
+    ui.on(_VIEWPORT_EVENT, _on_viewport)
+    ui.run_javascript(f"""
+        const query = window.matchMedia('(orientation: portrait)');
+        if (query.matches !== {known}) emitEvent('{_VIEWPORT_EVENT}', query.matches);
+        query.addEventListener('change', e => emitEvent('{_VIEWPORT_EVENT}', e.matches));
+    """)
+
 
-    if width > height:
-        return False
-    return True
+def is_portrait() -> bool:
+    return app.storage.user.get("portrait", False)
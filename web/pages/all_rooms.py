@@ -1,10 +1,45 @@
 import asyncio
+from functools import partial
 
 from nicegui import ui
 
 import globals
+from movies.images import image_url
+from rooms.room import Room
 from web.custom_widgets import draw_header
-from web.misc import check_user, is_portrait
+from web.misc import check_user
+
+
+def _members_text(room: Room) -> str:
+    users = [globals.USERS_DATABASE.by_uid[uid] for uid in room.connected_users]
+    return f"<i>{", ".join(u.username for u in users)}</i>"
+
+
+def _draw_room(container: ui.element, rooms_data: dict, room: Room):
+    with (container, ui.link(target=f"/room/{room.uid}").style("text-decoration: none") as link,
+          ui.card().classes("no-shadow").style("border-radius: 15px;")):
+        content = globals.MOVIES_DATABASE.by_tmdb_id[room.tmdb_id]
+
+        with ui.row(wrap=False):
+            ui.image(image_url(content.poster_path, "w185")).style("width: 100px; border-radius: 15px")
+
+            with ui.column(wrap=False).style("gap: 0px;"):
+                ui.html(f"{room.uid}", sanitize=False)
+                ui.html(f"<b>{content.title}</b>", sanitize=False)
+
+                members = ui.html(_members_text(room), sanitize=False)
+
+    rooms_data[room.uid] = (link, members)
+
+
+def _on_room_deleted(rooms_data: dict, uid: str):
+    if (drawn := rooms_data.pop(uid, None)) is not None:
+        drawn[0].delete()
+
+
+def _on_members_changed(rooms_data: dict, room: Room):
+    if (drawn := rooms_data.get(room.uid)) is not None:
+        drawn[1].set_content(_members_text(room))
 
 
 async def page():
@@ -18,26 +53,15 @@ async def page():
         await asyncio.sleep(1)
         ui.navigate.to("/contents")
 
-    portrait = await is_portrait()
-
     await draw_header()
 
-    if portrait:
-        container = ui.column().classes("w-full items-center")
-    else:
-        container = ui.row().classes("w-full items-center")
+    container = ui.row().classes("w-full items-center portrait-column")
 
+    # Cards of the rooms on the page, so that changes only touch the room they are about
+    rooms_data = {}
     for room in rooms:
-        with (container, ui.link(target=f"/room/{room.uid}").style("text-decoration: none"),
-              ui.card().classes("no-shadow").style("border-radius: 15px;")):
-            content = globals.MOVIES_DATABASE.by_tmdb_id[room.tmdb_id]
-
-            with ui.row(wrap=False):
-                ui.image(content.poster_url).style("width: 100px; border-radius: 15px")
-
-                with ui.column(wrap=False).style("gap: 0px;"):
-                    ui.html(f"{room.uid}", sanitize=False)
-                    ui.html(f"<b>{content.title}</b>", sanitize=False)
+        _draw_room(container, rooms_data, room)
 
-                    users = [globals.USERS_DATABASE.by_uid[uid] for uid in room.connected_users]
-                    ui.html(f"<i>{", ".join(u.username for u in users)}</i>", sanitize=False)
+    globals.ROOMS_DATABASE.room_created.subscribe(partial(_draw_room, container, rooms_data))
+    globals.ROOMS_DATABASE.room_deleted.subscribe(partial(_on_room_deleted, rooms_data))
+    globals.ROOMS_DATABASE.members_changed.subscribe(partial(_on_members_changed, rooms_data))
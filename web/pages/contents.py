@@ -1,8 +1,110 @@
+from functools import partial
+
 from nicegui import ui
 
+import config
 import globals
 from web.custom_widgets import draw_header, ContentCard
-from web.misc import check_user, is_portrait
+from web.misc import check_user
+
+_LOAD_MORE_EVENT = "contents_load_more"
+
+_SCROLL_LISTENER_JS = f"""
+    window.contentsLoading = false;
+    window.checkContentsScroll = () => {{
+        const remaining = document.body.offsetHeight - (window.innerHeight + window.scrollY);
+        if (!window.contentsLoading && remaining < window.innerHeight) {{
+            window.contentsLoading = true;
+            emitEvent('{_LOAD_MORE_EVENT}');
+        }}
+    }};
+    window.contentsLoaded = () => {{
+        window.contentsLoading = false;
+        requestAnimationFrame(window.checkContentsScroll);
+    }};
+    window.addEventListener('scroll', window.checkContentsScroll, {{passive: true}});
+    window.addEventListener('resize', window.checkContentsScroll, {{passive: true}});
+"""
+
+
+def _draw_next_page(container: ui.element, grid_data: dict):
+    contents = grid_data["contents"]
+    start = grid_data["rendered"]
+    end = min(start + config.CONTENTS_PAGE_SIZE, len(contents))
+
+    with container:
+        for content in contents[start:end]:
+            grid_data["cards"][content.tmdb_id] = ContentCard(content.tmdb_id)
+    grid_data["rendered"] = end
+
+    if end < len(contents):
+        ui.run_javascript("window.contentsLoaded();")
+
+
+def _find_contents(query: str) -> list:
+    if query:
+        return globals.MOVIES_DATABASE.search(query)
+    return globals.MOVIES_DATABASE.contents
+
+
+def _draw_contents(container: ui.element, grid_data: dict, query: str):
+    container.clear()
+
+    grid_data["query"] = query.strip()
+    grid_data["contents"] = _find_contents(grid_data["query"])
+    grid_data["cards"] = {}
+    grid_data["rendered"] = 0
+
+    if not grid_data["contents"]:
+        with container:
+            ui.label("Nothing found").classes("text-lg")
+        return
+
+    _draw_next_page(container, grid_data)
+
+
+def _on_contents_changed(container: ui.element, grid_data: dict, added: list[int], removed: list[int],
+                         changed: list[int]):
+    if not grid_data["cards"]:
+        _draw_contents(container, grid_data, grid_data["query"])
+        return
+
+    contents = _find_contents(grid_data["query"])
+    cards = grid_data["cards"]
+    rendered = grid_data["rendered"]
+
+    # Only cards of added, removed and changed titles are touched, the rest of the grid stays as it is
+    rendered += sum(content.tmdb_id not in cards for content in contents[:rendered])
+    rendered -= sum(tmdb_id in cards for tmdb_id in removed)
+    rendered = max(0, min(rendered, len(contents)))
+
+    stale = set(changed)
+    shown = {content.tmdb_id for content in contents[:rendered]}
+    for tmdb_id in [tmdb_id for tmdb_id in cards if tmdb_id not in shown or tmdb_id in stale]:
+        cards.pop(tmdb_id).card.delete()
+
+    with container:
+        for content in contents[:rendered]:
+            if content.tmdb_id not in cards:
+                cards[content.tmdb_id] = ContentCard(content.tmdb_id)
+
+    children = list(container.default_slot.children)
+    for index, content in enumerate(contents[:rendered]):
+        element = cards[content.tmdb_id].card
+        if children[index] is not element:
+            element.move(target_index=index)
+            children.remove(element)
+            children.insert(index, element)
+
+    grid_data["contents"] = contents
+    grid_data["rendered"] = rendered
+    if rendered < len(contents):
+        ui.run_javascript("window.contentsLoaded();")
+
+
+def _on_load_more(container: ui.element, grid_data: dict):
+    if grid_data["rendered"] < len(grid_data["contents"]):
+        _draw_next_page(container, grid_data)
 
 
 async def page():
@@ -11,15 +113,25 @@ async def page():
     if not await check_user():
         ui.navigate.to("/")
 
-    portrait = await is_portrait()
-
     await draw_header()
 
-    if portrait:
-        container = ui.column(wrap=False).classes("w-full items-center").style("margin: auto; gap: auto;")
-    else:
-        container = ui.row().classes("items-center").style("margin: auto; gap: auto;")
+    with ui.row(wrap=False).classes("w-full justify-center"):
+        search_input = ui.input(placeholder="Search by title, genre or year")
+        search_input.props("dense outlined rounded clearable debounce=300")
+        search_input.style("width: 100%; max-width: 600px;")
 
-    with container:
-        for content in globals.MOVIES_DATABASE.contents:
-            ContentCard(content.tmdb_id)
+    container = ui.row().classes("items-center portrait-column").style("margin: auto; gap: auto;")
+
+    grid_data = {
+        "query": "",
+        "contents": [],
+        "cards": {},
+        "rendered": 0
+    }
+
+    search_input.on_value_change(lambda e: _draw_contents(container, grid_data, e.value or ""))
+    ui.on(_LOAD_MORE_EVENT, partial(_on_load_more, container, grid_data))
+    ui.run_javascript(_SCROLL_LISTENER_JS)
+
+    _draw_contents(container, grid_data, "")
+    globals.MOVIES_DATABASE.contents_changed.subscribe(partial(_on_contents_changed, container, grid_data))
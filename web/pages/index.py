@@ -2,14 +2,16 @@ from nicegui import ui, app
 
 import config
 import globals
+from monitoring import metrics
 from users.utils import generate_token
-from web.misc import check_user
+from web.misc import check_user, track_viewport
 
 
 async def page():
     ui.page_title("Watch With Friends")
 
     await ui.context.client.connected()
+    track_viewport()
 
     if not await check_user():
         await handle_login()
@@ -23,6 +25,7 @@ async def handle_login():
         password = password_input.value.strip()
 
         if password != config.PASSWORD:
+            metrics.LOGINS.inc(outcome="wrong_password")
             ui.notify("Incorrect password!", type="negative", position="top")
             return
 
@@ -30,9 +33,11 @@ async def handle_login():
         token = generate_token(new_user)
 
         if token:
+            metrics.LOGINS.inc(outcome="success")
             app.storage.user["token"] = token
             dialog.close()
         else:
+            metrics.LOGINS.inc(outcome="error")
             ui.notify("Something went wrong!", type="negative", position="top")
 
     with ui.dialog().props("persistent") as dialog, ui.card():
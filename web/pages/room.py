@@ -1,11 +1,19 @@
 import asyncio
 import logging
+from datetime import datetime, timedelta
 from functools import partial
 
 from nicegui import ui
 
 import config
 import globals
+from monitoring import metrics
+from movies.classes import MediaInfo
+from movies.images import image_url
+from movies.media_probe import preload_hint
+from movies.remux import should_remux, stream_id, stream_url, HLS_MIME_TYPE
+from rooms import sync
+from rooms.room import Room
 from rooms.state import PlayerState
 from web.custom_widgets import PlyrVideoPlayer
 from web.custom_widgets.header import draw_header
@@ -29,42 +37,83 @@ async def _join_room(room_uid: str, user_uid: str):
         ui.navigate.to("/rooms")
         return
 
-    globals.ROOMS_DATABASE.by_uid[room_uid].connected_users.append(user_uid)
+    globals.ROOMS_DATABASE.add_member(room_uid, user_uid)
 
     logging.info(f"{user_uid} joined room {room_uid}")
 
 
 def _leave_room(room_uid: str, user_uid: str):
-    if user_uid in globals.ROOMS_DATABASE.by_uid[room_uid].connected_users:
-        globals.ROOMS_DATABASE.by_uid[room_uid].connected_users.remove(user_uid)
+    if globals.ROOMS_DATABASE.remove_member(room_uid, user_uid):
         logging.info(f"{user_uid} left room {room_uid}")
 
 
-def _change_episode(room_uid: str, tmdb_id: int, season_number: int, episode_number: int, seasons_column: ui.column,
-                    video_player: PlyrVideoPlayer, player_data: dict):
-    try:
-        new_episode = globals.MOVIES_DATABASE.by_tmdb_id[tmdb_id].seasons[season_number - 1].episodes[
-            episode_number - 1]
-    except KeyError:
+def _notify_slow_start(media: MediaInfo | None):
+    if media is not None and media.fast_start is False:
+        ui.notify("This file is not optimized for streaming, starting and seeking may take longer", type="warning")
+
+
+def _video_source(tmdb_id: int, season_number: int | None = None, episode_number: int | None = None) -> tuple[str, str]:
+    file = globals.MOVIES_DATABASE.get_file(tmdb_id, season_number, episode_number)
+    if file is None or file.file_url is None:
+        return "", "video/mp4"
+
+    if globals.REMUX_CACHE is not None and should_remux(file.media):
+        return stream_url(stream_id(tmdb_id, season_number, episode_number)), HLS_MIME_TYPE
+    return file.file_url, "video/mp4"
+
+
+def _load_episode(room_uid: str, tmdb_id: int, season_number: int, episode_number: int, seasons_column: ui.column,
+                  video_player: PlyrVideoPlayer, player_data: dict):
+    new_episode = globals.MOVIES_DATABASE.get_file(tmdb_id, season_number, episode_number)
+    if new_episode is None:
         ui.notify("Episode not found", type="negative")
         return
 
-    room = globals.ROOMS_DATABASE.by_uid[room_uid]
-    room.current_season, room.current_episode = season_number, episode_number
-    room.player_position = 0
-    room.player_state = PlayerState.PAUSED
     player_data["season"], player_data["episode"] = season_number, episode_number
     player_data["position"] = 0
+    # The next sync starts playback if the room is already playing the new episode
+    player_data["state"] = PlayerState.PAUSED
     video_player.pause()
     video_player.seek(0)
 
     video_player.pause()
-    video_player.set_source(new_episode.file_url, new_episode.still_url)
+    video, video_type = _video_source(tmdb_id, season_number, episode_number)
+    video_player.set_source(video, image_url(new_episode.still_path), video_type,
+                            preload=preload_hint(new_episode.media))
+    if video_type != HLS_MIME_TYPE:
+        _notify_slow_start(new_episode.media)
 
     seasons_column.clear()
     _draw_seasons(room_uid, tmdb_id, seasons_column, video_player, player_data)
 
 
+def _change_episode(room_uid: str, tmdb_id: int, season_number: int, episode_number: int, seasons_column: ui.column,
+                    video_player: PlyrVideoPlayer, player_data: dict):
+    if globals.MOVIES_DATABASE.get_file(tmdb_id, season_number, episode_number) is None:
+        ui.notify("Episode not found", type="negative")
+        return
+
+    globals.ROOMS_DATABASE.by_uid[room_uid].change_episode(season_number, episode_number)
+    _load_episode(room_uid, tmdb_id, season_number, episode_number, seasons_column, video_player, player_data)
+
+
+def _preload_next_episode(room_uid: str, tmdb_id: int, video_player: PlyrVideoPlayer, player_data: dict):
+    room = globals.ROOMS_DATABASE.by_uid[room_uid]
+    if (file := room.current_file()) is None or room.current_episode is None:
+        return
+
+    # The probed duration is exact, TMDB runtime is only a fallback for files that were not probed yet
+    duration = room.duration or (file.runtime * 60 if file.runtime else None)
+    if duration is None or duration - player_data["position"] > config.ROOMS_PRELOAD_NEXT_EPISODE_SECONDS:
+        return
+
+    if (next_episode := room.next_episode) is None or player_data["preloaded"] == next_episode:
+        return
+
+    player_data["preloaded"] = next_episode
+    video_player.preload(*_video_source(tmdb_id, *next_episode))
+
+
 def _draw_users_list(room_uid: str, users_scroll_area: ui.scroll_area, room_data: dict):
     room = globals.ROOMS_DATABASE.by_uid[room_uid]
 
@@ -80,6 +129,11 @@ def _draw_users_list(room_uid: str, users_scroll_area: ui.scroll_area, room_data
                 ui.label(user.username)
 
 
+def _on_members_changed(room_uid: str, users_scroll_area: ui.scroll_area, room_data: dict, room: Room):
+    if room.uid == room_uid:
+        _draw_users_list(room_uid, users_scroll_area, room_data)
+
+
 def _draw_messages(room_uid: str, current_user_uid: str, messages_scroll_area: ui.scroll_area, scroll_position: dict,
                    room_data: dict):
     room = globals.ROOMS_DATABASE.by_uid[room_uid]
@@ -143,41 +197,69 @@ async def _on_pause(room_uid: str, player_data: dict):
 
 async def _on_stop(room_uid: str, video_player: PlyrVideoPlayer, player_data: dict):
     room = globals.ROOMS_DATABASE.by_uid[room_uid]
+
+    # Every client reports the end of the episode, the reports for an episode the room already left are stale
+    if (player_data["season"], player_data["episode"]) != (room.current_season, room.current_episode):
+        return
+
+    if room.auto_advance and room.advance():
+        return
+
     room.stop()
     player_data["state"] = PlayerState.STOPPED
     video_player.pause()
 
 
+def _on_visibility(player_data: dict, e):
+    # The first sync after a tab comes back catches up at once
+    player_data["hidden"] = not e.args
+    player_data["next_sync"] = datetime.min
+
+
 async def _sync(room_uid: str, tmdb_id: int, seasons_column: ui.column, video_player: PlyrVideoPlayer,
-                player_data: dict):
+                player_data: dict, sync_timer: ui.timer):
+    room = globals.ROOMS_DATABASE.by_uid[room_uid]
+    last_change = room.last_change
+    # Until the next sync is due only a change of the room is worth a round trip to the browser
+    if last_change == player_data["last_change"] and room.clock() < player_data["next_sync"]:
+        return
+
     try:
         player_data["position"] = await video_player.get_current_position()
     except TimeoutError:
         return
-    room = globals.ROOMS_DATABASE.by_uid[room_uid]
+    seeking = await video_player.is_seeking()
+
+    now = room.clock()
+    decision = sync.decide(player_data["state"], player_data["position"], seeking, player_data["hidden"],
+                           room.player_state, room.player_position, (now - last_change).total_seconds())
 
-    if player_data["state"] != room.player_state:
-        match room.player_state:
-            case PlayerState.PLAYING:
-                video_player.play()
-                player_data["state"] = PlayerState.PLAYING
-            case PlayerState.PAUSED:
-                video_player.pause()
-                player_data["state"] = PlayerState.PAUSED
-            case PlayerState.STOPPED:
-                video_player.pause()
-                player_data["state"] = PlayerState.STOPPED
-
-    if not await video_player.is_seeking():
-        if (player_data["state"] != PlayerState.PLAYING
-                or abs(player_data["position"] - room.player_position) > config.MAX_DELAY_SECONDS):
-            video_player.seek(room.player_position)
-            player_data["position"] = room.player_position
+    if decision.state is not None:
+        if decision.state == PlayerState.PLAYING:
+            video_player.play()
+        else:
+            video_player.pause()
+        player_data["state"] = decision.state
+
+    if room.player_state == PlayerState.PLAYING and not player_data["hidden"]:
+        metrics.SYNC_DRIFT_SECONDS.observe(decision.drift)
+        metrics.ROOM_SYNC_DRIFT_SECONDS.set(decision.drift, room=room_uid)
+
+    if decision.seek_reason is not None:
+        metrics.SYNC_SEEKS.inc(reason=decision.seek_reason)
+        video_player.seek(room.player_position)
+        player_data["position"] = room.player_position
+
+    player_data["last_change"] = last_change
+    player_data["next_sync"] = now + timedelta(seconds=decision.interval)
+    # Idle clients still tick at the normal rate, so that a change of the room reaches them just as fast
+    sync_timer.interval = min(decision.interval, config.SYNC_INTERVAL_SECONDS)
 
     if player_data["season"] != room.current_season or player_data["episode"] != room.current_episode:
-        player_data["season"], player_data["episode"] = room.current_season, room.current_episode
-        _change_episode(room_uid, tmdb_id, room.current_season, room.current_episode, seasons_column, video_player,
-                        player_data)
+        _load_episode(room_uid, tmdb_id, room.current_season, room.current_episode, seasons_column, video_player,
+                      player_data)
+    else:
+        _preload_next_episode(room_uid, tmdb_id, video_player, player_data)
 
 
 async def page(room_uid: str):
@@ -190,8 +272,6 @@ async def page(room_uid: str):
         ui.navigate.to("/")
         return
 
-    portrait = await is_portrait()
-
     await draw_header()
 
     await _join_room(room_uid, user.uid)
@@ -200,7 +280,11 @@ async def page(room_uid: str):
         "state": PlayerState.PAUSED,
         "position": 0,
         "season": None,
-        "episode": None
+        "episode": None,
+        "preloaded": None,
+        "last_change": None,
+        "next_sync": datetime.min,
+        "hidden": False
     }
 
     room_data = {
@@ -208,44 +292,31 @@ async def page(room_uid: str):
         "members_hash": ""
     }
 
-    with ui.column(wrap=False).classes("w-full") if portrait else ui.row(wrap=False).classes("w-full items-stretch"):
+    with ui.row(wrap=False).classes("w-full items-stretch portrait-column"):
         player_card = ui.card()
-        player_card.classes("no-shadow items-center")
-        player_card.style("border-radius: 15px")
-        if portrait:
-            player_card.style("width: 100%;")
-        else:
-            player_card.style("width: 80%; min-height: 80vh;")
+        player_card.classes("no-shadow items-center portrait-full")
+        player_card.style("border-radius: 15px; width: 80%; min-height: 80vh;")
 
         with ui.column(wrap=False) as column:
-            if portrait:
-                column.classes("w-full")
-            else:
-                column.classes("grow")
-                column.style("width: 20%;")
+            column.classes("grow portrait-full")
+            column.style("width: 20%;")
 
             users_card = ui.card()
-            users_card.classes("w-full grow no-shadow")
-            users_card.style("border-radius: 15px; gap: 0px;")
-            if portrait:
-                users_card.style("max-height: 20vh;")
-            else:
-                users_card.style("min-height: 39vh;")
+            users_card.classes("w-full grow no-shadow portrait-short")
+            users_card.style("border-radius: 15px; gap: 0px; min-height: 39vh;")
 
             with users_card.classes("justify-between"):
                 ui.label("Members").classes("text-lg font-bold q-mb-md")
 
                 messages_scroll_area = ui.scroll_area().classes("w-full")
 
-            ui.timer(0.1, partial(_draw_users_list, room_uid, messages_scroll_area, room_data))
+            _draw_users_list(room_uid, messages_scroll_area, room_data)
+            globals.ROOMS_DATABASE.members_changed.subscribe(
+                partial(_on_members_changed, room_uid, messages_scroll_area, room_data))
 
             messages_card = ui.card()
-            messages_card.classes("w-full grow no-shadow")
-            messages_card.style("border-radius: 15px; gap: 0px;")
-            if portrait:
-                messages_card.style("max-height: 20vh;")
-            else:
-                messages_card.style("min-height: 39vh;")
+            messages_card.classes("w-full grow no-shadow portrait-short")
+            messages_card.style("border-radius: 15px; gap: 0px; min-height: 39vh;")
 
             with messages_card.classes("justify-between"):
                 ui.label("Chat").classes("text-lg font-bold q-mb-md")
@@ -273,13 +344,17 @@ async def page(room_uid: str):
                                   room_data))
 
     with player_card:
-        video_player = PlyrVideoPlayer(src="", poster_url="", minimal=portrait)
+        video_player = PlyrVideoPlayer(src="", poster_url="", minimal=is_portrait())
 
         video_player.on("play", partial(_on_play, room_uid, player_data))
         video_player.on("pause", partial(_on_pause, room_uid, player_data))
         video_player.on("seeked", partial(_on_seeked, room_uid, video_player, player_data))
         video_player.on("end", partial(_on_stop, room_uid, video_player, player_data))
 
+    auto_advance_switch = ui.switch("Play next episode automatically")
+    auto_advance_switch.bind_value(globals.ROOMS_DATABASE.by_uid[room_uid], "auto_advance")
+    auto_advance_switch.visible = False
+
     seasons_column = ui.column().classes("w-full")
     seasons_column.visible = False
 
@@ -289,25 +364,39 @@ async def page(room_uid: str):
     ui.page_title(content.title)
 
     if content.type == "movie":
-        video = content.file_url
-        poster = content.backdrop_url
+        video, video_type = _video_source(tmdb_id)
+        poster = image_url(content.backdrop_path, "w1280")
+        media = content.media
     elif content.type == "tv":
-        video = content.seasons[0].episodes[0].file_url
-        poster = content.seasons[0].episodes[0].still_url
-
+        # Late joiners start on the episode the room is already watching
         room = globals.ROOMS_DATABASE.by_uid[room_uid]
-        room.current_season, room.current_episode = 1, 1
-        player_data["season"], player_data["episode"] = 1, 1
+        episode = room.current_file()
+        video, video_type = _video_source(tmdb_id, room.current_season, room.current_episode)
+        poster = image_url(episode.still_path) if episode else ""
+        media = episode.media if episode else None
+        player_data["season"], player_data["episode"] = room.current_season, room.current_episode
 
+        auto_advance_switch.visible = True
         seasons_column.visible = True
         _draw_seasons(room_uid, tmdb_id, seasons_column, video_player, player_data)
     else:
-        video = ""
+        video, video_type = "", "video/mp4"
         poster = ""
+        media = None
+
+    video_player.set_source(video, poster, video_type, preload=preload_hint(media))
+    if video_type != HLS_MIME_TYPE:
+        _notify_slow_start(media)
+
+    async def sync_player():
+        await _sync(room_uid, tmdb_id, seasons_column, video_player, player_data, sync_timer)
 
-    video_player.set_source(video, poster)
+    sync_timer = ui.timer(config.SYNC_INTERVAL_SECONDS, sync_player)
 
-    ui.timer(1, partial(_sync, room_uid, tmdb_id, seasons_column, video_player, player_data))
+    ui.on("room_visibility", partial(_on_visibility, player_data))
+    ui.run_javascript("""
+        document.addEventListener('visibilitychange', () => emitEvent('room_visibility', !document.hidden));
+    """)
 
     await ui.context.client.disconnected()
 
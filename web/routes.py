@@ -1,9 +1,35 @@
-from nicegui import ui
+import asyncio
+import hmac
+import logging
 
+import aiohttp
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse
+from nicegui import ui, app
+
+import config
+import globals
+from monitoring.metrics import REGISTRY
+from monitoring.profiler import PROFILER, collapsed, top
+from movies.images import IMAGES_ROUTE
+from movies.remux import (REMUX_ROUTE, HLS_MIME_TYPE, PLAYLIST_NAME, RemuxBusyError, RemuxCache, parse_stream_id,
+                          should_remux)
+from web.assets import ASSETS_ROUTE, get_file
 from web.custom_widgets.PlyrVideoPlayer import install_plyr
-from web.misc import default_page_setup
+from web.misc import check_user, default_page_setup
 from web.pages import index_page, movies_page, rooms_page, room_page
 
+_IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_REMUX_SEGMENT_CACHE_CONTROL = "private, max-age=86400"
+
+
+def _is_admin(request: Request) -> bool:
+    if not config.ADMIN_TOKEN:
+        return False
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode())
+
 
 @ui.page("/")
 async def index():
@@ -27,3 +53,94 @@ async def room(room_uid: str):
     install_plyr()
     await default_page_setup()
     await room_page.page(room_uid)
+
+
+@app.get(IMAGES_ROUTE + "/{size}/{name}")
+async def image(size: str, name: str, request: Request):
+    if not globals.IMAGE_CACHE.is_valid(size, name) or name not in globals.MOVIES_DATABASE.image_names:
+        return Response(status_code=404)
+
+    # TMDB image paths are content-addressed, so the name and size identify the bytes
+    etag = f"\"{size}-{name}\""
+    headers = {"Cache-Control": _IMAGE_CACHE_CONTROL, "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        file_path = await globals.IMAGE_CACHE.get(size, name)
+    except aiohttp.ClientResponseError as e:
+        logging.warning("Failed to fetch image %s/%s: Status %s", size, name, e.status)
+        return Response(status_code=404 if e.status == 404 else 502)
+    except aiohttp.ClientError as e:
+        logging.warning("Failed to fetch image %s/%s: %s", size, name, e)
+        return Response(status_code=502)
+
+    return FileResponse(file_path, headers=headers)
+
+
+@app.get(REMUX_ROUTE + "/{stream_id}/{name}")
+async def remuxed_stream(stream_id: str, name: str):
+    if globals.REMUX_CACHE is None or not RemuxCache.is_valid(stream_id, name):
+        return Response(status_code=404)
+    if not await check_user():
+        return Response(status_code=401)
+
+    # Only files the room page would stream remuxed may start ffmpeg
+    file = globals.MOVIES_DATABASE.get_file(*parse_stream_id(stream_id))
+    if file is None or file.file_url is None or not should_remux(file.media):
+        return Response(status_code=404)
+
+    try:
+        file_path = await globals.REMUX_CACHE.get(stream_id, name, file.file_url, file.file_size)
+    except RemuxBusyError as e:
+        logging.warning("Refusing to remux %s: %s", stream_id, e)
+        return Response(status_code=503, headers={"Retry-After": str(config.REMUX_WAIT_TIMEOUT_SECONDS)})
+    except FileNotFoundError:
+        return Response(status_code=404)
+
+    # The playlist grows while ffmpeg is still remuxing, segments never change once written
+    if name == PLAYLIST_NAME:
+        return FileResponse(file_path, media_type=HLS_MIME_TYPE, headers={"Cache-Control": "no-cache"})
+    return FileResponse(file_path, media_type="video/mp4", headers={"Cache-Control": _REMUX_SEGMENT_CACHE_CONTROL})
+
+
+@app.get(ASSETS_ROUTE + "/{name}")
+async def asset(name: str):
+    if (file_path := get_file(name)) is None:
+        return Response(status_code=404)
+
+    # Asset names carry a hash of their content, so a name never points to different bytes
+    return FileResponse(file_path, headers={"Cache-Control": _ASSET_CACHE_CONTROL})
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    # Like the /admin routes, metrics are only served once there is a token to scrape them with
+    if not config.ENABLE_METRICS or not config.ADMIN_TOKEN:
+        return Response(status_code=404)
+    if not _is_admin(request):
+        return Response(status_code=401)
+
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/profile")
+async def admin_profile(request: Request, seconds: float = 10, interval_ms: float = 5, format: str = "collapsed",
+                        limit: int = 40):
+    if not _is_admin(request):
+        return Response(status_code=401)
+    if format not in ("collapsed", "top"):
+        return Response(status_code=400)
+    if PROFILER.running:
+        return Response(status_code=409)
+
+    seconds = min(max(seconds, 0.1), config.ADMIN_PROFILE_MAX_SECONDS)
+    logging.info("Profiling the server for %s seconds", seconds)
+
+    # Sampling happens in a worker thread, so the event loop being profiled keeps running as usual
+    try:
+        stacks = await asyncio.to_thread(PROFILER.sample, seconds, max(interval_ms, 1) / 1000)
+    except RuntimeError:
+        return Response(status_code=409)
+
+    return PlainTextResponse(collapsed(stacks) if format == "collapsed" else top(stacks, limit))